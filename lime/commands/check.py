@@ -31,10 +31,12 @@ from lime.common.inference.api_openai import (
 )
 from lime.common.inference.local_llama_cpp import (
     LocalModelFns,
+    LocalModelInitParams,
     CppInference,
 )
 from lime.common.inference.cpl_client import (
     CplClientParams,
+    CplClientConnection,
     CPLModelObj,
 )
 from lime.common.inference.cpl_server import (
@@ -164,6 +166,9 @@ def main(args):
     }
     print(fmt_grid(d_modelfns))
 
+    print('\n#### LocalModelInitParams')
+    print(fmt_grid(get_settings(LocalModelInitParams)))
+
     ### InferenceParams:
     msg = '\n### InferenceParams'
     print(msg)
@@ -183,6 +188,8 @@ def main(args):
         print(fmt_grid(get_settings(CplServerParams)))
         print('#### CplClientParams')
         print(fmt_grid(get_settings(CplClientParams)))
+        print('#### CplClientConnection')
+        print(fmt_grid(get_settings(CplClientConnection)))
 
         print('#### Custom Cpl Models')
         d_modelfns = {
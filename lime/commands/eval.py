@@ -1,16 +1,35 @@
 import os, time, uuid, sys, glob
+import signal
+import asyncio
 from datetime import datetime
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+    as_completed,
+)
 from typing import (
     Union, 
     Any,
     List,
+    Dict,
+    Tuple,
+    Iterator,
+    AsyncIterator,
 )
 from lime.common.controllers.parse import (
     parse_to_obj,
+    parse_sheets,
     extract_gen_params,
 )
+from lime.common.controllers.journal import (
+    CheckpointJournal,
+    read_journal,
+    compact_journal,
+    write_journal,
+)
 from lime.common.models.internal import (
     SheetSchema,
+    QuestionSchema,
     HeaderOutput,
     QuestionOutput,
     SheetOutputSchema,
@@ -26,6 +45,20 @@ from lime.common.views.msg.eval import (
 from lime.common.grading.base import (
     grade_answer,
 )
+from lime.common.grading.early_stop import (
+    StopPredicate,
+    get_stop_predicate,
+)
+from lime.common.cache.completion import (
+    CompletionCache,
+    CompletionCacheParams,
+)
+from lime.common.cache.parsed_sheet import (
+    get_parse_cache,
+)
+from lime.common.inference.local_llama_cpp import (
+    share_cpus,
+)
 from lime.common.inference.interface import (
     get_infer_obj,
     ModelObjVariant,
@@ -47,21 +80,430 @@ class ExecSettings(ConfigLoader):
     output_sheet_prefix = 'output'
     use_prompt_cache = True     #TODO - move
     save_tmp_file = False
+    tmp_fsync_every = 0
+    concurrency = 1
+    use_async = False
+    jobs = 1
+    parse_jobs = None
 
 ExecSettings._initialize()
 
 
-def eval_sheet(
-    sheet_obj:      SheetSchema,
+class PromptTimer:
+    '''
+        Passed to prompt_model as its progress_cb: times the streamed 
+        chunks of a completion and forwards their text to on_text.
+        With a stop_fn, returns True (the backend stops generating) 
+        once stop_fn is satisfied by the text streamed so far.
+    '''
+    def __init__(
+            self, 
+            on_text: callable = None,
+            stop_fn: StopPredicate = None,
+        ) -> None:
+        self.on_text = on_text
+        self.stop_fn = stop_fn
+        self.reset()
+
+    def reset(self) -> None:
+        '''start over, for a retry of the prompt (see RateLimiter.call)'''
+        self.text : str = ''
+        self.stopped : bool = False
+        self.t_start : float = time.time()
+        self.t_first : Union[float, None] = None
+        self.t_end : Union[float, None] = None
+        self.n_chunks : int = 0
+
+    def __call__(self, text: str) -> bool:
+        if self.t_first is None:
+            self.t_first = time.time()
+        self.n_chunks += 1
+        if self.on_text is not None:
+            self.on_text(text)
+        if self.stop_fn is not None:
+            self.text += text
+            self.stopped = self.stop_fn(self.text)
+        return self.stopped
+
+    def stop(self) -> None:
+        self.t_end = time.time()
+
+    def ttft(self) -> Union[float, None]:
+        '''secs to the first streamed chunk'''
+        if self.t_first is None:
+            return None
+        return self.t_first - self.t_start
+
+    def gen_time(self) -> Union[float, None]:
+        '''secs from the first to the last chunk, if streamed in pieces'''
+        if (self.n_chunks < 2) or (self.t_end is None):
+            return None
+        return self.t_end - self.t_first
+
+
+def build_question_output(
+    question:       QuestionSchema,
+    infer_obj:      ModelObjVariant,
+    gen_params:     dict,
+    completion:     Union[str, None],
+    error:          Union[Exception, None],
+    eval_time:      float,
+    ntokens_usr:    int,
+    ntokens_sys:    int,
+    cache_hit:      Union[bool, None] = None,
+    timer:          Union[PromptTimer, None] = None,
+) -> QuestionOutput:
+    '''
+        tps is the completion tokens over the time they were streamed 
+        in, else over eval_time (for non-streaming prompts / batches).
+    '''
+    question_output = QuestionOutput(
+        name            = question.name,
+        meta_data       = question.meta,
+        gen_params      = gen_params,
+        ground_truth    = question.answer,
+        question_sys    = question.text_sys,
+        question_usr    = question.text_usr,
+        completion      = completion,
+        error           = str(error) if error else None,
+        eval_time       = eval_time,
+        cache_hit       = cache_hit,
+    )
+
+    ntokens_cmp = infer_obj.count_tokens(completion)
+
+    question_output.ntokens = NTokens(
+        usr = ntokens_usr,
+        sys = ntokens_sys,
+        cmp = ntokens_cmp,
+    )
+
+    if timer is not None:
+        question_output.ttft = timer.ttft()
+
+    if (completion is not None) and (ntokens_cmp or 0) > 0 and not(cache_hit):
+        gen_time = (timer.gen_time() if timer is not None else None) or eval_time
+        if gen_time > 0:
+            question_output.tps = ntokens_cmp / gen_time
+    
+    grading_output = grade_answer(
+        completion      = completion,
+        ground_truth    = question.answer,
+    )
+
+    question_output.grading = grading_output
+
+    return question_output
+
+
+def lookup_completion_cache(
+    completion_cache:   CompletionCache,
+    infer_obj:          ModelObjVariant,
+    question:           QuestionSchema,
+    gen_params:         dict,
+    stop_fn:            StopPredicate = None,
+    batch:              bool = False,
+) -> Tuple[Union[str, None], Union[str, None]]:
+    '''
+        Returns (cache_key, cached completion); cache_key is None when
+        this prompt shouldn't be cached (e.g. temperature > 0). Batched
+        completions are sampled outside llama (see sample_logits) so 
+        they're keyed apart.
+    '''
+    key_data = infer_obj.cache_key_data(
+        prompt_sys  = question.text_sys,
+        prompt_usr  = question.text_usr,
+        gen_params  = gen_params,
+    )
+    if stop_fn is not None:
+        key_data['early_stop'] = stop_fn.key_data()
+    if batch:
+        key_data['sampler'] = 'batch'
+    if not(completion_cache.is_cacheable(key_data)):
+        return None, None
+    cache_key = completion_cache.make_key(key_data)
+    return cache_key, completion_cache.get(cache_key)
+
+
+def start_question(
+    question:       QuestionSchema,
     infer_obj:      ModelObjVariant,
-    run_id:         str,
-    tmp_output_fn:  str = None,
-    verbose_level:  int = 0,
     dry_run:        bool = False,
-) -> SheetOutputSchema:
+    completion_cache: CompletionCache = None,
+    batch:          bool = False,
+) -> Dict[str, Any]:
+    '''
+        State of a question's eval up to its prompt: gen params, stop
+        predicate and completion cache lookup. `prompt` is whether the
+        model still needs to be prompted (see prompt_kwargs / end_prompt).
+    '''
+    gen_params = extract_gen_params(question.meta)
+    stop_fn = get_stop_predicate(question.meta, question.answer)
+    cache_key, completion, cache_hit = None, None, None
+    if (completion_cache is not None) and not(dry_run):
+        cache_key, completion = lookup_completion_cache(
+            completion_cache, infer_obj, question, gen_params, stop_fn, batch
+        )
+        if cache_key is not None:
+            cache_hit = completion is not None
+    return {
+        'question':     question,
+        'ntokens_usr':  infer_obj.count_tokens(question.text_usr),
+        'gen_params':   gen_params,
+        'stop_fn':      stop_fn,
+        'cache_key':    cache_key,
+        'cache_hit':    cache_hit,
+        'completion':   completion,
+        'error':        None,
+        'timer':        None,
+        'prompt':       not(dry_run) and not(cache_hit),
+    }
 
-    progress = SheetProgressMsg(verbose_level=verbose_level)
+
+def prompt_kwargs(
+    item:           Dict[str, Any],
+    stream_cb:      callable = None,
+) -> Dict[str, Any]:
+    '''
+        kwargs of prompt_model / aprompt_model, starts the item's timer.
+        The completion is streamed (the timer is its progress_cb) only 
+        if its text is shown or a stop predicate watches it.
+    '''
+    item['timer'] = PromptTimer(on_text=stream_cb, stop_fn=item['stop_fn'])
+    stream = (stream_cb is not None) or (item['stop_fn'] is not None)
+    return {
+        'prompt_sys':   item['question'].text_sys,
+        'prompt_usr':   item['question'].text_usr,
+        'progress_cb':  item['timer'] if stream else None,
+        **item['gen_params'],
+    }
+
+
+def end_prompt(
+    item:           Dict[str, Any],
+    completion:     Union[str, None],
+    error:          Union[Exception, None],
+    completion_cache: CompletionCache = None,
+) -> None:
+    '''record the response: truncate at the stop predicate and cache it'''
+    if item['timer'] is not None:
+        item['timer'].stop()
+    if (item['stop_fn'] is not None) and (completion is not None):
+        completion = item['stop_fn'].truncate(completion)
+    item['completion'], item['error'] = completion, error
+    if ((item['cache_key'] is not None) and 
+        (completion is not None) and (error is None)):
+        completion_cache.put(item['cache_key'], completion)
+
+
+def end_question(
+    item:           Dict[str, Any],
+    infer_obj:      ModelObjVariant,
+    ntokens_sys:    int,
+    eval_time:      float,
+) -> QuestionOutput:
+    return build_question_output(
+        item['question'], infer_obj, item['gen_params'],
+        item['completion'], item['error'],
+        eval_time   = eval_time,
+        ntokens_usr = item['ntokens_usr'],
+        ntokens_sys = ntokens_sys,
+        cache_hit   = item['cache_hit'],
+        timer       = item['timer'],
+    )
+
+
+def eval_question(
+    question:       QuestionSchema,
+    infer_obj:      ModelObjVariant,
+    ntokens_sys:    int,
+    dry_run:        bool = False,
+    completion_cache: CompletionCache = None,
+    stream_cb:      callable = None,
+) -> QuestionOutput:
+    '''stream_cb gets the text of the completion as it's streamed'''
+    t0 = time.time()
+
+    item = start_question(question, infer_obj, dry_run, completion_cache)
+
+    if item['prompt']:
+        completion, error = infer_obj.prompt_model(
+            **prompt_kwargs(item, stream_cb)
+        )
+        end_prompt(item, completion, error, completion_cache)
+    
+    return end_question(item, infer_obj, ntokens_sys, time.time() - t0)
+
+
+async def aeval_question(
+    question:       QuestionSchema,
+    infer_obj:      ModelObjVariant,
+    ntokens_sys:    int,
+    dry_run:        bool = False,
+    completion_cache: CompletionCache = None,
+    stream_cb:      callable = None,
+) -> QuestionOutput:
+    '''stream_cb gets the text of the completion as it's streamed'''
+    t0 = time.time()
+
+    item = start_question(question, infer_obj, dry_run, completion_cache)
+
+    if item['prompt']:
+        completion, error = await infer_obj.aprompt_model(
+            **prompt_kwargs(item, stream_cb)
+        )
+        end_prompt(item, completion, error, completion_cache)
+    
+    return end_question(item, infer_obj, ntokens_sys, time.time() - t0)
+
+
+def eval_question_batch(
+    questions:      List[QuestionSchema],
+    infer_obj:      ModelObjVariant,
+    ntokens_sys:    int,
+    dry_run:        bool = False,
+    completion_cache: CompletionCache = None,
+) -> List[QuestionOutput]:
+    '''
+        eval_question for several questions whose prompts are generated 
+        together by infer_obj.prompt_model_batch. eval_time of each is 
+        the time of the whole batch.
+    '''
+    t0 = time.time()
+
+    items = [
+        start_question(
+            question, infer_obj, dry_run, completion_cache, batch=True
+        )
+        for question in questions
+    ]
+    
+    to_prompt = [item for item in items if item['prompt']]
+    if len(to_prompt) > 0:
+        responses = infer_obj.prompt_model_batch(
+            [
+                (item['question'].text_sys, item['question'].text_usr, item['gen_params'])
+                for item in to_prompt
+            ],
+            stop_fns = [item['stop_fn'] for item in to_prompt],
+        )
+        for item, (completion, error) in zip(to_prompt, responses):
+            end_prompt(item, completion, error, completion_cache)
+    
+    eval_time = time.time() - t0
+    
+    return [
+        end_question(item, infer_obj, ntokens_sys, eval_time)
+        for item in items
+    ]
+
+
+def iter_eval_questions(
+    questions:      List[QuestionSchema],
+    infer_obj:      ModelObjVariant,
+    ntokens_sys:    int,
+    progress:       SheetProgressMsg,
+    dry_run:        bool = False,
+    concurrency:    int = 1,
+    completion_cache: CompletionCache = None,
+) -> Iterator[QuestionOutput]:
+    '''
+        Yield a QuestionOutput for each question, in sheet order.
+        With concurrency > 1 the prompts are dispatched through a 
+        bounded thread pool, but results are still yielded in order.
+        Models which can't be prompted from threads but can generate
+        a batch (local models) are given `concurrency` questions at once.
+    '''
+    if (concurrency > 1) and hasattr(infer_obj, 'prompt_model_batch'):
+        for i in range(0, len(questions), concurrency):
+            batch = questions[i:i + concurrency]
+            question_outputs = eval_question_batch(
+                batch, infer_obj, ntokens_sys, dry_run, completion_cache
+            )
+            for question, question_output in zip(batch, question_outputs):
+                progress.pre_prompt(question)
+                yield question_output
+        return
+
+    if (concurrency <= 1) or not(infer_obj.thread_safe):
+        for question in questions:
+            progress.pre_prompt(question)
+            yield eval_question(
+                question, infer_obj, ntokens_sys, dry_run, completion_cache,
+                stream_cb = progress.stream if progress.verbose >= 2 else None,
+            )
+        return
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    futures = []
+    try:
+        futures = [
+            executor.submit(
+                eval_question, question, infer_obj, ntokens_sys, dry_run,
+                completion_cache,
+            )
+            for question in questions
+        ]
+        for question, future in zip(questions, futures):
+            question_output = future.result()
+            progress.pre_prompt(question)
+            yield question_output
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+async def aiter_eval_questions(
+    questions:      List[QuestionSchema],
+    infer_obj:      ModelObjVariant,
+    ntokens_sys:    int,
+    progress:       SheetProgressMsg,
+    dry_run:        bool = False,
+    concurrency:    int = 1,
+    completion_cache: CompletionCache = None,
+) -> AsyncIterator[QuestionOutput]:
+    '''
+        Async version of iter_eval_questions: up to `concurrency` 
+        aprompt_model calls are in flight at once on the running 
+        event loop, results are yielded in sheet order.
+    '''
+    if not(infer_obj.thread_safe):
+        concurrency = 1
     
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def bounded_eval(question: QuestionSchema) -> QuestionOutput:
+        async with semaphore:
+            return await aeval_question(
+                question, infer_obj, ntokens_sys, dry_run, completion_cache
+            )
+
+    tasks = [
+        asyncio.ensure_future(bounded_eval(question)) 
+        for question in questions
+    ]
+    try:
+        for question, task in zip(questions, tasks):
+            question_output = await task
+            progress.pre_prompt(question)
+            yield question_output
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def init_sheet_output(
+    sheet_obj:      SheetSchema,
+    infer_obj:      ModelObjVariant,
+    run_id:         str,
+    dry_run:        bool = False,
+) -> Tuple[SheetOutputSchema, int]:
+    '''
+        Apply sheet level params to infer_obj, build the output header
+        and (if used) evaluate the sheet prompt into the prompt cache.
+        Returns the output object and the ntokens of the sheet prompt.
+    '''
     sheet_gen_params = extract_gen_params(sheet_obj.meta)
 
     infer_obj.update_gen_params(sheet_gen_params)
@@ -91,61 +533,195 @@ def eval_sheet(
             )
             infer_obj.save_state()
 
+    return output, ntokens_sys
+
+
+def open_journal(
+    tmp_output_fn:  Union[str, None],
+    output:         SheetOutputSchema,
+    prior_outputs:  Union[Dict[str, QuestionOutput], None] = None,
+) -> Union[CheckpointJournal, None]:
+    '''
+        Start the checkpoint journal for a sheet. When resuming, the 
+        journal is first (atomically) rewritten with the prior outputs
+        and then appended to.
+    '''
+    if tmp_output_fn is None:
+        return None
+    if prior_outputs:
+        write_journal(
+            tmp_output_fn, 
+            output.header, 
+            list(prior_outputs.values()),
+        )
+        return CheckpointJournal(
+            tmp_output_fn,
+            fsync_every=ExecSettings.tmp_fsync_every,
+            append=True,
+        )
+    journal = CheckpointJournal(
+        tmp_output_fn,
+        fsync_every=ExecSettings.tmp_fsync_every,
+    )
+    journal.write_header(output.header)
+    return journal
+
+
+def record_question_output(
+    output:          SheetOutputSchema,
+    question_output: QuestionOutput,
+    progress:        SheetProgressMsg,
+    journal:         Union[CheckpointJournal, None] = None,
+) -> None:
+    
+    output.questions.append(question_output)
+
+    if journal is not None:
+        journal.append(question_output)
+
+    progress.post_prompt(question_output)
+
+
+def start_sheet(
+    sheet_obj:      SheetSchema,
+    infer_obj:      ModelObjVariant,
+    run_id:         str,
+    progress:       SheetProgressMsg,
+    tmp_output_fn:  str = None,
+    dry_run:        bool = False,
+    prior_outputs:  Dict[str, QuestionOutput] = None,
+) -> Tuple[
+        SheetOutputSchema, 
+        int, 
+        Dict[str, QuestionOutput], 
+        List[QuestionSchema], 
+        Union[CheckpointJournal, None],
+    ]:
+    '''
+        Shared setup of eval_sheet / aeval_sheet. Returns the output,
+        ntokens of the sheet prompt, the prior outputs of the sheet's
+        questions, the questions still pending and the journal.
+    '''
+    output, ntokens_sys = init_sheet_output(
+        sheet_obj, infer_obj, run_id, dry_run
+    )
+
     progress.pre_loop(sheet_obj)
+
+    # when resuming, completed questions are carried over, not prompted
+    prior_outputs = {
+        q.name: prior_outputs[q.name] for q in sheet_obj.questions
+        if q.name in (prior_outputs or {})
+    }
     
-    for question in sheet_obj.questions:
-        
-        t0 = time.time()
+    pending = [
+        q for q in sheet_obj.questions 
+        if q.name not in prior_outputs
+    ]
 
-        ntokens_usr = infer_obj.count_tokens(question.text_usr)
-        
-        gen_params = extract_gen_params(question.meta)
+    journal = open_journal(tmp_output_fn, output, prior_outputs)
 
-        progress.pre_prompt(question)
+    return output, ntokens_sys, prior_outputs, pending, journal
 
-        if dry_run:
-            completion, error = None, None
-        else:
-            completion, error = infer_obj.prompt_model(
-                prompt_sys  = question.text_sys,
-                prompt_usr  = question.text_usr,
-                **gen_params,
-            )
-        
-        question_output = QuestionOutput(
-            name            = question.name,
-            meta_data       = question.meta,
-            gen_params      = gen_params,
-            ground_truth    = question.answer,
-            question_sys    = question.text_sys,
-            question_usr    = question.text_usr,
-            completion      = completion,
-            error           = str(error) if error else None,
-            eval_time       = time.time() - t0,
-        )
 
-        ntokens_cmp = infer_obj.count_tokens(completion)
+def record_prior_output(
+    output:         SheetOutputSchema,
+    question:       QuestionSchema,
+    prior_outputs:  Dict[str, QuestionOutput],
+    progress:       SheetProgressMsg,
+) -> bool:
+    '''carry over the question's prior output, if it has one'''
+    if question.name not in prior_outputs:
+        return False
+    progress.pre_prompt(question)
+    record_question_output(output, prior_outputs[question.name], progress)
+    return True
 
-        question_output.ntokens = NTokens(
-            usr = ntokens_usr,
-            sys = ntokens_sys,
-            cmp = ntokens_cmp,
-        )
-        
-        grading_output = grade_answer(
-            completion      = completion,
-            ground_truth    = question.answer,
-        )
 
-        question_output.grading = grading_output
-        
-        output.questions.append(question_output)
+def eval_sheet(
+    sheet_obj:      SheetSchema,
+    infer_obj:      ModelObjVariant,
+    run_id:         str,
+    tmp_output_fn:  str = None,
+    verbose_level:  int = 0,
+    dry_run:        bool = False,
+    concurrency:    int = 1,
+    prior_outputs:  Dict[str, QuestionOutput] = None,
+    completion_cache: CompletionCache = None,
+) -> SheetOutputSchema:
 
-        if tmp_output_fn is not None:
-            with open(tmp_output_fn, 'w', encoding='utf-8', errors='replace') as f:
-                f.write(output.model_dump_json(indent=2))
+    progress = SheetProgressMsg(verbose_level=verbose_level)
+    
+    output, ntokens_sys, prior_outputs, pending, journal = start_sheet(
+        sheet_obj, infer_obj, run_id, progress, tmp_output_fn, dry_run, 
+        prior_outputs,
+    )
 
-        progress.post_prompt(question_output)
+    new_outputs = iter_eval_questions(
+        questions   = pending,
+        infer_obj   = infer_obj,
+        ntokens_sys = ntokens_sys,
+        progress    = progress,
+        dry_run     = dry_run,
+        concurrency = concurrency,
+        completion_cache = completion_cache,
+    )
+    
+    try:
+        for question in sheet_obj.questions:
+            if not(record_prior_output(output, question, prior_outputs, progress)):
+                record_question_output(
+                    output, next(new_outputs), progress, journal
+                )
+    finally:
+        new_outputs.close()
+        if journal is not None:
+            journal.close()
+
+    progress.post_loop(output)
+
+    return output
+
+
+async def aeval_sheet(
+    sheet_obj:      SheetSchema,
+    infer_obj:      ModelObjVariant,
+    run_id:         str,
+    tmp_output_fn:  str = None,
+    verbose_level:  int = 0,
+    dry_run:        bool = False,
+    concurrency:    int = 1,
+    prior_outputs:  Dict[str, QuestionOutput] = None,
+    completion_cache: CompletionCache = None,
+) -> SheetOutputSchema:
+
+    progress = SheetProgressMsg(verbose_level=verbose_level)
+    
+    output, ntokens_sys, prior_outputs, pending, journal = start_sheet(
+        sheet_obj, infer_obj, run_id, progress, tmp_output_fn, dry_run, 
+        prior_outputs,
+    )
+
+    new_outputs = aiter_eval_questions(
+        questions   = pending,
+        infer_obj   = infer_obj,
+        ntokens_sys = ntokens_sys,
+        progress    = progress,
+        dry_run     = dry_run,
+        concurrency = concurrency,
+        completion_cache = completion_cache,
+    )
+    
+    try:
+        for question in sheet_obj.questions:
+            if not(record_prior_output(output, question, prior_outputs, progress)):
+                record_question_output(
+                    output, await new_outputs.__anext__(), progress, journal
+                )
+    finally:
+        await new_outputs.aclose()
+        if journal is not None:
+            journal.close()
 
     progress.post_loop(output)
 
@@ -169,14 +745,43 @@ def make_output_fp(
     return str(output_fp)
 
 
+def make_journal_fp(output_fp: str) -> str:
+    '''path of the jsonl checkpoint journal for an output file'''
+    output_name, _ = os.path.splitext(os.path.basename(output_fp))
+    return str(os.path.join(
+        os.path.dirname(output_fp),
+        f'tmp-{output_name}.jsonl'
+    ))
+
+
 def make_tmp_output_fp(output_fp: str) -> Union[str, None]:
     if ExecSettings.save_tmp_file:
-        return str(os.path.join(
-            os.path.dirname(output_fp),
-            f'tmp-{os.path.basename(output_fp)}'
-        ))
+        return make_journal_fp(output_fp)
     return None
 
+
+def load_prior_outputs(output_fp: str) -> Dict[str, QuestionOutput]:
+    '''
+        Questions completed without error by a previous (partial) run, 
+        read from its checkpoint journal if present, else its output.
+    '''
+    journal_fp = make_journal_fp(output_fp)
+    prior_output = None
+    try:
+        if os.path.exists(journal_fp):
+            prior_output = read_journal(journal_fp)
+        elif os.path.exists(output_fp):
+            with open(output_fp, 'r', encoding='utf-8') as f:
+                prior_output = SheetOutputSchema.model_validate_json(f.read())
+    except Exception as e:
+        raise BaseQuietError(f'Error reading prior run: {output_fp}: {str(e)}')
+    if prior_output is None:
+        return {}
+    return {
+        q.name: q for q in prior_output.questions
+        if (q.error is None) and (q.completion is not None)
+    }
+
     
 def continue_or_exit() -> None:
     try:
@@ -201,6 +806,196 @@ def cleanup_tmp(tmp_output_fp: Union[None, str]) -> None:
             else:print(err_msg)
 
 
+def make_infer_obj(
+    model_name:         str,
+    use_prompt_cache:   bool = True,
+    concurrency:        int = 1,
+) -> ModelObjVariant:
+    # TODO - Make this init params
+    infer_constructor_args = {
+        'use_prompt_cache': use_prompt_cache,    
+    }
+    if concurrency > 1:
+        # a local model's batch: the sheet prompt's sequence + a question's each
+        infer_constructor_args['n_seq_max'] = concurrency + 1
+    return get_infer_obj(model_name, **infer_constructor_args)
+
+
+def run_sheet(
+    sheet_fn:       str,
+    model_name:     str,
+    progress:       MainProgressMsg,
+    sheet_obj:      Union[SheetSchema, None] = None,
+    resume:         bool = False,
+    loop:           Union[asyncio.AbstractEventLoop, None] = None,
+    **sheet_kwargs,
+) -> Union[SheetOutputSchema, None]:
+    '''
+        Evaluate and write the output of one sheet, parsing it first
+        unless its sheet_obj is given. sheet_kwargs are passed on to 
+        eval_sheet / aeval_sheet, which is used when an event `loop` 
+        is given.
+    '''
+    output_fp = make_output_fp(sheet_fn, model_name, sheet_kwargs['run_id'])
+    
+    tmp_output_fp = make_tmp_output_fp(output_fp)
+    
+    if sheet_obj is None:
+        sheet_obj = parse_to_obj(sheet_fn, parse_cache=get_parse_cache())
+
+    progress.pre_sheet(sheet_obj)
+
+    prior_outputs = load_prior_outputs(output_fp) if resume else None
+
+    if resume:
+        progress.resume_sheet(sheet_obj, prior_outputs)
+
+    try:
+        if loop is not None:
+            output = loop.run_until_complete(aeval_sheet(
+                sheet_obj=sheet_obj,
+                tmp_output_fn=tmp_output_fp,
+                prior_outputs=prior_outputs,
+                **sheet_kwargs,
+            ))
+        else:
+            output = eval_sheet(
+                sheet_obj=sheet_obj,
+                tmp_output_fn=tmp_output_fp,
+                prior_outputs=prior_outputs,
+                **sheet_kwargs,
+            )
+    
+    except KeyboardInterrupt:
+        continue_or_exit()
+        # keep the questions completed before the interrupt
+        output = None
+        if tmp_output_fp is not None and os.path.exists(tmp_output_fp):
+            output = compact_journal(tmp_output_fp, output_fp)
+        cleanup_tmp(tmp_output_fp)
+        return output
+
+    except Exception as e:
+        raise BaseQuietError(f'Error processing: {sheet_fn}: {str(e)}')
+
+    if output is not None:
+        with open(output_fp, 'w', encoding='utf-8', errors='replace') as f:
+            f.write(output.model_dump_json(indent=2))
+
+    cleanup_tmp(tmp_output_fp)
+
+    return output
+
+
+# state owned by each process of a --jobs pool, set in init_sheet_worker
+_worker = {}
+
+def init_sheet_worker(
+    model_name:         str,
+    use_prompt_cache:   bool,
+    use_cache:          bool,
+    use_async:          bool,
+    jobs:               int = 1,
+    concurrency:        int = 1,
+) -> None:
+    '''
+        Initializer of each pool process: it builds its own infer_obj 
+        (and cache / event loop), with local models' default threads 
+        divided between the `jobs` processes. Interrupts are left to 
+        the coordinator.
+    '''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    share_cpus(jobs)
+    _worker['infer_obj'] = make_infer_obj(
+        model_name, use_prompt_cache, concurrency
+    )
+    _worker['completion_cache'] = CompletionCache() if use_cache else None
+    _worker['loop'] = asyncio.new_event_loop() if use_async else None
+
+
+def run_sheet_job(
+    sheet_fn:       str,
+    sheet_obj:      SheetSchema,
+    model_name:     str,
+    resume:         bool,
+    sheet_kwargs:   dict,
+) -> Union[SheetOutputSchema, None]:
+    return run_sheet(
+        sheet_fn,
+        model_name,
+        progress=MainProgressMsg(verbose_level=0),
+        sheet_obj=sheet_obj,
+        resume=resume,
+        loop=_worker['loop'],
+        infer_obj=_worker['infer_obj'],
+        completion_cache=_worker['completion_cache'],
+        **sheet_kwargs,
+    )
+
+
+def batch_eval_jobs(
+    sheet_fns:      List[str],
+    sheet_objs:     List[SheetSchema],
+    model_name:     str,
+    progress:       MainProgressMsg,
+    jobs:           int,
+    use_prompt_cache: bool = True,
+    use_cache:      bool = False,
+    use_async:      bool = False,
+    resume:         bool = False,
+    **sheet_kwargs,
+) -> Union[SheetOutputSchema, None]:
+    '''
+        Shard sheets across a pool of `jobs` processes, each owning its
+        own infer_obj. Progress is reported here as sheets complete.
+    '''
+    sheet_kwargs['verbose_level'] = 0
+    
+    output = None
+    
+    executor = ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=init_sheet_worker,
+        initargs=(
+            model_name, use_prompt_cache, use_cache, use_async, jobs,
+            sheet_kwargs.get('concurrency', 1),
+        ),
+    )
+    interrupted = False
+    try:
+        futures = {
+            executor.submit(
+                run_sheet_job, 
+                sheet_fn, sheet_obj, model_name, resume, sheet_kwargs
+            ): sheet_fn
+            for sheet_fn, sheet_obj in zip(sheet_fns, sheet_objs)
+        }
+        for future in as_completed(futures):
+            try:
+                output = future.result()
+            except BaseQuietError:
+                raise
+            except Exception as e:
+                raise BaseQuietError(f'Error processing: {futures[future]}: {str(e)}')
+            progress.post_sheet(futures[future], output)
+    
+    except KeyboardInterrupt:
+        print('Keyboard Interrupt.')
+        interrupted = True
+    
+    finally:
+        if interrupted:
+            # workers ignore SIGINT; don't wait for their running sheets
+            for proc in list((executor._processes or {}).values()):
+                proc.terminate()
+        executor.shutdown(wait=not(interrupted), cancel_futures=True)
+    
+    if interrupted:
+        sys.exit(1)
+    
+    return output
+
+
 def batch_eval(
     sheet_fns: List[str],
     model_name: str,
@@ -208,57 +1003,96 @@ def batch_eval(
     dry_run: bool = False,
     use_prompt_cache: bool = True,
     verbose_level:  int = 0,
+    concurrency:    int = 1,
+    use_async:      bool = False,
+    resume:         bool = False,
+    use_cache:      bool = False,
+    jobs:           int = 1,
     ) -> None:
     
     progress = MainProgressMsg(verbose_level=verbose_level)
 
     progress.pre_loop(sheet_fns=sheet_fns)
 
-    try:
-        # TODO - Make this init params
-        infer_constructor_args = {
-            'use_prompt_cache': use_prompt_cache,    
-        }
+    # parse (and validate) every sheet before any inference is spent
+    sheet_objs, parse_errs = parse_sheets(sheet_fns, jobs=ExecSettings.parse_jobs)
     
-        infer_obj = get_infer_obj(model_name, **infer_constructor_args)
+    progress.parse_summary(sheet_fns, sheet_objs, parse_errs)
+
+    if len(parse_errs) > 0:
+        raise BaseQuietError(
+            f'Error parsing {len(parse_errs)} of {len(sheet_fns)} sheets:\n' +
+            '\n'.join(f'{fn}: {err}' for fn, err in parse_errs.items())
+        )
+
+    use_cache = use_cache and not(dry_run)
+
+    sheet_kwargs = {
+        'run_id':           run_id,
+        'verbose_level':    verbose_level,
+        'dry_run':          dry_run,
+        'concurrency':      concurrency,
+    }
+
+    if (jobs > 1) and (len(sheet_fns) > 1):
+        
+        progress.jobs_init(jobs)
+        
+        output = batch_eval_jobs(
+            sheet_fns,
+            sheet_objs,
+            model_name,
+            progress,
+            jobs=min(jobs, len(sheet_fns)),
+            use_prompt_cache=use_prompt_cache,
+            use_cache=use_cache,
+            use_async=use_async,
+            resume=resume,
+            **sheet_kwargs,
+        )
+        
+        progress.post_loop(output)
+        
+        return
+
+    try:
+        infer_obj = make_infer_obj(model_name, use_prompt_cache, concurrency)
     
-        progress.infer_init(infer_obj, infer_obj.check_valid())
+        progress.infer_init(infer_obj, infer_obj.check_valid(dry_run=dry_run))
     
     except Exception as e:
         raise BaseQuietError(f'Error creating infer_obj: {str(e)}')
     
-    for sheet_fn in sheet_fns:
-        
-        output_fp = make_output_fp(sheet_fn, model_name, run_id)
-        
-        tmp_output_fp = make_tmp_output_fp(output_fp)
-        
-        sheet_obj = parse_to_obj(sheet_fn)
-
-        progress.pre_sheet(sheet_obj)
+    # one event loop drives all sheets so async clients can be reused
+    loop = asyncio.new_event_loop() if use_async else None
 
+    completion_cache = None
+    if use_cache:
         try:
-            output = eval_sheet(
-                sheet_obj=sheet_obj,
-                infer_obj=infer_obj,
-                run_id=run_id,
-                tmp_output_fn=tmp_output_fp,
-                verbose_level= verbose_level,
-                dry_run=dry_run,
-            )
-        
-        except KeyboardInterrupt:
-            continue_or_exit()
-            output = None
-
+            completion_cache = CompletionCache()
         except Exception as e:
-            raise BaseQuietError(f'Error processing: {sheet_fn}: {str(e)}')
+            raise BaseQuietError(f'Error opening completion cache: {str(e)}')
 
-        with open(output_fp, 'w', encoding='utf-8', errors='replace') as f:
-            if output: f.write(output.model_dump_json(indent=2))
-
-        cleanup_tmp(tmp_output_fp)
+    for sheet_fn, sheet_obj in zip(sheet_fns, sheet_objs):
+        
+        output = run_sheet(
+            sheet_fn,
+            model_name,
+            progress,
+            sheet_obj=sheet_obj,
+            resume=resume,
+            loop=loop,
+            infer_obj=infer_obj,
+            completion_cache=completion_cache,
+            **sheet_kwargs,
+        )
     
+    if loop is not None:
+        loop.close()
+
+    if completion_cache is not None:
+        completion_cache.close()
+
     progress.post_loop(output)
 
 
@@ -300,6 +1134,11 @@ def setup_parser(parser):
     # Optional arguments, will overwrite config loaded defaults
     parser.add_argument('-m', '--model_name',    type=str)
     parser.add_argument('-y', '--dry_run',       action='store_true')
+    parser.add_argument('-c', '--concurrency',   type=int)
+    parser.add_argument('-a', '--use_async',     action='store_true')
+    parser.add_argument('-r', '--resume',        type=str, metavar='RUN_ID')
+    parser.add_argument('-k', '--use_cache',     action='store_true')
+    parser.add_argument('-j', '--jobs',          type=int)
     parser.add_argument('-v', '--verbose',       action='count')
     parser.add_argument('-b', '--debug',         action='store_true')
     
@@ -316,8 +1155,14 @@ def main(args):
     model_name      = args.get('model_name')    or ExecSettings.model_name
     verbose_level   = args.get('verbose')       or ExecSettings.verbose
     dry_run         = args.get('dry_run')
+    concurrency     = args.get('concurrency')   or ExecSettings.concurrency
+    use_async       = args.get('use_async')     or ExecSettings.use_async
+    use_cache       = args.get('use_cache')     or CompletionCacheParams.enabled
+    jobs            = args.get('jobs')          or ExecSettings.jobs
+
+    resume_run_id   = args.get('resume')
 
-    run_id          = uuid.uuid4().hex[:ExecSettings.uuid_digits]
+    run_id          = resume_run_id or uuid.uuid4().hex[:ExecSettings.uuid_digits]
 
     use_prompt_cache = ExecSettings.use_prompt_cache  # TODO - move
 
@@ -328,5 +1173,10 @@ def main(args):
         dry_run = dry_run,
         use_prompt_cache = use_prompt_cache,
         verbose_level = verbose_level,
+        concurrency = concurrency,
+        use_async = use_async,
+        resume = resume_run_id is not None,
+        use_cache = use_cache,
+        jobs = jobs,
     )
         
\ No newline at end of file
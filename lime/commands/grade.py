@@ -13,14 +13,15 @@ from lime.common.models.internal import (
 from lime.common.controllers.parse import (
     parse_to_obj
 )
+from lime.common.cache.parsed_sheet import (
+    get_parse_cache,
+)
 from lime.common.grading.base import grade_array
 
-script_dir = os.path.dirname(os.path.abspath(__file__))
-
 def do_grade_sheet(
         output_json_fp: str,
         input_md_fp: Union[None, str] = None,
-        input_schema_fp: str = os.path.join(script_dir, '..', 'data', 'md-schema.yaml'),
+        input_schema_fp: Union[None, str] = None,
         overwrite: bool = False,
         verbose: bool = False,
         liberal_grading: bool = False,
@@ -33,7 +34,11 @@ def do_grade_sheet(
     # with the ground_truth from input where applicable
     if input_md_fp is not None:
         
-        in_sheet = parse_to_obj(input_md_fp, input_schema_fp)
+        in_sheet = parse_to_obj(
+            input_md_fp, 
+            input_schema_fp, 
+            parse_cache=get_parse_cache(),
+        )
         
         match_counter = 0
         overwrite_counter = 0
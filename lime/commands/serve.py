@@ -0,0 +1,56 @@
+import argparse
+from lime.common.models.errs import (
+    QuietError,
+    BaseQuietError,
+)
+from lime.common.inference.model_server import (
+    ModelServer,
+    read_server_info,
+)
+
+
+def serve_model(model_name: str, verbose: bool = False) -> None:
+    '''
+        Load a local model and serve it until interrupted; `lime eval`
+        with this model_name then prompts the resident model.
+    '''
+    if read_server_info(model_name) is not None:
+        raise BaseQuietError(f'A model server for {model_name} is already running')
+
+    try:
+        server = ModelServer(model_name)
+        if verbose:
+            print(f'Loading {model_name}...', flush=True)
+        server.start()
+    except Exception as e:
+        raise BaseQuietError(f'Error starting model server: {str(e)}')
+
+    print(f'Serving {model_name} at {server.listener.address} (Ctrl+C to stop)', flush=True)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('\nStopping model server.')
+    finally:
+        server.close()
+
+
+def setup_parser(argparser):
+
+    argparser.add_argument('model_name', type=str,
+                           help='name of a LocalModels model (or weights fn)')
+    argparser.add_argument('-v', '--verbose', action='store_true')
+    argparser.add_argument('-b', '--debug',   action='store_true')
+
+
+def main(args):
+
+    args = vars(args)
+
+    if args.get('debug'):
+        QuietError.debug_mode = True
+
+    serve_model(
+        model_name = args.get('model_name'),
+        verbose = args.get('verbose'),
+    )
@@ -0,0 +1,61 @@
+import json
+import hashlib
+from typing import (
+    Any,
+    Dict,
+)
+from ..models.state import (
+    ConfigLoader,
+)
+from .sqlite_lru import (
+    SqliteLRUCache,
+)
+
+class CompletionCacheParams(ConfigLoader):
+    enabled = False
+    max_size_mb = 256
+    # only cache completions generated with temperature 0
+    deterministic_only = True
+CompletionCacheParams._initialize()
+
+
+class CompletionCache(SqliteLRUCache):
+    '''
+        Content-addressed store of completions shared across runs, in a
+        sqlite db. Entries are keyed on a hash of everything which can
+        change the completion (see ModelObj.cache_key_data) and evicted
+        least-recently-used first once the db grows past max_bytes.
+    '''
+    db_fn = 'completions.sqlite'
+    table = 'completions'
+    value_col = 'completion'
+
+    def __init__(
+            self,
+            cache_dir: str = None,
+            max_bytes: int = None,
+            deterministic_only: bool = None,
+        ) -> None:
+
+        super().__init__(
+            cache_dir=cache_dir,
+            max_bytes=(
+                max_bytes if max_bytes is not None
+                else int(CompletionCacheParams.max_size_mb * 1024 * 1024)
+            ),
+        )
+        self.deterministic_only : bool = (
+            deterministic_only if deterministic_only is not None
+            else CompletionCacheParams.deterministic_only
+        )
+
+    @staticmethod
+    def make_key(key_data: Dict[str, Any]) -> str:
+        s_data = json.dumps(key_data, sort_keys=True, default=str)
+        return hashlib.sha256(s_data.encode('utf-8')).hexdigest()
+
+    def is_cacheable(self, key_data: Dict[str, Any]) -> bool:
+        if not(self.deterministic_only):
+            return True
+        temperature = key_data.get('gen_params', {}).get('temperature')
+        return (temperature is not None) and (float(temperature) == 0.0)
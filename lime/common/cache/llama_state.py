@@ -0,0 +1,190 @@
+import os
+import json
+import mmap
+import hashlib
+import threading
+from typing import (
+    Any,
+    Dict,
+    Union,
+)
+import numpy as np
+from ..models.state import (
+    ConfigLoader,
+)
+from ..models.utils import (
+    get_cache_dir,
+)
+try:
+    from llama_cpp import LlamaState
+except ImportError:
+    LlamaState = None
+
+
+class LlamaStateCacheParams(ConfigLoader):
+    enabled = True
+    max_size_mb = 8192
+LlamaStateCacheParams._initialize()
+
+
+_file_hashes : Dict[tuple, str] = {}
+_file_hashes_lock = threading.Lock()
+
+def get_file_hash(fn: str, cache_dir: str = None) -> str:
+    '''
+        sha256 of a (model) file. Hashing gigabytes of weights is slow,
+        so hashes are kept in an index keyed on path, size and mtime and
+        only recomputed when the file changes.
+    '''
+    stat = os.stat(fn)
+    file_id = (os.path.abspath(fn), stat.st_size, stat.st_mtime_ns)
+    index_fn = os.path.join(cache_dir or get_cache_dir(), 'file_hashes.json')
+    with _file_hashes_lock:
+        if file_id in _file_hashes:
+            return _file_hashes[file_id]
+        index = {}
+        if os.path.exists(index_fn):
+            try:
+                with open(index_fn, 'r') as f:
+                    index = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                index = {}
+        index_key = '|'.join(str(e) for e in file_id)
+        if index_key not in index:
+            h = hashlib.sha256()
+            with open(fn, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 24), b''):
+                    h.update(chunk)
+            index[index_key] = h.hexdigest()
+            os.makedirs(os.path.dirname(index_fn), exist_ok=True)
+            with open(index_fn + '.part', 'w') as f:
+                json.dump(index, f)
+            os.replace(index_fn + '.part', index_fn)
+        _file_hashes[file_id] = index[index_key]
+        return index[index_key]
+
+
+class LlamaStateStore:
+    '''
+        Content-addressed files of llama states (e.g. an evaluated sheet
+        prompt) which persist across runs. A file is a json header line
+        followed by the raw input_ids, scores and llama_state bytes; it's
+        memory-mapped on load so the state is copied once, into the model.
+        Only scores rows for evaluated tokens are kept.
+    '''
+    sub_dir = 'llama_states'
+    ext = '.llstate'
+
+    def __init__(
+            self,
+            cache_dir: str = None,
+            max_bytes: int = None,
+        ) -> None:
+        self.cache_dir : str = os.path.join(
+            cache_dir or get_cache_dir(),
+            self.sub_dir,
+        )
+        self.max_bytes : int = (
+            max_bytes if max_bytes is not None
+            else int(LlamaStateCacheParams.max_size_mb * 1024 * 1024)
+        )
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(key_data: Dict[str, Any]) -> str:
+        s_data = json.dumps(key_data, sort_keys=True, default=str)
+        return hashlib.sha256(s_data.encode('utf-8')).hexdigest()
+
+    def _fn(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + self.ext)
+
+    def save(self, key: str, state: Any) -> None:
+        n_tokens = int(state.n_tokens)
+        input_ids = np.ascontiguousarray(state.input_ids[:n_tokens])
+        scores = np.ascontiguousarray(state.scores[:n_tokens])
+        llama_state = bytes(state.llama_state)[:state.llama_state_size]
+        header = {
+            'n_tokens':         n_tokens,
+            'input_ids_dtype':  input_ids.dtype.str,
+            'input_ids_shape':  list(state.input_ids.shape),
+            'scores_dtype':     scores.dtype.str,
+            'scores_shape':     list(state.scores.shape),
+            'input_ids_nbytes': input_ids.nbytes,
+            'scores_nbytes':    scores.nbytes,
+            'llama_state_size': len(llama_state),
+        }
+        fn = self._fn(key)
+        with open(fn + '.part', 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            f.write(input_ids.tobytes())
+            f.write(scores.tobytes())
+            f.write(llama_state)
+        os.replace(fn + '.part', fn)
+        self._evict(keep_fn=fn)
+
+    def load(self, key: str) -> Union[Any, None]:
+        '''the LlamaState saved under key, or None'''
+        fn = self._fn(key)
+        if not os.path.exists(fn):
+            return None
+        try:
+            with open(fn, 'rb') as f:
+                header = json.loads(f.readline())
+                offset = f.tell()
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            n_tokens = header['n_tokens']
+
+            input_ids = np.zeros(
+                header['input_ids_shape'], dtype=header['input_ids_dtype']
+            )
+            input_ids[:n_tokens] = np.frombuffer(
+                buf, dtype=header['input_ids_dtype'],
+                count=n_tokens, offset=offset,
+            )
+            offset += header['input_ids_nbytes']
+
+            scores = np.zeros(
+                header['scores_shape'], dtype=header['scores_dtype']
+            )
+            scores[:n_tokens] = np.frombuffer(
+                buf, dtype=header['scores_dtype'],
+                count=header['scores_nbytes'] // scores.itemsize, offset=offset,
+            ).reshape((n_tokens, *header['scores_shape'][1:]))
+            offset += header['scores_nbytes']
+
+            llama_state = memoryview(buf)[offset:offset + header['llama_state_size']]
+
+            os.utime(fn)    # mark as recently used
+
+            return LlamaState(
+                input_ids=input_ids,
+                scores=scores,
+                n_tokens=n_tokens,
+                llama_state=llama_state,
+                llama_state_size=header['llama_state_size'],
+            )
+        except Exception:
+            return None
+
+    def size(self) -> int:
+        return sum(
+            os.path.getsize(os.path.join(self.cache_dir, fn))
+            for fn in os.listdir(self.cache_dir)
+            if fn.endswith(self.ext)
+        )
+
+    def _evict(self, keep_fn: str = None) -> None:
+        '''delete least recently used state files until under max_bytes'''
+        fns = [
+            os.path.join(self.cache_dir, fn)
+            for fn in os.listdir(self.cache_dir)
+            if fn.endswith(self.ext)
+        ]
+        fns.sort(key=lambda fn: os.path.getmtime(fn))
+        excess = sum(os.path.getsize(fn) for fn in fns) - self.max_bytes
+        for fn in fns:
+            if excess <= 0: break
+            if fn == keep_fn: continue
+            excess -= os.path.getsize(fn)
+            os.remove(fn)
@@ -0,0 +1,145 @@
+import os
+import hashlib
+from typing import (
+    Dict,
+    List,
+    Tuple,
+    Union,
+)
+from ..models.state import (
+    ConfigLoader,
+)
+from ..models.utils import (
+    get_cache_dir,
+)
+from ..models.internal import (
+    SheetSchema,
+)
+from .sqlite_lru import (
+    SqliteLRUCache,
+)
+
+class ParseCacheParams(ConfigLoader):
+    enabled = False
+    max_size_mb = 256
+ParseCacheParams._initialize()
+
+
+class ParseCache(SqliteLRUCache):
+    '''
+        Parsed input sheets (SheetSchema json) shared across runs, in a
+        sqlite db. Entries are keyed on a hash of the sheet's content and
+        the md-schema version; a table of each file's (size, mtime)
+        gives a fast path which skips reading unchanged sheets.
+    '''
+    db_fn = 'parsed_sheets.sqlite'
+    table = 'sheets'
+    value_col = 'data'
+
+    def __init__(
+            self,
+            cache_dir: str = None,
+            max_bytes: int = None,
+        ) -> None:
+
+        super().__init__(
+            cache_dir=cache_dir,
+            max_bytes=(
+                max_bytes if max_bytes is not None
+                else int(ParseCacheParams.max_size_mb * 1024 * 1024)
+            ),
+        )
+
+    def _create_tables(self) -> None:
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                path            TEXT NOT NULL,
+                schema_version  TEXT NOT NULL,
+                size            INTEGER NOT NULL,
+                mtime_ns        INTEGER NOT NULL,
+                key             TEXT NOT NULL,
+                PRIMARY KEY (path, schema_version)
+            )
+        ''')
+
+    @staticmethod
+    def make_key(content: bytes, schema_version: str) -> str:
+        h = hashlib.sha256(content)
+        h.update(schema_version.encode('utf-8'))
+        return h.hexdigest()
+
+    @staticmethod
+    def file_id(fn: str) -> Tuple[str, int, int]:
+        stat = os.stat(fn)
+        return os.path.abspath(fn), stat.st_size, stat.st_mtime_ns
+
+    def get_by_file(
+            self,
+            file_id: Tuple[str, int, int],
+            schema_version: str,
+        ) -> Union[SheetSchema, None]:
+        '''fast path: the sheet of a file unchanged since it was parsed'''
+        path, size, mtime_ns = file_id
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT key FROM files WHERE path = ? AND schema_version = ? '
+                'AND size = ? AND mtime_ns = ?',
+                (path, schema_version, size, mtime_ns)
+            ).fetchone()
+        if row is None:
+            return None
+        return self.get(row[0])
+
+    def get(self, key: str) -> Union[SheetSchema, None]:
+        data = super().get(key)
+        if data is None:
+            return None
+        try:
+            return SheetSchema.model_validate_json(data)
+        except Exception:
+            # stored by a version of lime with a different SheetSchema
+            return None
+
+    def put(
+            self,
+            key: str,
+            sheet_obj: SheetSchema,
+            file_id: Tuple[str, int, int] = None,
+            schema_version: str = None,
+        ) -> None:
+        data = sheet_obj.model_dump_json()
+        with self.lock:
+            with self.conn:
+                self._insert(key, data)
+                if file_id is not None:
+                    self.conn.execute(
+                        'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                        (file_id[0], schema_version, file_id[1], file_id[2], key)
+                    )
+            self._evict()
+
+    def _delete(self, keys: List[Tuple[str]]) -> None:
+        super()._delete(keys)
+        self.conn.executemany(
+            'DELETE FROM files WHERE key = ?',
+            keys
+        )
+
+
+_parse_caches : Dict[Tuple[int, str], ParseCache] = {}
+
+def get_parse_cache() -> Union[ParseCache, None]:
+    '''
+        The ParseCache of the cache dir if enabled; None if disabled or 
+        it can't be opened (sheets are then just parsed). Connections 
+        aren't shared with forked processes.
+    '''
+    if not(ParseCacheParams.enabled):
+        return None
+    cache_id = (os.getpid(), get_cache_dir())
+    if cache_id not in _parse_caches:
+        try:
+            _parse_caches[cache_id] = ParseCache(cache_dir=cache_id[1])
+        except Exception:
+            return None
+    return _parse_caches[cache_id]
@@ -0,0 +1,122 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import (
+    List,
+    Tuple,
+    Union,
+)
+from ..models.utils import (
+    get_cache_dir,
+)
+
+class SqliteLRUCache:
+    '''
+        Base of the caches kept in a sqlite db in the cache dir: a table
+        of (key, value) text entries, evicted least-recently-used first
+        once their size grows past max_bytes. Subclasses set db_fn, the
+        table / value column names, and can add tables in _create_tables
+        and clean them up in _delete.
+    '''
+    db_fn : str = None
+    table : str = None
+    value_col : str = None
+
+    def __init__(
+            self,
+            cache_dir: str = None,
+            max_bytes: int = None,
+        ) -> None:
+
+        self.cache_dir : str = cache_dir or get_cache_dir()
+        self.max_bytes : int = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.lock = threading.Lock()
+        # --jobs workers share the db, so wait on each other's writes
+        self.conn = sqlite3.connect(
+            os.path.join(self.cache_dir, self.db_fn),
+            check_same_thread=False,
+            timeout=30.0,
+        )
+        with self.conn:
+            self.conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    key             TEXT PRIMARY KEY,
+                    {self.value_col}    TEXT NOT NULL,
+                    nbytes          INTEGER NOT NULL,
+                    accessed        REAL NOT NULL
+                )
+            ''')
+            self.conn.execute(f'''
+                CREATE INDEX IF NOT EXISTS idx_{self.table}_accessed
+                ON {self.table} (accessed)
+            ''')
+            self._create_tables()
+
+    def _create_tables(self) -> None:
+        pass
+
+    def get(self, key: str) -> Union[str, None]:
+        with self.lock:
+            row = self.conn.execute(
+                f'SELECT {self.value_col} FROM {self.table} WHERE key = ?',
+                (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            with self.conn:
+                self.conn.execute(
+                    f'UPDATE {self.table} SET accessed = ? WHERE key = ?',
+                    (time.time(), key)
+                )
+            return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        with self.lock:
+            with self.conn:
+                self._insert(key, value)
+            self._evict()
+
+    def _insert(self, key: str, value: str) -> None:
+        '''called holding the lock, inside a transaction'''
+        nbytes = len(key) + len(value.encode('utf-8', errors='replace'))
+        self.conn.execute(
+            f'INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)',
+            (key, value, nbytes, time.time())
+        )
+
+    def size(self) -> int:
+        row = self.conn.execute(
+            f'SELECT COALESCE(SUM(nbytes), 0) FROM {self.table}'
+        ).fetchone()
+        return row[0]
+
+    def _evict(self) -> None:
+        '''delete least recently used entries until under max_bytes'''
+        if self.max_bytes is None:
+            return
+        excess = self.size() - self.max_bytes
+        if excess <= 0:
+            return
+        rows = self.conn.execute(
+            f'SELECT key, nbytes FROM {self.table} ORDER BY accessed ASC'
+        ).fetchall()
+        evict_keys = []
+        for key, nbytes in rows:
+            if excess <= 0: break
+            evict_keys.append((key,))
+            excess -= nbytes
+        with self.conn:
+            self._delete(evict_keys)
+
+    def _delete(self, keys: List[Tuple[str]]) -> None:
+        self.conn.executemany(
+            f'DELETE FROM {self.table} WHERE key = ?',
+            keys
+        )
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,123 @@
+import os
+import json
+from typing import (
+    Union,
+    Any,
+    List,
+)
+from lime.common.models.internal import (
+    HeaderOutput,
+    QuestionOutput,
+    SheetOutputSchema,
+)
+
+
+class CheckpointJournal:
+    '''
+        Append-only jsonl checkpoint of an eval_sheet run.
+        Each line is a record of either:
+            {"header": HeaderOutput}
+            {"question": QuestionOutput}
+        so checkpointing a question costs the same regardless of how
+        many questions came before it.
+
+        fsync_every:  0 - only flush to the OS (survives process crash)
+                      n - also fsync every n records (survives power loss)
+    '''
+    def __init__(
+            self,
+            fn: str,
+            fsync_every: int = 0,
+            append: bool = False,
+        ) -> None:
+        self.fn : str = fn
+        self.fsync_every : int = fsync_every or 0
+        self.n_unsynced : int = 0
+        self.f = open(fn, 'a' if append else 'w', encoding='utf-8', errors='replace')
+
+    def _write(self, record: str) -> None:
+        self.f.write(record + '\n')
+        self.f.flush()
+        self.n_unsynced += 1
+        if self.fsync_every > 0 and self.n_unsynced >= self.fsync_every:
+            os.fsync(self.f.fileno())
+            self.n_unsynced = 0
+
+    def write_header(self, header: HeaderOutput) -> None:
+        self._write(f'{{"header": {header.model_dump_json()}}}')
+
+    def append(self, question_output: QuestionOutput) -> None:
+        self._write(f'{{"question": {question_output.model_dump_json()}}}')
+
+    def close(self) -> None:
+        if self.f.closed: return
+        if self.fsync_every > 0 and self.n_unsynced > 0:
+            os.fsync(self.f.fileno())
+        self.f.close()
+
+    def __enter__(self) -> 'CheckpointJournal':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+def write_journal(
+        fn: str,
+        header: HeaderOutput,
+        question_outputs: List[QuestionOutput],
+    ) -> None:
+    '''
+        (Re)write a whole journal atomically: written beside fn and 
+        then moved into place, so a crash never leaves it half written.
+    '''
+    part_fn = fn + '.part'
+    with CheckpointJournal(part_fn, fsync_every=1) as journal:
+        journal.write_header(header)
+        for question_output in question_outputs:
+            journal.append(question_output)
+    os.replace(part_fn, fn)
+
+
+def read_journal(fn: str) -> Union[SheetOutputSchema, None]:
+    '''
+        Compact a journal into a SheetOutputSchema.
+        - The last header record wins (a resumed run appends a new one).
+        - A question recorded more than once keeps its latest record
+          but its original position.
+        - A truncated last line (crash mid-write) is ignored.
+        Returns None if no header was recorded.
+    '''
+    header = None
+    questions = {}
+    with open(fn, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if 'header' in record:
+                header = HeaderOutput.model_validate(record['header'])
+            elif 'question' in record:
+                question_output = QuestionOutput.model_validate(record['question'])
+                questions[question_output.name] = question_output
+    if header is None:
+        return None
+    return SheetOutputSchema(
+        header=header,
+        questions=list(questions.values()),
+    )
+
+
+def compact_journal(
+        journal_fn: str,
+        output_fn: str,
+    ) -> Union[SheetOutputSchema, None]:
+    '''
+        Write the compacted journal as the (indented) output json.
+    '''
+    output = read_journal(journal_fn)
+    if output is not None:
+        with open(output_fn, 'w', encoding='utf-8', errors='replace') as f:
+            f.write(output.model_dump_json(indent=2))
+    return output
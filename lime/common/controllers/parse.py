@@ -1,8 +1,20 @@
 import os
+import io
 import json
 import yaml
+import hashlib
+from concurrent.futures import (
+    ProcessPoolExecutor,
+)
 from typing import (
+    Any,
+    Dict,
     List,
+    Tuple,
+    Union,
+    Iterable,
+    Iterator,
+    FrozenSet,
 )
 from pydantic import (
     BaseModel
@@ -13,10 +25,22 @@ from lime.common.models.internal import (
     MdDocument,
     QuestionSchema,
     SheetSchema,
+    QuestionNames,
+)
+from lime.common.cache.parsed_sheet import (
+    ParseCache,
+    get_parse_cache,
 )
 
 ENDCHAR_MD_TOKENS = ['|EVAL-ENDCHAR|', '<EVAL-ENDCHAR>']
 
+# bump when the parser's output for a given sheet changes, so
+# sheets cached by the previous version are parsed again
+PARSER_VERSION = 2
+
+# a parse process is only worth starting for at least this many sheets
+MIN_SHEETS_PER_PARSE_JOB = 16
+
 def strip_end_token(
         text : str,
         endchar_tokens : List[str] = ENDCHAR_MD_TOKENS,
@@ -31,7 +55,10 @@ def parse(
     d_md: dict, 
     check_name: bool = False
 ) -> list:
-
+    '''
+        Deprecated, used by parse_markdown only: scans every line for 
+        every header of d_md. Sheets are parsed by SheetParser.
+    '''
     parsed_markers = []
     for i, line in enumerate(text):
         for obj, md_header in d_md.items():
@@ -61,7 +88,7 @@ def extract_sections(
     parsed_markers: list,
     compress: bool = False,
 ) -> list:
-
+    '''Deprecated, used by parse_markdown only.'''
     sections = []
     for section in parsed_markers:
         section_text = text[section['start']: section['end']]
@@ -119,7 +146,11 @@ def parse_markdown(
     text: str, 
     md_schema: dict
 ) -> MdDocument:
-    
+    '''
+        Deprecated: parses each major section a second time for its 
+        sub-sections. Kept as the reference SheetParser is tested 
+        against; use parse_to_obj / iter_sheet_questions instead.
+    '''
     # parse and extract major sections
     d_md = {obj: md_schema[obj]['md_header'] for obj in md_schema}
 
@@ -212,40 +243,308 @@ def extract_gen_params(meta_data: dict) -> dict:
             except: pass
     return gen_params
 
+def header_depth(line: str) -> int:
+    '''number of `#` of a markdown header line, else 0'''
+    n = len(line) - len(line.lstrip('#'))
+    if n > 0 and line[n:n+1] == ' ':
+        return n
+    return 0
+
+
+class MdSchema:
+    '''
+        md-schema.yaml compiled to dispatch tables: major section type by
+        header depth, and each section type's sub-section header depth 
+        and keywords. Built once per schema file, see get_md_schema().
+        version identifies the schema and PARSER_VERSION.
+    '''
+    def __init__(self, schema: dict) -> None:
+        self.schema : dict = schema
+        self.version : str = hashlib.sha256(
+            json.dumps([schema, PARSER_VERSION], sort_keys=True).encode('utf-8')
+        ).hexdigest()[:16]
+        self.major : Dict[int, str] = {
+            schema[obj]['md_header']: obj for obj in schema
+        }
+        self.minor : Dict[str, Tuple[int, FrozenSet[str]]] = {
+            obj: (
+                schema[obj]['children']['md_header'],
+                frozenset(schema[obj]['children']['options']),
+            )
+            for obj in schema
+        }
+
+
+_md_schemas : Dict[str, MdSchema] = {}
+
+def get_md_schema_fn() -> str:
+    return os.path.join(
+        os.path.dirname(__file__), 
+        '../../data/md-schema.yaml'
+    )
+
+def get_md_schema(md_schema_fn: str = None) -> MdSchema:
+    '''the compiled schema of a md-schema file, loaded once per process'''
+    md_schema_fn = os.path.realpath(md_schema_fn or get_md_schema_fn())
+    md_schema = _md_schemas.get(md_schema_fn)
+    if md_schema is None:
+        with open(md_schema_fn, 'r') as f:
+            md_schema = MdSchema(yaml.safe_load(f))
+        _md_schemas[md_schema_fn] = md_schema
+    return md_schema
+
+
+def iter_md_sections(
+    lines: Iterable[str],
+    md_schema: MdSchema,
+) -> Iterator[Tuple[str, str, List[Tuple[str, str]]]]:
+    '''
+        Single pass over the lines of a sheet, yielding each major section
+        as (section_type, name, [(sub_section_type, text), ...]) once the
+        next one starts. Same rules as parse_markdown: lines before the 
+        first header of their level are dropped, and minor headers not 
+        among the section's options are kept as text.
+    '''
+    major, minor = md_schema.major, md_schema.minor
+
+    section, sub_lines = None, None
+    
+    for line in lines:
+        
+        depth = header_depth(line)
+        
+        if depth in major:
+            if section is not None:
+                if sub_lines is not None:
+                    section[2][-1] = (section[2][-1][0], ''.join(sub_lines))
+                yield section
+            marker = '#' * depth + ' '
+            section = (major[depth], line.replace(marker, '').strip(), [])
+            sub_lines = None
+            continue
+        
+        if section is None:
+            continue
+        
+        sub_depth, options = minor[section[0]]
+        if depth == sub_depth:
+            sub_type = line.replace('#' * depth + ' ', '').strip().lower()
+            if sub_type in options:
+                if sub_lines is not None:
+                    section[2][-1] = (section[2][-1][0], ''.join(sub_lines))
+                section[2].append((sub_type, None))
+                sub_lines = []
+                continue
+        
+        if sub_lines is not None:
+            sub_lines.append(line)
+    
+    if section is not None:
+        if sub_lines is not None:
+            section[2][-1] = (section[2][-1][0], ''.join(sub_lines))
+        yield section
+
+
+class SheetParser:
+    '''
+        Streams QuestionSchema objects from the lines of a sheet with
+        iter_questions(), one per question section as it's read, so a
+        sheet is parsed in one pass and without holding all its text.
+        The sheet's name, meta and text are set once its header is read.
+        Gives the same result as SheetSchema.from_mddoc(parse_markdown())
+        for sheets with their header at the top.
+    '''
+    def __init__(self, md_schema: MdSchema = None) -> None:
+        self.md_schema : MdSchema = md_schema or get_md_schema()
+        self.name : Union[str, None] = None
+        self.meta : Union[Dict[str, str], None] = None
+        self.text : Union[str, None] = None
+        # sheet meta cascaded onto each question's meta
+        self.cascade_meta : Union[Dict[str, str], None] = None
+        self.names : QuestionNames = QuestionNames()
+
+    def read_header(self, name: str, sub_sections: List[Tuple[str, str]]) -> None:
+        self.name, self.meta, self.text = name, None, None
+        for sub_type, text in sub_sections:
+            if sub_type == 'meta':
+                self.cascade_meta = extract_meta_kv(text)
+                if self.meta is None:
+                    self.meta = self.cascade_meta
+            elif sub_type == 'question':
+                if self.text is None:
+                    self.text = strip_end_token(text)
+
+    def read_question(
+            self, 
+            name: str, 
+            sub_sections: List[Tuple[str, str]],
+        ) -> QuestionSchema:
+        meta, text_usr, answer = None, None, None
+        for sub_type, text in sub_sections:
+            if sub_type == 'meta' and meta is None:
+                meta = extract_meta_kv(text)
+                if self.cascade_meta is not None:
+                    meta = {**self.cascade_meta, **meta}
+            elif sub_type == 'question' and text_usr is None:
+                text_usr = strip_end_token(text)
+            elif sub_type == 'answer' and answer is None:
+                answer = strip_end_token(text)
+        parse_warns = []
+        if text_usr is None:
+            text_usr = ''
+            parse_warns.append('text_usr is None')
+        unique_name, is_dup = self.names.add(name)
+        if is_dup:
+            parse_warns.append(f'question name `{name}` is not unique')
+        return QuestionSchema(
+            name=unique_name,
+            meta=meta or {},
+            text_usr=text_usr,
+            text_sys=self.text,
+            answer=answer,
+            parse_warns=parse_warns,
+        )
+
+    def iter_questions(self, lines: Iterable[str]) -> Iterator[QuestionSchema]:
+        for section_type, name, sub_sections in iter_md_sections(lines, self.md_schema):
+            if section_type == 'sheet':
+                self.read_header(name, sub_sections)
+            elif section_type == 'question':
+                yield self.read_question(name, sub_sections)
+            else:
+                raise ValueError(f'Unknown section type: {section_type}')
+
+    def parse(self, lines: Iterable[str]) -> SheetSchema:
+        questions = list(self.iter_questions(lines))
+        return SheetSchema(
+            name=self.name or '',
+            meta=self.meta or {},
+            text=self.text or '',
+            questions=questions,
+        )
+
+
+def iter_sheet_questions(
+    fn: str,
+    md_schema_fn: str = None,
+) -> Iterator[QuestionSchema]:
+    '''questions of a sheet file, parsed as they're read'''
+    parser = SheetParser(get_md_schema(md_schema_fn))
+    with open(fn, 'r') as f:
+        yield from parser.iter_questions(f)
+
+
 def parse_wrapper(
     fn: str,
     md_schema_fn: str,
 ) -> MdDocument:
-
+    '''Deprecated, see parse_markdown.'''
     with open(fn, 'r') as f:
         text = f.readlines()
 
-    with open(md_schema_fn, 'r') as f:
-        md_schema = yaml.safe_load(f)
+    return parse_markdown(text, get_md_schema(md_schema_fn).schema)
 
-    return parse_markdown(text, md_schema)
+
+def parse_cached(
+    fn: str,
+    md_schema: MdSchema,
+    parse_cache: ParseCache,
+) -> SheetSchema:
+    '''
+        A sheet whose size and mtime are unchanged isn't read; otherwise
+        it's read once, hashed, and only parsed if its content isn't
+        in parse_cache.
+    '''
+    file_id = parse_cache.file_id(fn)
+    sheet_obj = parse_cache.get_by_file(file_id, md_schema.version)
+    if sheet_obj is not None:
+        return sheet_obj
+
+    with open(fn, 'rb') as f:
+        content = f.read()
+    
+    key = parse_cache.make_key(content, md_schema.version)
+    sheet_obj = parse_cache.get(key)
+    if sheet_obj is None:
+        # decoded the same as open(fn, 'r')
+        sheet_obj = SheetParser(md_schema).parse(
+            io.TextIOWrapper(io.BytesIO(content))
+        )
+    
+    parse_cache.put(key, sheet_obj, file_id, md_schema.version)
+    return sheet_obj
 
 
 def parse_to_obj(
     fn: str,
     md_schema_fn: str = None,
+    parse_cache: ParseCache = None,
 ) -> SheetSchema:
     
-    if md_schema_fn is None:
-        md_schema_fn = os.path.join(
-            os.path.dirname(__file__), 
-            '../../data/md-schema.yaml'
-        )
-
-    md_doc = parse_wrapper(fn, md_schema_fn)
+    md_schema = get_md_schema(md_schema_fn)
 
-    sheet_obj = SheetSchema.from_mddoc(md_doc)
+    sheet_obj = None
+    if parse_cache is not None:
+        try:
+            sheet_obj = parse_cached(fn, md_schema, parse_cache)
+        except Exception:
+            sheet_obj = None    # e.g. the cache db is locked, parse it
+    
+    if sheet_obj is None:
+        with open(fn, 'r') as f:
+            sheet_obj = SheetParser(md_schema).parse(f)
 
     sheet_obj.sheet_fn = os.path.basename(fn)
 
     return sheet_obj
 
 
+
+def parse_sheet_job(
+    fn: str,
+    md_schema_fn: str = None,
+) -> Tuple[Union[SheetSchema, None], Union[str, None]]:
+    '''(sheet, None) or (None, error) so errors pickle across processes'''
+    try:
+        sheet_obj = parse_to_obj(fn, md_schema_fn, parse_cache=get_parse_cache())
+        return sheet_obj, None
+    except Exception as e:
+        return None, f'{e.__class__.__name__}: {str(e)}'
+
+
+def parse_sheets(
+    fns: List[str],
+    md_schema_fn: str = None,
+    jobs: int = None,
+) -> Tuple[List[Union[SheetSchema, None]], Dict[str, str]]:
+    '''
+        Parse all of fns up front, in a pool of up to `jobs` processes
+        (None for the cpu count) when there are enough sheets to be worth
+        it. Returns the sheets in the order of fns (None where parsing
+        failed), and the error of each sheet which failed.
+    '''
+    jobs = min(
+        jobs or os.cpu_count() or 1,
+        len(fns) // MIN_SHEETS_PER_PARSE_JOB,
+    )
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(
+                parse_sheet_job,
+                fns,
+                [md_schema_fn] * len(fns),
+                chunksize=max(1, len(fns) // (jobs * 4)),
+            ))
+    else:
+        results = [parse_sheet_job(fn, md_schema_fn) for fn in fns]
+
+    sheet_objs = [sheet_obj for sheet_obj, _ in results]
+    errors = {
+        fn: err for fn, (_, err) in zip(fns, results)
+        if err is not None
+    }
+    return sheet_objs, errors
+
 if __name__ == '__main__':
     md_doc = parse_wrapper(
         '../../../../datasets/tmp/one/input-common-sense-2.md',
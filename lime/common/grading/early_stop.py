@@ -0,0 +1,153 @@
+import re
+import json
+from typing import (
+    Any,
+    Dict,
+    List,
+    Union,
+)
+from lime.common.models.state import (
+    ConfigLoader,
+)
+
+class EarlyStopParams(ConfigLoader):
+    '''
+        Defaults for the stop predicate of questions which don't set
+        stop_regex / stop_sequences / stop_answer_len in their meta.
+    '''
+    stop_regex = None
+    stop_sequences = None
+    stop_answer_len = False
+EarlyStopParams._initialize()
+
+
+def is_unset(value: Any) -> bool:
+    '''meta values are strings, so `None` / `null` mean unset too'''
+    return (value is None) or (
+        isinstance(value, str) and value.strip().lower() in ('', 'none', 'null')
+    )
+
+
+def parse_stop_sequences(value: Any) -> List[str]:
+    '''a json list of strings, or a single sequence'''
+    if is_unset(value):
+        return []
+    if isinstance(value, list):
+        return [str(e) for e in value if e]
+    value = str(value)
+    try:
+        data = json.loads(value)
+        if isinstance(data, list):
+            return [str(e) for e in data if e]
+    except ValueError:
+        pass
+    return [value] if value else []
+
+
+def parse_bool(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', 'yes', '1')
+    return bool(value)
+
+
+def answer_pattern(answer: str) -> re.Pattern:
+    '''
+        The answer not run into the words around it: when it starts / 
+        ends with a word char, a non-word char must precede / follow it,
+        so `B` matches "is B." but not "Based" nor (yet) a trailing "B".
+    '''
+    pattern = re.escape(answer)
+    if re.match(r'\w', answer[0]):
+        pattern = r'(?<!\w)' + pattern
+    if re.match(r'\w', answer[-1]):
+        pattern = pattern + r'(?=\W)'
+    return re.compile(pattern)
+
+
+class StopPredicate:
+    '''
+        Decides from the text streamed so far that the rest of a
+        completion can't change its grade, so generation can stop:
+         - stop_regex: the regex is found (the match is kept)
+         - stop_sequences: a sequence is found (cut before it)
+         - stop_answer_len: the completion contains the answer as a
+           whole word; a preamble ("The answer is B.") or a word 
+           starting like the answer ("Based") doesn't stop it
+    '''
+    def __init__(
+            self,
+            regex: str = None,
+            sequences: List[str] = None,
+            ground_truth: str = None,
+        ) -> None:
+        self.regex_str : Union[str, None] = regex
+        self.regex : Union[re.Pattern, None] = (
+            re.compile(regex) if regex else None
+        )
+        self.sequences : List[str] = sequences or []
+        self.ground_truth : Union[str, None] = (
+            ground_truth.strip() if ground_truth else None
+        )
+        self.answer : Union[re.Pattern, None] = (
+            answer_pattern(self.ground_truth) if self.ground_truth else None
+        )
+
+    def find(self, text: str) -> Union[int, None]:
+        '''the length of text to keep if it should stop, else None'''
+        ends = []
+        if self.regex is not None:
+            match = self.regex.search(text)
+            if match is not None:
+                ends.append(match.end())
+        for seq in self.sequences:
+            i = text.find(seq)
+            if i != -1:
+                ends.append(i)
+        if self.answer is not None:
+            if self.answer.search(text) is not None:
+                ends.append(len(text))
+        return min(ends) if ends else None
+
+    def __call__(self, text: str) -> bool:
+        return self.find(text) is not None
+
+    def truncate(self, completion: str) -> str:
+        end = self.find(completion)
+        return completion if end is None else completion[:end]
+
+    def key_data(self) -> Dict[str, Any]:
+        '''settings which change the completion, for cache keys'''
+        return {
+            'stop_regex':       self.regex_str,
+            'stop_sequences':   self.sequences,
+            'stop_answer_word': self.ground_truth,
+        }
+
+
+def get_stop_predicate(
+        meta: Dict[str, Any],
+        ground_truth: str = None,
+    ) -> Union[StopPredicate, None]:
+    '''
+        The stop predicate set by a question's meta (which includes its
+        sheet's meta), falling back on EarlyStopParams; None if early
+        stopping isn't enabled for it.
+    '''
+    regex = meta.get('stop_regex', EarlyStopParams.stop_regex)
+    if is_unset(regex):
+        regex = None
+    sequences = parse_stop_sequences(
+        meta.get('stop_sequences', EarlyStopParams.stop_sequences)
+    )
+    answer_len = parse_bool(
+        meta.get('stop_answer_len', EarlyStopParams.stop_answer_len)
+    )
+    if not(answer_len) or not(ground_truth):
+        ground_truth = None
+    if not(regex) and not(sequences) and (ground_truth is None):
+        return None
+    return StopPredicate(
+        regex=regex,
+        sequences=sequences,
+        ground_truth=ground_truth,
+    )
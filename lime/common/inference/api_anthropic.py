@@ -1,49 +1,374 @@
+from typing import (
+    Any,
+    Dict,
+    List,
+    Union,
+)
+import json
+import asyncio
+import functools
+import threading
 import requests
-from .base import ModelObj
-from ..models.state import Secrets
+import httpx
+from .base import (
+    ModelObj,
+    PromptModelResponse,
+)
+from .tokens import (
+    NTokensCache,
+)
+from .api_openai import (
+    ApiModelName,
+)
+from ..models.errs import (
+    NetworkError,
+)
+from ..models.state import (
+    ConfigLoader,
+    Secrets,
+)
+
+class AnthropicClientParams(ConfigLoader):
+    '''
+        Settings for the http connection pool shared by all requests
+        of an AnthropicModelObj, and for prompt caching of the sheet
+        prompt (sent as the system prompt).
+    '''
+    base_url = 'https://api.anthropic.com'
+    api_version = '2023-06-01'
+    max_connections = 100
+    max_keepalive_connections = 20
+    keepalive_expiry = 30.0
+    connect_timeout = 10.0
+    timeout = 600.0
+    prompt_caching = True
+AnthropicClientParams._initialize()
+
+
+# rough chars per token of claude's tokenizer on english text
+CHARS_PER_TOKEN = 3.5
+
+def approx_ntokens(text: Union[str, None]) -> int:
+    if not text:
+        return 0
+    return max(1, round(len(text) / CHARS_PER_TOKEN))
+
+
+def get_api_model_name(model_name: str) -> str:
+    '''full (dated) name of a claude model given as its short name'''
+    if not model_name.startswith('claude-'):
+        return model_name
+
+    model_name = model_name.replace('.', '-')
+
+    model_mapping = {
+        'claude-3-opus': 'claude-3-opus-20240229',
+        'claude-3-sonnet': 'claude-3-sonnet-20240229',
+        'claude-3-haiku': 'claude-3-haiku-20240307',
+        'claude-3-5-sonnet': 'claude-3-5-sonnet-20240620',
+    }
+
+    for base_name, full_name in model_mapping.items():
+        if model_name == base_name or model_name.startswith(f"{base_name}-"):
+
+            if len(model_name.split('-')) <= 4:
+                model_name = full_name
+            break
+
+    return model_name
+
 
 class AnthropicModelObj(ModelObj):
+    '''
+        Claude models through the Messages api. The sheet prompt is sent
+        as the system prompt marked with cache_control, so the api caches
+        it across the questions of a sheet.
+    '''
     def __init__(self, model_name: str, **kwargs):
-        
-        if model_name.startswith('claude-'):
-
-            model_name = model_name.replace('.', '-')
-            
-            model_mapping = {
-                'claude-3-opus': 'claude-3-opus-20240229',
-                'claude-3-sonnet': 'claude-3-sonnet-20240229',
-                'claude-3-haiku': 'claude-3-haiku-20240307',
-                'claude-3-5-sonnet': 'claude-3-5-sonnet-20240620',
-            }
-            
-            for base_name, full_name in model_mapping.items():
-                if model_name == base_name or model_name.startswith(f"{base_name}-"):
-
-                    if len(model_name.split('-')) <= 4:
-                        model_name = full_name
-                    break
-            
         super().__init__(model_name, **kwargs)
-        self.api_key = kwargs.get('api_key') or kwargs.get('anthropic_api_key') or Secrets.get('ANTHROPIC_API_KEY')
+        self.prompt_model_params : List[str] = [
+            'temperature',
+            'max_tokens',
+        ]
+        self.api_model_name : str = (
+            ApiModelName._to_dict().get(model_name) or
+            kwargs.get('api_model_name') or
+            get_api_model_name(model_name)
+        )
+        self.api_key : Union[str, None] = (
+            kwargs.get('api_key') or
+            kwargs.get('anthropic_api_key') or
+            Secrets.get('ANTHROPIC_API_KEY')
+        )
         if not self.api_key:
             raise ValueError("Anthropic API key not found. Please set the ANTHROPIC_API_KEY environment variable or provide it in kwargs.")
-        self.temperature = kwargs.get('temperature', 0.0)
-        self.max_tokens = kwargs.get('max_tokens', 20)
-        self.seed = kwargs.get('seed')
+        # pool settings: config < model's profile < constructor kwargs
+        self.client_params : Dict[str, Any] = {
+            k: kwargs.get(k, self.profile_params.get(k, v))
+            for k, v in AnthropicClientParams._to_dict().items()
+        }
+        self.client : Union[httpx.Client, None] = None
+        self.aclient : Union[httpx.AsyncClient, None] = None
+        self.aclient_loop : Union[asyncio.AbstractEventLoop, None] = None
+        self.client_lock = threading.Lock()
+        self.ntokens_cache = NTokensCache()
 
-    def prompt_model(self, prompt: str) -> str:
+    def _headers(self) -> Dict[str, str]:
         headers = {
             'x-api-key': self.api_key,
-            'anthropic-version': '2023-06-01',
-            'Content-Type': 'application/json',
+            'anthropic-version': self.client_params.get('api_version'),
+            'content-type': 'application/json',
         }
-        data = {
-            'model': self.model_name,
-            'messages': [{'role': 'user', 'content': prompt}],
-            'temperature': self.temperature,
-            'max_tokens': self.max_tokens,
-            'seed': self.seed,
+        if self.client_params.get('prompt_caching'):
+            headers['anthropic-beta'] = 'prompt-caching-2024-07-31'
+        return headers
+
+    def _http_client_kwargs(self) -> Dict[str, Any]:
+        return {
+            'base_url': self.client_params.get('base_url'),
+            'headers': self._headers(),
+            'limits': httpx.Limits(
+                max_connections=self.client_params.get('max_connections'),
+                max_keepalive_connections=self.client_params.get('max_keepalive_connections'),
+                keepalive_expiry=self.client_params.get('keepalive_expiry'),
+            ),
+            'timeout': httpx.Timeout(
+                self.client_params.get('timeout'),
+                connect=self.client_params.get('connect_timeout'),
+            ),
+        }
+
+    def get_client(self) -> httpx.Client:
+        '''
+            Created once and reused by all prompts, so the connection
+            pool (and TLS sessions) are kept alive between questions.
+            Retries are left to the rate_limiter.
+        '''
+        with self.client_lock:
+            if self.client is None:
+                self.client = httpx.Client(**self._http_client_kwargs())
+        return self.client
+
+    def get_aclient(self) -> httpx.AsyncClient:
+        '''
+            Async connections are bound to an event loop, so the client
+            is reused for as long as the running loop stays the same.
+        '''
+        loop = asyncio.get_running_loop()
+        if (self.aclient is None) or (self.aclient_loop is not loop):
+            self.aclient = httpx.AsyncClient(**self._http_client_kwargs())
+            self.aclient_loop = loop
+        return self.aclient
+
+    def check_valid(self, **kwargs) -> bool:
+        try:
+            response = self.get_client().get(f'/v1/models/{self.api_model_name}')
+            if response.status_code in (401, 403):
+                raise ValueError('Anthropic API key not valid')
+            if response.status_code == 404:
+                raise ValueError(f'model `{self.api_model_name}` not found in models list')
+            response.raise_for_status()
+        except httpx.TransportError:
+            try: requests.get('https://www.google.com/', timeout=2)
+            except requests.ConnectionError:
+                raise NetworkError('No network connection available')
+            raise
+        return True
+
+    def count_tokens(self, text: str) -> int:
+        '''
+            Approximated locally, since the api counts tokens with a 
+            request per text; completions are counted exactly from the 
+            usage of their response.
+        '''
+        ntokens = self.ntokens_cache.get(text)
+        if ntokens is not None:
+            return ntokens
+        return approx_ntokens(text)
+
+    def cache_key_data(self, 
+                       prompt_sys: str = None, 
+                       prompt_usr: str = None, 
+                       gen_params: Dict[str, Any] = {},
+                       ) -> Dict[str, Any]:
+        '''the sheet prompt is sent as the system prompt, so keyed apart'''
+        key_data = super().cache_key_data(prompt_sys, prompt_usr, gen_params)
+        key_data.pop('prompt')
+        return {
+            **key_data,
+            'prompt_sys':   prompt_sys or '',
+            'prompt_usr':   prompt_usr or '',
         }
-        response = requests.post('https://api.anthropic.com/v1/messages', headers=headers, json=data)
-        response.raise_for_status()
-        return response.json().get('content', [{}])[0].get('text', '')
\ No newline at end of file
+
+    def _build_request(self,
+                       prompt_sys: str = None,
+                       prompt_usr: str = None,
+                       **kwargs
+                       ) -> Dict[str, Any]:
+        '''body of a /v1/messages request'''
+        params = {
+            k: v for k, v in self.gen_params.items()
+            if k in self.prompt_model_params
+        }
+        params.update({
+            k: v
+            for k, v in kwargs.items()
+            if k in self.prompt_model_params
+        })
+
+        if not(prompt_usr):
+            prompt_sys, prompt_usr = None, prompt_sys or ''
+
+        request = {
+            'model': self.api_model_name,
+            'messages': [{'role': 'user', 'content': prompt_usr}],
+            **params,
+        }
+        if prompt_sys:
+            system = {'type': 'text', 'text': prompt_sys}
+            if self.client_params.get('prompt_caching'):
+                system['cache_control'] = {'type': 'ephemeral'}
+            request['system'] = [system]
+        return request
+
+    def _get_completion(self, data: Dict[str, Any]) -> str:
+        completion = ''.join(
+            block.get('text', '') for block in data.get('content', [])
+            if block.get('type', 'text') == 'text'
+        )
+        output_tokens = data.get('usage', {}).get('output_tokens')
+        if output_tokens is not None:
+            self.ntokens_cache.set(completion, output_tokens)
+        return completion
+
+    @staticmethod
+    def _parse_event(line: str) -> Union[Dict[str, Any], None]:
+        '''a server-sent event's data, or None for other lines'''
+        if not line.startswith('data:'):
+            return None
+        event = json.loads(line[len('data:'):])
+        if event.get('type') == 'error':
+            raise ValueError(event.get('error', {}).get('message'))
+        return event
+
+    def _post(self,
+              request: Dict[str, Any],
+              progress_cb: callable = None,
+              ) -> PromptModelResponse:
+        '''
+            With a progress_cb, the completion's text deltas are streamed
+            to it, and the stream is dropped when it returns True.
+        '''
+        try:
+            client = self.get_client()
+
+            if progress_cb is None:
+                response = client.post('/v1/messages', json=request)
+                response.raise_for_status()
+                return PromptModelResponse(self._get_completion(response.json()), None)
+
+            chunks, usage = [], {}
+            with client.stream(
+                'POST', '/v1/messages', json={**request, 'stream': True},
+            ) as response:
+                if response.status_code >= 400:
+                    response.read()
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    event = self._parse_event(line)
+                    if not self._on_event(event, chunks, usage, progress_cb):
+                        break
+            return PromptModelResponse(self._end_stream(chunks, usage), None)
+
+        except Exception as e:
+            return PromptModelResponse(None, e)
+
+    async def _apost(self,
+                     request: Dict[str, Any],
+                     progress_cb: callable = None,
+                     ) -> PromptModelResponse:
+        try:
+            client = self.get_aclient()
+
+            if progress_cb is None:
+                response = await client.post('/v1/messages', json=request)
+                response.raise_for_status()
+                return PromptModelResponse(self._get_completion(response.json()), None)
+
+            chunks, usage = [], {}
+            async with client.stream(
+                'POST', '/v1/messages', json={**request, 'stream': True},
+            ) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    event = self._parse_event(line)
+                    if not self._on_event(event, chunks, usage, progress_cb):
+                        break
+            return PromptModelResponse(self._end_stream(chunks, usage), None)
+
+        except Exception as e:
+            return PromptModelResponse(None, e)
+
+    @staticmethod
+    def _on_event(
+            event: Union[Dict[str, Any], None],
+            chunks: List[str],
+            usage: Dict[str, Any],
+            progress_cb: callable,
+        ) -> bool:
+        '''handle a streamed event; False once the stream should end'''
+        if event is None:
+            return True
+        if event.get('type') == 'message_delta':
+            usage.update(event.get('usage', {}))
+        elif event.get('type') == 'message_stop':
+            return False
+        elif event.get('type') == 'content_block_delta':
+            s_chunk = event.get('delta', {}).get('text')
+            if s_chunk:
+                chunks.append(s_chunk)
+                if progress_cb(s_chunk):
+                    return False
+        return True
+
+    def _end_stream(self, chunks: List[str], usage: Dict[str, Any]) -> str:
+        completion = ''.join(chunks)
+        if usage.get('output_tokens') is not None:
+            self.ntokens_cache.set(completion, usage['output_tokens'])
+        return completion
+
+    def prompt_model(self,
+                     prompt_sys: str = None,
+                     prompt_usr: str = None,
+                     progress_cb: callable = None,
+                     **kwargs
+                     ) -> PromptModelResponse:
+        try:
+            request = self._build_request(prompt_sys, prompt_usr, **kwargs)
+        except Exception as e:
+            return PromptModelResponse(None, e)
+
+        return self.rate_limiter.call(
+            functools.partial(self._post, request, progress_cb),
+            self.limit_ntokens(prompt_sys, prompt_usr, **kwargs),
+            on_retry=getattr(progress_cb, 'reset', None),
+        )
+
+    async def aprompt_model(self,
+                     prompt_sys: str = None,
+                     prompt_usr: str = None,
+                     progress_cb: callable = None,
+                     **kwargs
+                     ) -> PromptModelResponse:
+        try:
+            request = self._build_request(prompt_sys, prompt_usr, **kwargs)
+        except Exception as e:
+            return PromptModelResponse(None, e)
+
+        return await self.rate_limiter.acall(
+            functools.partial(self._apost, request, progress_cb),
+            self.limit_ntokens(prompt_sys, prompt_usr, **kwargs),
+            on_retry=getattr(progress_cb, 'reset', None),
+        )
@@ -1,12 +1,17 @@
 from typing import (
     Any,
+    Dict,
     Tuple,
     Union,
 )
+import asyncio
+import functools
+import threading
 import requests
-import tiktoken
+import httpx
 from openai import (
     OpenAI, 
+    AsyncOpenAI,
     AuthenticationError,
     ChatCompletion,
 )
@@ -14,6 +19,10 @@ from .base import (
     PromptModelResponse,
     ModelObj,
 )
+from .tokens import (
+    NTokensCache,
+    get_tiktoken_encoder,
+)
 from ..models.errs import (
     NetworkError,
 )
@@ -33,6 +42,17 @@ class ApiModelName(ConfigLoader):
     }
 ApiModelName._initialize()
 
+class OpenAIClientParams(ConfigLoader):
+    '''
+        Settings for the http connection pool shared by all requests
+        of an OpenAIModelObj.
+    '''
+    max_connections = 100
+    max_keepalive_connections = 20
+    keepalive_expiry = 30.0
+    timeout = 600.0
+OpenAIClientParams._initialize()
+
 
 class OpenAIModelObj(ModelObj):
 
@@ -52,10 +72,61 @@ class OpenAIModelObj(ModelObj):
             kwargs.get('api_model_name') or
             self.model_name
         )
+        # pool settings: config < model's profile < constructor kwargs
+        self.client_params : Dict[str, Any] = {
+            k: kwargs.get(k, self.profile_params.get(k, v))
+            for k, v in OpenAIClientParams._to_dict().items()
+        }
+        self.client : Union[OpenAI, None] = None
+        self.aclient : Union[AsyncOpenAI, None] = None
+        self.aclient_loop : Union[asyncio.AbstractEventLoop, None] = None
+        self.client_lock = threading.Lock()
+        self.encoder : Any = None
+        self.ntokens_cache = NTokensCache()
+
+    def _http_client_kwargs(self) -> Dict[str, Any]:
+        return {
+            'limits': httpx.Limits(
+                max_connections=self.client_params.get('max_connections'),
+                max_keepalive_connections=self.client_params.get('max_keepalive_connections'),
+                keepalive_expiry=self.client_params.get('keepalive_expiry'),
+            ),
+            'timeout': self.client_params.get('timeout'),
+        }
+
+    def get_client(self) -> OpenAI:
+        '''
+            Created once and reused by all prompts, so the connection 
+            pool (and TLS sessions) are kept alive between questions.
+            Retries are left to the rate_limiter.
+        '''
+        with self.client_lock:
+            if self.client is None:
+                self.client = OpenAI(
+                    api_key=module_api_key,
+                    max_retries=0,
+                    http_client=httpx.Client(**self._http_client_kwargs()),
+                )
+        return self.client
+
+    def get_aclient(self) -> AsyncOpenAI:
+        '''
+            Async connections are bound to an event loop, so the client
+            is reused for as long as the running loop stays the same.
+        '''
+        loop = asyncio.get_running_loop()
+        if (self.aclient is None) or (self.aclient_loop is not loop):
+            self.aclient = AsyncOpenAI(
+                api_key=module_api_key,
+                max_retries=0,
+                http_client=httpx.AsyncClient(**self._http_client_kwargs()),
+            )
+            self.aclient_loop = loop
+        return self.aclient
 
     def check_valid(self, **kwargs) -> bool:
         try: 
-            client = OpenAI(api_key=module_api_key)
+            client = self.get_client()
             models_list = client.models.list()
             if self.api_model_name not in [m.id for m in models_list.data]:
                 raise ValueError(f'model `{self.api_model_name}` not found in models list')
@@ -70,48 +141,111 @@ class OpenAIModelObj(ModelObj):
     
     def count_tokens(self, text: str) -> int:
         '''wont be exact due to system message payload style'''
+        ntokens = self.ntokens_cache.get(text)
+        if ntokens is not None:
+            return ntokens
         try:
-            return len(
-                tiktoken.encoding_for_model(self.model_name)
-                .encode(text)
-            )
+            if self.encoder is None:
+                self.encoder = get_tiktoken_encoder(self.model_name)
+            ntokens = len(self.encoder.encode(text))
         except:
             return -1
+        self.ntokens_cache.set(text, ntokens)
+        return ntokens
     
-    def prompt_model(self, 
-                     prompt_sys: str, 
-                     prompt_usr: str, 
-                     progress_cb: callable = None,
-                     **kwargs
-                    ) -> PromptModelResponse:
+    def _build_request(self, 
+                       prompt_sys: str, 
+                       prompt_usr: str, 
+                       **kwargs
+                       ) -> Dict[str, Any]:
+        '''kwargs for client.chat.completions.create'''
+        params = self.gen_params.copy()
+        
+        params.update({
+            k: v 
+            for k, v in kwargs.items()
+            if k in self.prompt_model_params
+        })
+
+        prompt = (
+            (prompt_sys if prompt_sys else '') +
+            (prompt_usr if prompt_usr else '')
+        )
+
+        return {
+            'messages': [
+                {
+                    "role": "user",
+                    "content": prompt,
+                }
+            ],
+            'model': self.api_model_name,
+            **params,
+        }
+    
+    def _create_completion(self, 
+                           request: Dict[str, Any],
+                           progress_cb: callable = None,
+                           ) -> PromptModelResponse:
+        '''
+            With a progress_cb, the completion is streamed to it, and
+            stopped early when it returns True.
+        '''
         try:
 
-            client = OpenAI(
-                api_key=module_api_key,
+            if progress_cb is not None:
+                stream = self.get_client().chat.completions.create(
+                    **request,
+                    stream=True,
+                )
+                chunks = []
+                for chunk in stream:
+                    s_chunk = self._get_chunk(chunk)
+                    if s_chunk:
+                        chunks.append(s_chunk)
+                        if progress_cb(s_chunk):
+                            # closing the response stops the generation
+                            if hasattr(stream, 'close'):
+                                stream.close()
+                            break
+                return PromptModelResponse(''.join(chunks), None)
+
+            chat_completion = self.get_client().chat.completions.create(
+                **request
             )
 
-            params = self.gen_params.copy()
+            s_completion = self._get_completion(chat_completion)
             
-            params.update({
-                k: v 
-                for k, v in kwargs.items()
-                if k in self.prompt_model_params
-            })
-
-            prompt = (
-                (prompt_sys if prompt_sys else '') +
-                (prompt_usr if prompt_usr else '')
-            )
+            return PromptModelResponse(s_completion, None)
+        
+        except Exception as e:
             
-            chat_completion = client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt,
-                    }
-                ],    
-                model=self.api_model_name,
-                **params,
+            return PromptModelResponse(None, e)
+    
+    async def _acreate_completion(self, 
+                                  request: Dict[str, Any],
+                                  progress_cb: callable = None,
+                                  ) -> PromptModelResponse:
+        try:
+
+            if progress_cb is not None:
+                stream = await self.get_aclient().chat.completions.create(
+                    **request,
+                    stream=True,
+                )
+                chunks = []
+                async for chunk in stream:
+                    s_chunk = self._get_chunk(chunk)
+                    if s_chunk:
+                        chunks.append(s_chunk)
+                        if progress_cb(s_chunk):
+                            if hasattr(stream, 'close'):
+                                await stream.close()
+                            break
+                return PromptModelResponse(''.join(chunks), None)
+
+            chat_completion = await self.get_aclient().chat.completions.create(
+                **request
             )
 
             s_completion = self._get_completion(chat_completion)
@@ -122,9 +256,50 @@ class OpenAIModelObj(ModelObj):
             
             return PromptModelResponse(None, e)
     
+    def prompt_model(self, 
+                     prompt_sys: str, 
+                     prompt_usr: str, 
+                     progress_cb: callable = None,
+                     **kwargs
+                    ) -> PromptModelResponse:
+        try:
+            request = self._build_request(prompt_sys, prompt_usr, **kwargs)
+        except Exception as e:
+            return PromptModelResponse(None, e)
+        
+        return self.rate_limiter.call(
+            functools.partial(self._create_completion, request, progress_cb),
+            self.limit_ntokens(prompt_sys, prompt_usr, **kwargs),
+            on_retry=getattr(progress_cb, 'reset', None),
+        )
+    
+    async def aprompt_model(self, 
+                     prompt_sys: str, 
+                     prompt_usr: str, 
+                     progress_cb: callable = None,
+                     **kwargs
+                    ) -> PromptModelResponse:
+        try:
+            request = self._build_request(prompt_sys, prompt_usr, **kwargs)
+        except Exception as e:
+            return PromptModelResponse(None, e)
+        
+        return await self.rate_limiter.acall(
+            functools.partial(self._acreate_completion, request, progress_cb),
+            self.limit_ntokens(prompt_sys, prompt_usr, **kwargs),
+            on_retry=getattr(progress_cb, 'reset', None),
+        )
+    
     @staticmethod
     def _get_completion(chat_completion: ChatCompletion) -> str:
         return chat_completion.choices[0].message.content
+
+    @staticmethod
+    def _get_chunk(chunk: Any) -> Union[str, None]:
+        '''text of a streamed chunk; the last chunks may have no choices'''
+        if not chunk.choices:
+            return None
+        return chunk.choices[0].delta.content
         
 
 if __name__ == '__main__':
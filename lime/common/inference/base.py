@@ -1,3 +1,5 @@
+import asyncio
+import functools
 from typing import (
     Union, 
     Any, 
@@ -9,6 +11,10 @@ from typing import (
 from ..models.state import (
     ConfigLoader,
 )
+from .ratelimit import (
+    RateLimiter,
+    get_rate_limiter,
+)
 
 class LocalParams(ConfigLoader):
     max_tokens = 100
@@ -52,13 +58,17 @@ class ModelObj:
         self.use_prompt_cache : bool = kwargs.get('use_prompt_cache', False)
         self.gen_params : Dict[str, Any] = LocalParams._to_dict()
         self.prompt_model_params : List[str] = []
+        self.thread_safe : bool = True
         
         ModelProfileParams._initialize_for_model(model_name)
         self.profile_params = ModelProfileParams._to_dict()
         self.gen_params = {
             k: self.profile_params.get(k) or v
             for k, v in self.gen_params.items()
-        }    
+        }
+        self.rate_limiter : RateLimiter = get_rate_limiter(
+            model_name, self.profile_params, **kwargs
+        )
     def get_gen_params(self) -> Dict[str, Any]:
         return self.gen_params
     def update_gen_params(self, gen_params: dict) -> None:
@@ -67,6 +77,43 @@ class ModelObj:
         )
     def validate_gen_params(self, gen_params: dict) -> dict:
         return gen_params
+    def cache_key_data(self, 
+                       prompt_sys: str = None, 
+                       prompt_usr: str = None, 
+                       gen_params: Dict[str, Any] = {},
+                       ) -> Dict[str, Any]:
+        '''
+            Everything which determines the completion of a prompt,
+            used to key the completion cache.
+        '''
+        return {
+            'model_name':       self.model_name,
+            'api_model_name':   getattr(self, 'api_model_name', None),
+            'prompt':           (prompt_sys or '') + (prompt_usr or ''),
+            'gen_params':       {**self.get_gen_params(), **gen_params},
+            'profile_params':   self.profile_params,
+        }
+    def limit_ntokens(self, 
+                      prompt_sys: str = None, 
+                      prompt_usr: str = None, 
+                      **kwargs
+                      ) -> int:
+        '''
+            Tokens a prompt is charged against the rate_limiter's tpm:
+            the prompt plus the max_tokens it can generate.
+        '''
+        if self.rate_limiter.tpm_bucket is None:
+            return 0
+        prompt = (
+            (prompt_sys if prompt_sys else '') +
+            (prompt_usr if prompt_usr else '')
+        )
+        try:
+            ntokens = max(0, self.count_tokens(prompt))
+        except Exception:
+            ntokens = 0
+        max_tokens = kwargs.get('max_tokens', self.gen_params.get('max_tokens'))
+        return ntokens + int(max_tokens or 0)
     def check_valid(self, **kwargs) -> bool:
         raise NotImplementedError
     def count_tokens(self, text: str) -> int:
@@ -78,3 +125,25 @@ class ModelObj:
                      **kwargs
                      ) -> PromptModelResponse:
         raise NotImplementedError
+    async def aprompt_model(self, 
+                     prompt_sys: str = None, 
+                     prompt_usr: str = None, 
+                     progress_cb: callable = None,
+                     **kwargs
+                     ) -> PromptModelResponse:
+        '''
+            Async contract for prompt_model. Variants which have a native
+            async client override this, by default the blocking 
+            prompt_model is run in the loop's default thread executor.
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None,
+            functools.partial(
+                self.prompt_model,
+                prompt_sys=prompt_sys,
+                prompt_usr=prompt_usr,
+                progress_cb=progress_cb,
+                **kwargs
+            )
+        )
@@ -4,12 +4,21 @@ from typing import (
     Dict,
     Union,
 )
+import gzip
+import json
+import asyncio
+import threading
 import requests
-import tiktoken
+import httpx
+from requests.adapters import HTTPAdapter
 from .base import (
     PromptModelResponse,
     ModelObj,
 )
+from .tokens import (
+    NTokensCache,
+    get_tiktoken_encoder,
+)
 from ..models.state import (
     ConfigLoader,
     Secrets,
@@ -25,9 +34,21 @@ class CplClientParams(ConfigLoader):
     valid_request_args = None  
 CplClientParams._initialize()
 
+class CplClientConnection(ConfigLoader):
+    '''
+        Connection settings for the client's session, kept separate from 
+        CplClientParams since those are sent in the request payload.
+    '''
+    pool_size = 10
+    keep_alive = True
+    connect_timeout = 5.0
+    read_timeout = 600.0
+    gzip_payload = False
+CplClientConnection._initialize()
+
 class CPLModelObj(ModelObj):
     
-    def __init__(self, model_name: str) -> None:
+    def __init__(self, model_name: str, **kwargs) -> None:
         super().__init__(model_name)
         self.profile_params : Dict[str, Any] = {
             **CplClientParams._to_dict(), 
@@ -37,12 +58,82 @@ class CPLModelObj(ModelObj):
         self.base_url : str = f'http://{CplServer.domain}:{CplServer.port}'
         self.endpoint_check : str = '/check'
         self.endpoint_infer : str = '/infer'
+        self.conn_params : Dict[str, Any] = {
+            k: kwargs.get(k, v)
+            for k, v in CplClientConnection._to_dict().items()
+        }
+        self.session : Union[requests.Session, None] = None
+        self.asession : Union[httpx.AsyncClient, None] = None
+        self.asession_loop : Union[asyncio.AbstractEventLoop, None] = None
+        self.session_lock = threading.Lock()
+        self.encoder : Any = None
+        self.ntokens_cache = NTokensCache()
+
+    def _headers(self) -> Dict[str, str]:
+        headers = {'Content-Type': 'application/json'}
+        if not(self.conn_params.get('keep_alive')):
+            headers['Connection'] = 'close'
+        return headers
+
+    def get_session(self) -> requests.Session:
+        '''
+            Persistent session so the tcp connection(s) to the server 
+            are pooled and kept alive across questions.
+        '''
+        with self.session_lock:
+            if self.session is None:
+                pool_size = self.conn_params.get('pool_size')
+                adapter = HTTPAdapter(
+                    pool_connections=1, 
+                    pool_maxsize=pool_size,
+                )
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update(self._headers())
+                self.session = session
+        return self.session
+
+    def get_asession(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if (self.asession is None) or (self.asession_loop is not loop):
+            pool_size = self.conn_params.get('pool_size')
+            self.asession = httpx.AsyncClient(
+                headers=self._headers(),
+                limits=httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=(
+                        pool_size if self.conn_params.get('keep_alive') else 0
+                    ),
+                ),
+                timeout=httpx.Timeout(
+                    self.conn_params.get('read_timeout'),
+                    connect=self.conn_params.get('connect_timeout'),
+                ),
+            )
+            self.asession_loop = loop
+        return self.asession
+
+    def get_timeout(self) -> tuple:
+        return (
+            self.conn_params.get('connect_timeout'),
+            self.conn_params.get('read_timeout'),
+        )
+
+    def _encode_payload(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        '''kwargs for the post request: json, or gzip'd json as data'''
+        if not(self.conn_params.get('gzip_payload')):
+            return {'json': payload}
+        return {
+            'data': gzip.compress(json.dumps(payload).encode('utf-8')),
+            'headers': {'Content-Encoding': 'gzip'},
+        }
 
     def check_valid(self, **kwargs) -> bool:
         try:
-            response = requests.get(
+            response = self.get_session().get(
                 self.base_url + self.endpoint_check,
-                timeout=5
+                timeout=(self.conn_params.get('connect_timeout'), 5)
             )
             data = response.json() 
             if data.get('status') != 'ok':
@@ -51,6 +142,113 @@ class CPLModelObj(ModelObj):
         except Exception as e:
             raise ValueError(f'Exception in check_valid (cpl). Message: {str(e)}')
 
+    def _build_payload(self, 
+                       prompt_sys: str = None, 
+                       prompt_usr: str = None, 
+                       **kwargs
+                       ) -> Dict[str, Any]:
+        
+        req_params = {**self.profile_params.copy(), **kwargs}
+
+        if self.valid_request_args:
+            req_params = {
+                k:v for k,v in req_params.items() 
+                if k in self.valid_request_args
+            }
+
+        prompt = (
+            (prompt_sys if prompt_sys else '') +
+            (prompt_usr if prompt_usr else '')
+        )
+        
+        return {
+            'question': prompt,
+            **req_params,
+        }
+    
+    @staticmethod
+    def _parse_response(response: Any) -> PromptModelResponse:
+        '''response can be either a requests or httpx Response'''
+        completion, error = None, None
+        
+        if response.status_code < 400:
+            try:
+                result = response.json()
+                completion = result['answer']
+            except Exception as e:
+                error = ValueError(f'Error parsing infer_cpl response: {e}')
+        else:
+            try: 
+                server_err_text = response.json().get('error')
+            except: 
+                server_err_text = 'could not parse server error message'
+            error = ValueError(f'Error: {response.status_code} - {server_err_text}')
+        
+        return PromptModelResponse(completion, error)
+
+    @staticmethod
+    def _is_streamed(response: Any) -> bool:
+        '''
+            Servers which don't stream ignore the stream param and send 
+            the usual json {'answer': ...} response.
+        '''
+        content_type = response.headers.get('content-type', '')
+        return 'application/json' not in content_type.lower()
+
+    def _prompt_stream(self, 
+                       payload: Dict[str, Any], 
+                       progress_cb: callable,
+                       ) -> PromptModelResponse:
+        '''
+            The server sends the answer as plain text chunks; when 
+            progress_cb returns True the connection is dropped early.
+            A json response is parsed whole and passed to progress_cb.
+        '''
+        with self.get_session().post(
+            self.base_url + self.endpoint_infer,
+            params={'stream': 1},
+            stream=True,
+            timeout=self.get_timeout(),
+            **self._encode_payload(payload),
+        ) as response:
+            if (response.status_code >= 400) or not(self._is_streamed(response)):
+                completion, error = self._parse_response(response)
+                if completion is not None:
+                    progress_cb(completion)
+                return PromptModelResponse(completion, error)
+            response.encoding = 'utf-8'
+            chunks = []
+            for chunk in response.iter_content(chunk_size=None, decode_unicode=True):
+                if chunk:
+                    chunks.append(chunk)
+                    if progress_cb(chunk):
+                        break   # the response is closed on exit
+            return PromptModelResponse(''.join(chunks), None)
+
+    async def _aprompt_stream(self, 
+                              payload: Dict[str, Any], 
+                              progress_cb: callable,
+                              ) -> PromptModelResponse:
+        async with self.get_asession().stream(
+            'POST',
+            self.base_url + self.endpoint_infer,
+            params={'stream': 1},
+            **self._encode_payload(payload),
+        ) as response:
+            if (response.status_code >= 400) or not(self._is_streamed(response)):
+                await response.aread()
+                completion, error = self._parse_response(response)
+                if completion is not None:
+                    progress_cb(completion)
+                return PromptModelResponse(completion, error)
+            chunks = []
+            async for chunk in response.aiter_text():
+                if chunk:
+                    chunks.append(chunk)
+                    if progress_cb(chunk):
+                        break   # the response is closed on exit
+            return PromptModelResponse(''.join(chunks), None)
+
     def prompt_model(self, 
                      prompt_sys: str = None, 
                      prompt_usr: str = None, 
@@ -60,45 +258,42 @@ class CPLModelObj(ModelObj):
         
         try:
             
-            req_params = {**self.profile_params.copy(), **kwargs}
+            payload = self._build_payload(prompt_sys, prompt_usr, **kwargs)
 
-            if self.valid_request_args:
-                req_params = {
-                    k:v for k,v in req_params.items() 
-                    if k in self.valid_request_args
-                }
+            if progress_cb is not None:
+                return self._prompt_stream(payload, progress_cb)
 
-            prompt = (
-                (prompt_sys if prompt_sys else '') +
-                (prompt_usr if prompt_usr else '')
+            response = self.get_session().post(
+                self.base_url + self.endpoint_infer,
+                timeout=self.get_timeout(),
+                **self._encode_payload(payload),
             )
             
-            payload = {
-                'question': prompt,
-                **req_params,
-            }
+            return self._parse_response(response)
+        
+        except Exception as e:
+            return PromptModelResponse(None, e)
+
+    async def aprompt_model(self, 
+                     prompt_sys: str = None, 
+                     prompt_usr: str = None, 
+                     progress_cb: callable = None,
+                     **kwargs
+                     ) -> PromptModelResponse:
+        
+        try:
             
-            response = requests.post(
+            payload = self._build_payload(prompt_sys, prompt_usr, **kwargs)
+
+            if progress_cb is not None:
+                return await self._aprompt_stream(payload, progress_cb)
+
+            response = await self.get_asession().post(
                 self.base_url + self.endpoint_infer,
-                json=payload
+                **self._encode_payload(payload),
             )
             
-            completion, error = None, None
-            
-            if response.status_code < 400:
-                try:
-                    result = response.json()
-                    completion = result['answer']
-                except Exception as e:
-                    error = ValueError(f'Error parsing infer_cpl response: {e}')
-            else:
-                try: 
-                    server_err_text = response.json().get('error')
-                except: 
-                    server_err_text = 'could not parse server error message'
-                error = ValueError(f'Error: {response.status_code} - {server_err_text}')
-            
-            return PromptModelResponse(completion, error)
+            return self._parse_response(response)
         
         except Exception as e:
             return PromptModelResponse(None, e)
@@ -110,12 +305,14 @@ class CPLModelObj(ModelObj):
         '''TODO - switch on base model type: local or oai'''
         # m = LocalModel(self.model_name, vocab_only=True)
         # return m.num_tokens(text)
+        ntokens = self.ntokens_cache.get(text)
+        if ntokens is not None:
+            return ntokens
         try:
-            return len(
-                tiktoken.encoding_for_model(self.model_name)
-                .encode(text)
-            )
+            if self.encoder is None:
+                self.encoder = get_tiktoken_encoder(self.model_name)
+            ntokens = len(self.encoder.encode(text))
         except:
             return -1
-
-    
+        self.ntokens_cache.set(text, ntokens)
+        return ntokens
@@ -1,13 +1,18 @@
+import gzip
+import json
+import itertools
 from typing import (
     List,
     Dict,
     Any,
+    Iterator,
 )
 from flask import (
     Flask, 
     Response,
     request, 
     jsonify,
+    stream_with_context,
 )
 from ..models.state import (
     ConfigLoader,
@@ -65,9 +70,14 @@ class CPLBaseServer:
             Shouldnt need to override this method, instead:
              - override generate_answer()
              - add required keys to self.required_infer_keys
+            With ?stream=1 the answer is sent as plain text chunks
+            from generate_answer_stream().
         '''
         try:
-            data = request.get_json()
+            if request.content_encoding == 'gzip':
+                data = json.loads(gzip.decompress(request.get_data()))
+            else:
+                data = request.get_json()
         except Exception as e:
             return jsonify({'error': f'could not parse json payload: {str(e)}'}), 400
         
@@ -76,6 +86,17 @@ class CPLBaseServer:
         except AssertionError as e:
             return jsonify({'error': str(e)}) , 400
         
+        if request.args.get('stream'):
+            try:
+                chunks = iter(self.generate_answer_stream(**data))
+                first = next(chunks, '')
+            except Exception as e:
+                return jsonify({'error': f'Error on generate_answer: {str(e)}'}), 500
+            return Response(
+                stream_with_context(itertools.chain([first], chunks)),
+                mimetype='text/plain; charset=utf-8',
+            )
+
         try:
             answer = self.generate_answer(**data)
         except Exception as e:
@@ -99,6 +120,13 @@ class CPLBaseServer:
         '''
         raise NotImplementedError
 
+    def generate_answer_stream(self, question: str, **kwargs) -> Iterator[str]:
+        '''
+            Override this method to stream the answer in chunks; by default
+            the whole answer of generate_answer() is sent as one chunk.
+        '''
+        yield self.generate_answer(question, **kwargs)
+
     def run(self, **kwargs):
         '''
             Call this method on your inherited class to start server.
@@ -2,8 +2,8 @@ from typing import Union, Any, Dict, List
 from ..models.state import (
     ConfigLoader,
     Secrets,
+    default_config_obj,
 )
-from ..models.config import default_config_obj
 from .api_openai import (
     OpenAIModelObj,
 )
@@ -18,6 +18,13 @@ from .cpl_client import (
 from .api_anthropic import (
     AnthropicModelObj, 
 )
+from .model_server import (
+    ModelServerParams,
+    read_server_info,
+)
+from .model_client import (
+    ServedModelObj,
+)
 
 class ModelNameTypes(ConfigLoader):
     _urn = {
@@ -38,6 +45,7 @@ ModelObjVariant =  Union[
         LocalModelObj, 
         CPLModelObj,
         AnthropicModelObj,
+        ServedModelObj,
     ]
 
 
@@ -61,6 +69,11 @@ def get_infer_obj(model_name: str, **kwargs) -> ModelObjVariant:
           (model_name.startswith('cpl') and (model_type is None))):
         return CPLModelObj(model_name, **params)
     
+    elif ((model_type in ('local', None)) and 
+          ModelServerParams.use_server and
+          (read_server_info(model_name) is not None)):
+        return ServedModelObj(model_name, **params)
+    
     elif (model_type == 'local'):
         if not(llama_cpp_loaded):
             raise ValueError(f'llama_cpp not loaded; local model {model_name} not available')
@@ -1,21 +1,39 @@
 import os
 import io
+import codecs
 import ctypes
+import inspect
+from array import array
 from contextlib import redirect_stderr
 from typing import (
     Any,
     Dict,
     List,
+    Tuple,
     Union,
 )
+import numpy as np
 from .base import (
     PromptModelResponse,
     ModelObj,
 )
+from .tokens import (
+    NTokensCache,
+)
+from .prefix_cache import (
+    PrefixCache,
+    common_prefix_len,
+)
+from ..cache.llama_state import (
+    LlamaStateCacheParams,
+    LlamaStateStore,
+    get_file_hash,
+)
 from ..models.state import (
     ConfigLoader,
 )
 try:
+    import llama_cpp
     from llama_cpp import (
         Llama, 
         LlamaState,
@@ -39,6 +57,60 @@ class LocalModelFns(ConfigLoader):
 LocalModelFns._initialize()
 
 
+def get_cpu_count() -> int:
+    '''cpus this process can run on'''
+    try: return len(os.sched_getaffinity(0))
+    except AttributeError: return os.cpu_count() or 1
+
+
+# processes running models at once on this machine's cpus (--jobs)
+_n_procs = 1
+
+def share_cpus(n_procs: int) -> None:
+    '''called in each of n_procs worker processes, see get_init_params'''
+    global _n_procs
+    _n_procs = max(1, n_procs)
+
+
+class LocalModelInitParams(ConfigLoader):
+    '''
+        Llama constructor params, can be overridden in a model's profile.
+        n_threads / n_threads_batch of None are set from the cpu count: 
+        generation runs best on about one thread per physical core (half 
+        the logical cpus), prompt (batch) evaluation uses them all.
+    '''
+    n_ctx = 512
+    n_batch = 512
+    n_threads = None
+    n_threads_batch = None
+    n_gpu_layers = 0
+    use_mmap = True
+    use_mlock = False
+    offload_kqv = True
+    # sequences the context can hold, the sheet prompt's plus one per 
+    # question of a batch (--concurrency); None for llama's default
+    n_seq_max = None
+LocalModelInitParams._initialize()
+
+
+def get_init_params(
+        profile_params: Dict[str, Any] = {},
+        **kwargs
+    ) -> Dict[str, Any]:
+    '''init params: config < model's profile < kwargs, with cpu defaults'''
+    init_params = {
+        k: kwargs.get(k, profile_params.get(k, v))
+        for k, v in LocalModelInitParams._to_dict().items()
+    }
+    # with --jobs, the processes split the cpus between them
+    n_cpus = max(1, get_cpu_count() // _n_procs)
+    if init_params.get('n_threads') is None:
+        init_params['n_threads'] = max(1, n_cpus // 2)
+    if init_params.get('n_threads_batch') is None:
+        init_params['n_threads_batch'] = n_cpus
+    return init_params
+
+
 class CppInference:
     def _get_package_version(package_name: str) -> str:
         try: return __import__(package_name).__version__
@@ -119,64 +191,326 @@ def get_sample_args(args: Dict) -> Dict:
     sample_args = rename_llama_args(sample_args)
     return sample_args
 
+def softmax(logits: np.ndarray) -> np.ndarray:
+    probs = np.exp(logits - np.max(logits))
+    return probs / probs.sum()
+
+def sample_logits(
+        logits: np.ndarray,
+        temperature: float = 0.0,
+        top_k: int = 40,
+        top_p: float = 0.95,
+        min_p: float = 0.05,
+        repeat_penalty: float = 1.1,
+        last_tokens: List[int] = None,
+        rng: Union[np.random.Generator, None] = None,
+    ) -> int:
+    '''
+        Sample a token id from one sequence's logits with the same chain
+        (and defaults) as Llama.sample: repeat penalty over last_tokens,
+        then greedy at temperature 0, else top_k, top_p, min_p and 
+        temperature. The draws come from rng, not llama's rng, so at
+        temperature > 0 completions differ from prompt_model's.
+    '''
+    logits = logits.astype(np.float64)
+    if repeat_penalty and (repeat_penalty != 1.0) and last_tokens:
+        ids = np.unique(np.asarray(last_tokens))
+        ids = ids[ids < len(logits)]
+        logits[ids] = np.where(
+            logits[ids] > 0, 
+            logits[ids] / repeat_penalty, 
+            logits[ids] * repeat_penalty,
+        )
+    if not(temperature) or temperature <= 0:
+        return int(np.argmax(logits))
+    if top_k and 0 < top_k < len(logits):
+        kth = np.partition(logits, -top_k)[-top_k]
+        logits = np.where(logits < kth, -np.inf, logits)
+    if top_p and top_p < 1.0:
+        probs = softmax(logits)
+        order = np.argsort(-probs)
+        n_keep = int(np.searchsorted(np.cumsum(probs[order]), top_p)) + 1
+        keep = np.zeros(len(logits), dtype=bool)
+        keep[order[:n_keep]] = True
+        logits = np.where(keep, logits, -np.inf)
+    if min_p and min_p > 0:
+        probs = softmax(logits)
+        logits = np.where(probs >= min_p * probs.max(), logits, -np.inf)
+    probs = softmax(logits / temperature)
+    rng = rng if rng is not None else np.random.default_rng()
+    return int(rng.choice(len(probs), p=probs))
+
+
+# tokens the repeat penalty looks back over (Llama's last_n_tokens_size)
+REPEAT_LAST_N = 64
+
+
+class StreamStop:
+    '''progress_cb which stops the stream once stop_fn is true of its text'''
+    def __init__(self, stop_fn: callable) -> None:
+        self.stop_fn = stop_fn
+        self.text : str = ''
+
+    def __call__(self, text: str) -> bool:
+        self.text += text
+        return self.stop_fn(self.text)
+
     
+class PromptCacheParams(ConfigLoader):
+    '''
+        Prefix cache of llama states used with use_prompt_cache.
+    '''
+    max_size_mb = 1024
+    # a prefix shared with the previous prompt is saved once it's this long
+    min_prefix_tokens = 16
+PromptCacheParams._initialize()
+
+
 class LocalModelCache:
     
     def __init__(self) -> None:
         self.llm: Union[Llama, None] = None
         self.cached_state : Union[LlamaState, None] = None
+        self.sys_tokens : List[int] = []
+        self.prev_tokens : List[int] = []
+        self.prefix_cache = PrefixCache(
+            max_bytes=int(PromptCacheParams.max_size_mb * 1024 * 1024)
+        )
     
+    def context_tokens(self) -> List[int]:
+        return list(self.llm.input_ids[:self.llm.n_tokens])
+
     @suppress_stderr
+    def save_prefix(self) -> 'LlamaState':
+        '''save the current context as a prefix for later prompts'''
+        state = self.llm.save_state()
+        self.prefix_cache.insert(
+            self.context_tokens(), 
+            state, 
+            state.llama_state_size,
+        )
+        return state
+
     def save_state(self):
-        self.cached_state = self.llm.save_state()
+        '''the evaluated sheet prompt becomes the start of each question'''
+        self.sys_tokens = self.context_tokens()
+        self.cached_state = self.save_prefix()
+
+    def eval_tokens(self, tokens: List[int]) -> None:
+        '''
+            Evaluate a whole prompt's tokens, skipping the longest prefix 
+            already in the context or in the prefix_cache. A prefix shared
+            with the previous prompt (e.g. a common question stem) is 
+            saved on the way so it can be skipped by later prompts.
+        '''
+        if len(tokens) == 0:
+            return
+        
+        n_past = common_prefix_len(self.context_tokens(), tokens)
+
+        n_cached, state = self.prefix_cache.match(tokens)
+        if n_cached > n_past:
+            self.llm.load_state(state)
+            n_past = n_cached
+        
+        # the last token is always evaluated, sampling needs its logits
+        n_past = min(n_past, len(tokens) - 1)
+
+        n_shared = min(
+            common_prefix_len(self.prev_tokens, tokens),
+            len(tokens) - 1,
+        )
+        if n_shared - n_cached >= PromptCacheParams.min_prefix_tokens:
+            if n_past < n_shared:
+                self.llm.n_tokens = n_past
+                self.llm.eval(tokens[n_past:n_shared])
+                n_past = n_shared
+            else:
+                # rewind (kv cells past n_tokens are kept until next eval)
+                self.llm.n_tokens = n_shared
+            self.save_prefix()
+        
+        self.llm.n_tokens = n_past
+        self.llm.eval(tokens[n_past:])
+        self.prev_tokens = list(tokens)
+
+    def eval_sample_batch(
+            self,
+            prompts_tokens: List[List[int]],
+            gen_params_list: List[Dict[str, Any]],
+            stop_fns: List[Union[callable, None]] = None,
+        ) -> List[PromptModelResponse]:
+        '''
+            Generate completions of several usr prompts at once, each as 
+            its own sequence branching off the sheet prompt (sys_tokens,
+            sequence 0) in the kv cache. Every llama_decode call evaluates
+            up to n_batch tokens across all sequences still generating.
+            The sequences must fit in the context together. A sequence
+            also stops once its stop_fn is true of its text so far.
+        '''
+        ctx = self.llm.ctx
+        n_batch = self.llm.n_batch
+        n_vocab = self.llm.n_vocab()
+        token_eos = self.llm.token_eos()
+
+        n_sys = len(self.sys_tokens)
+        if n_sys > 0:
+            self.eval_tokens(self.sys_tokens)
+        self.llm.n_tokens = n_sys
+        llama_cpp.llama_kv_cache_seq_rm(ctx, -1, n_sys, -1)
+
+        if stop_fns is None:
+            stop_fns = [None] * len(prompts_tokens)
+
+        seqs = []
+        for i, (tokens, gen_params) in enumerate(zip(prompts_tokens, gen_params_list)):
+            seq_id = i + 1
+            llama_cpp.llama_kv_cache_seq_cp(ctx, 0, seq_id, 0, n_sys)
+            seed = gen_params.get('seed')
+            seqs.append({
+                'seq_id':       seq_id,
+                'n_past':       n_sys,
+                'context':      self.sys_tokens + list(tokens),
+                'output':       [],
+                'max_tokens':   gen_params.get('max_tokens') or 1,
+                'stop_fn':      stop_fns[i],
+                'sample_args':  {
+                    'temperature':  gen_params.get('temperature', 0.0),
+                    'top_k':        gen_params.get('top_k', 40),
+                    'top_p':        gen_params.get('top_p', 0.95),
+                    'rng':          np.random.default_rng(seed),
+                },
+            })
+        
+        # (seq, token, whether its logits are needed for sampling)
+        queue = [
+            (seq, token, j == len(tokens) - 1)
+            for seq, tokens in zip(seqs, prompts_tokens)
+            for j, token in enumerate(tokens)
+        ]
 
-    def load_state(self):
-        self.llm.reset()  # apply this if seed doesn't work?
-        self.llm.load_state(self.cached_state)
+        batch = llama_cpp.llama_batch_init(n_batch, 0, len(seqs) + 1)
+        try:
+            while queue:
+                chunk, queue = queue[:n_batch], queue[n_batch:]
+                
+                for k, (seq, token, get_logits) in enumerate(chunk):
+                    batch.token[k] = token
+                    batch.pos[k] = seq['n_past']
+                    batch.n_seq_id[k] = 1
+                    batch.seq_id[k][0] = seq['seq_id']
+                    batch.logits[k] = get_logits
+                    seq['n_past'] += 1
+                batch.n_tokens = len(chunk)
+                
+                if llama_cpp.llama_decode(ctx, batch) != 0:
+                    raise ValueError('llama_decode failed, context may be full')
+                
+                for k, (seq, _, get_logits) in enumerate(chunk):
+                    if not(get_logits):
+                        continue
+                    logits = np.ctypeslib.as_array(
+                        llama_cpp.llama_get_logits_ith(ctx, k),
+                        shape=(n_vocab,),
+                    )
+                    token = sample_logits(
+                        logits, 
+                        last_tokens=seq['context'][-REPEAT_LAST_N:],
+                        **seq['sample_args'],
+                    )
+                    if token == token_eos:
+                        continue
+                    seq['output'].append(token)
+                    seq['context'].append(token)
+                    if seq['stop_fn'] is not None and seq['stop_fn'](
+                        self.llm.detokenize(seq['output']).decode('utf-8', errors='ignore')
+                    ):
+                        continue
+                    if len(seq['output']) < seq['max_tokens']:
+                        queue.append((seq, token, True))
+        finally:
+            llama_cpp.llama_batch_free(batch)
+            for seq in seqs:
+                llama_cpp.llama_kv_cache_seq_rm(ctx, seq['seq_id'], -1, -1)
+
+        return [
+            PromptModelResponse(
+                self.llm.detokenize(seq['output']).decode('utf-8', errors='replace'),
+                None,
+            )
+            for seq in seqs
+        ]
 
     def eval_prompt(
             self, 
             prompt: str, 
             prompt_type : str ='prompt'
         ) -> None:
+        '''a usr_prompt is evaluated after the sheet prompt (sys_tokens)'''
         wrapped_prompt = wrap_prompt(**{prompt_type: prompt})
-        self.llm.eval(
-            self.llm.tokenize(wrapped_prompt.encode())
-        )
+        tokens = self.llm.tokenize(wrapped_prompt.encode())
+        if prompt_type == 'usr_prompt':
+            tokens = self.sys_tokens + tokens
+        self.eval_tokens(tokens)
         
     def eval_sample_piecewise(
             self, 
             prompt: str, 
             progress_cb: callable = None,
         ) -> PromptModelResponse:
-        
+        '''
+            Sample the completion token by token after the cached state.
+            Token ids go into a buffer sized for the most tokens which 
+            can be generated, and are detokenized once at the end; 
+            progress_cb gets text through an incremental utf-8 decoder 
+            so a character split across tokens is sent whole.
+        '''
         try:
             self.eval_prompt(prompt=prompt, prompt_type='usr_prompt')
             
             if self.gen_params.get('seed') is not None: 
                 self.llm.set_seed(self.gen_params.get('seed'))
             
-            completion, counter = '', 1
+            n_ctx_left = self.llm.n_ctx() - self.llm.n_tokens
+            max_tokens = self.gen_params.get('max_tokens') or n_ctx_left
+            n_max = max(0, min(max_tokens, n_ctx_left))
 
-            token = self.llm.sample(**get_sample_args(self.gen_params))
+            tokens = array('i', bytes(n_max * array('i').itemsize))
+            n_tokens = 0
             
-            while token is not self.llm.token_eos() :
+            token_eos = self.llm.token_eos()
+            sample_args = get_sample_args(self.gen_params)
+            utf8_decoder = (
+                codecs.getincrementaldecoder('utf-8')(errors='replace')
+                if progress_cb is not None else None
+            )
+
+            token = self.llm.sample(**sample_args)
+            
+            while (token != token_eos) and (n_tokens < n_max):
                 
-                s_token = self.llm.detokenize([token]).decode()
-                completion += s_token
+                tokens[n_tokens] = token
+                n_tokens += 1
                 
-                if progress_cb is not None:
-                    progress_cb(s_token)
+                if utf8_decoder is not None:
+                    s_token = utf8_decoder.decode(self.llm.detokenize([token]))
+                    if s_token and progress_cb(s_token):
+                        break
 
-                if ((counter >= self.gen_params.get('max_tokens')) or  
-                    (counter >= self.init_params.get('n_ctx'))      # TODO - split this off
-                    ):
+                if n_tokens >= n_max:
                     break
-                else:
-                    counter += 1
 
                 self.llm.eval([token])
-                token = self.llm.sample(**get_sample_args(self.gen_params))
+                token = self.llm.sample(**sample_args)
+            
+            if utf8_decoder is not None:
+                s_token = utf8_decoder.decode(b'', final=True)
+                if s_token:
+                    progress_cb(s_token)
+
+            completion = self.llm.detokenize(
+                tokens[:n_tokens].tolist()
+            ).decode('utf-8', errors='replace')
             
             return PromptModelResponse(completion, None)
         
@@ -185,6 +519,20 @@ class LocalModelCache:
     
 
 
+_vocab_llms : Dict[str, 'Llama'] = {}
+
+@suppress_stderr
+def get_vocab_llm(model_fn: str) -> 'Llama':
+    '''vocab-only Llama of a weights file, loaded once per process'''
+    if model_fn not in _vocab_llms:
+        llama_log_set(log_callback, ctypes.c_void_p())
+        _vocab_llms[model_fn] = Llama(
+            model_path=model_fn,
+            vocab_only=True,
+        )
+    return _vocab_llms[model_fn]
+
+
 class LocalModelObj(ModelObj, LocalModelCache):
     
     def __init__(self, model_name: str, **kwargs) -> None:
@@ -197,31 +545,127 @@ class LocalModelObj(ModelObj, LocalModelCache):
             'max_tokens',
             'seed',
         ]
-        self.init_params = {
-            'n_threads': 4,
-            'n_ctx': 512,
+        self.init_params : Dict[str, Any] = get_init_params(
+            self.profile_params, **kwargs
+        )
+        # llm state is shared across prompts; can't run concurrently
+        self.thread_safe : bool = False
+        # evaluated sheet prompts persisted across runs
+        self.state_store : Union[LlamaStateStore, None] = (
+            LlamaStateStore() 
+            if self.use_prompt_cache and LlamaStateCacheParams.enabled
+            else None
+        )
+        self.pending_state_key : Union[str, None] = None
+        self.ntokens_cache = NTokensCache()
+
+    def cache_key_data(self, 
+                       prompt_sys: str = None, 
+                       prompt_usr: str = None, 
+                       gen_params: Dict[str, Any] = {},
+                       ) -> Dict[str, Any]:
+        return {
+            **super().cache_key_data(prompt_sys, prompt_usr, gen_params),
+            'prompt':       wrap_prompt(sys_prompt=prompt_sys, usr_prompt=prompt_usr),
+            'model_fn':     self.model_fn,
+            'init_params':  self.init_params,
         }
 
-    def check_valid(self, **kwargs) -> bool:
+    def sys_state_key(self, sys_prompt: str) -> str:
+        return self.state_store.make_key({
+            'model_hash':   get_file_hash(self.model_fn),
+            'init_params':  self.init_params,
+            'prompt':       wrap_prompt(sys_prompt=sys_prompt),
+            'llama_cpp':    CppInference.package_version,
+        })
+
+    def eval_prompt(
+            self, 
+            prompt: str, 
+            prompt_type : str ='prompt'
+        ) -> None:
+        '''
+            A sheet prompt not in the prefix_cache is loaded from the 
+            state_store if it was evaluated by a previous run, else it's
+            evaluated and then stored by save_state.
+        '''
+        self.pending_state_key = None
+        if (prompt_type == 'sys_prompt') and (self.state_store is not None):
+            tokens = self.llm.tokenize(wrap_prompt(sys_prompt=prompt).encode())
+            n_cached, _ = self.prefix_cache.match(tokens)
+            if n_cached < len(tokens):
+                key = self.sys_state_key(prompt)
+                state = self.state_store.load(key)
+                if state is not None:
+                    self.llm.load_state(state)
+                    return
+                self.pending_state_key = key
+        LocalModelCache.eval_prompt(self, prompt, prompt_type)
+
+    def save_state(self):
+        LocalModelCache.save_state(self)
+        if self.pending_state_key is not None:
+            self.state_store.save(self.pending_state_key, self.cached_state)
+            self.pending_state_key = None
+
+    def check_valid(self, dry_run: bool = False, **kwargs) -> bool:
+        '''
+            Loads the model, or on a dry_run (which only counts tokens) 
+            just its vocab, which checks the weights file without 
+            reading the weights.
+        '''
         self.model_fn = get_model_fn(self.model_name)
-        if self.llm is None:
+        if dry_run:
+            get_vocab_llm(self.model_fn)
+        elif self.llm is None:
             self.init_llm()
         return True
     
     @suppress_stderr
     def init_llm(self, **kwargs) -> None:
         llama_log_set(log_callback, ctypes.c_void_p())
+        init_params = dict(self.init_params)
+        # only set if this llama_cpp's Llama takes it, see max_batch_seqs
+        n_seq_max = init_params.pop('n_seq_max', None)
+        if (n_seq_max is not None) and (
+            'n_seq_max' in inspect.signature(Llama.__init__).parameters):
+            init_params['n_seq_max'] = n_seq_max
         self.llm = Llama(
             model_path=get_model_fn(self.model_name), 
             vocab_only=kwargs.get('vocab_only', False),
-            **self.init_params
+            **init_params
         )
+
+    def max_batch_seqs(self) -> Union[int, None]:
+        '''
+            Questions eval_sample_batch can decode at once: the context's
+            n_seq_max less the sheet prompt's sequence. None (no limit) 
+            for llama.cpp versions without n_seq_max, which don't bound 
+            sequence ids.
+        '''
+        llama_n_seq_max = getattr(llama_cpp, 'llama_n_seq_max', None)
+        if llama_n_seq_max is None:
+            return None
+        return max(0, int(llama_n_seq_max(self.llm.ctx)) - 1)
     
+    def get_tokenizer(self) -> 'Llama':
+        '''
+            The loaded model if there is one, else a vocab-only Llama 
+            (no weights) so counting tokens, e.g. on a dry run, doesn't
+            load the whole model.
+        '''
+        if self.llm is not None:
+            return self.llm
+        return get_vocab_llm(self.model_fn)
+
     def count_tokens(self, text: str) -> int:
-        if self.llm is None:
-            self.init_llm()
-        try: return len(self.llm.tokenize(text.encode()))
+        ntokens = self.ntokens_cache.get(text)
+        if ntokens is not None:
+            return ntokens
+        try: ntokens = len(self.get_tokenizer().tokenize(text.encode()))
         except: return -1
+        self.ntokens_cache.set(text, ntokens)
+        return ntokens
     
     @suppress_stderr
     def prompt_model(self,
@@ -243,8 +687,6 @@ class LocalModelObj(ModelObj, LocalModelCache):
             
             if self.use_prompt_cache:
                 
-                self.load_state()
-
                 return self.eval_sample_piecewise(
                     prompt=prompt_usr,
                     progress_cb=progress_cb,
@@ -255,14 +697,98 @@ class LocalModelObj(ModelObj, LocalModelCache):
                 return self.call_model(
                     prompt_sys=prompt_sys,
                     prompt_usr=prompt_usr,
+                    progress_cb=progress_cb,
                 )
         
         except Exception as e:
             return PromptModelResponse(None, e)
         
+    @suppress_stderr
+    def prompt_model_batch(self,
+            prompts: List[Tuple[str, str, Dict[str, Any]]],
+            stop_fns: List[Union[callable, None]] = None,
+        ) -> List[PromptModelResponse]:
+        '''
+            Prompt (prompt_sys, prompt_usr, gen_params) items, decoding as
+            many as fit in the context at once as parallel sequences after
+            the cached sheet prompt. Without use_prompt_cache there's no 
+            shared sheet prompt state, so the items are prompted in turn.
+            stop_fns (one per item, or None) stop an item's generation
+            early, as a progress_cb returning True does in prompt_model.
+        '''
+        if stop_fns is None:
+            stop_fns = [None] * len(prompts)
+
+        def prompt_in_turn() -> List[PromptModelResponse]:
+            return [
+                self.prompt_model(
+                    prompt_sys, prompt_usr, 
+                    progress_cb=(
+                        StreamStop(stop_fn) if stop_fn is not None else None
+                    ),
+                    **gen_params,
+                )
+                for (prompt_sys, prompt_usr, gen_params), stop_fn 
+                in zip(prompts, stop_fns)
+            ]
+
+        if not(self.use_prompt_cache):
+            return prompt_in_turn()
+        
+        try:
+            
+            if self.llm is None:
+                self.init_llm()
+            
+            items = []
+            for (_, prompt_usr, gen_params), stop_fn in zip(prompts, stop_fns):
+                gen_params = {
+                    **self.gen_params,
+                    **{k: v for k, v in gen_params.items()
+                       if k in self.prompt_model_params},
+                }
+                tokens = self.llm.tokenize(
+                    wrap_prompt(usr_prompt=prompt_usr).encode()
+                )
+                items.append((tokens, gen_params, stop_fn))
+            
+            max_seqs = self.max_batch_seqs()
+            if max_seqs == 0:
+                # the context holds a single sequence
+                return prompt_in_turn()
+
+            # group the items so each group's sequences fit in the context
+            n_free = self.llm.n_ctx() - len(self.sys_tokens)
+            groups, n_used = [[]], 0
+            for tokens, gen_params, stop_fn in items:
+                n_seq = len(tokens) + (gen_params.get('max_tokens') or 1)
+                if groups[-1] and (
+                    (n_used + n_seq > n_free) or 
+                    (max_seqs is not None and len(groups[-1]) >= max_seqs)):
+                    groups.append([])
+                    n_used = 0
+                groups[-1].append((tokens, gen_params, stop_fn))
+                n_used += n_seq
+            
+            responses = []
+            for group in groups:
+                try:
+                    responses += self.eval_sample_batch(
+                        [tokens for tokens, _, _ in group],
+                        [gen_params for _, gen_params, _ in group],
+                        [stop_fn for _, _, stop_fn in group],
+                    )
+                except Exception as e:
+                    responses += [PromptModelResponse(None, e) for _ in group]
+            return responses
+        
+        except Exception as e:
+            return [PromptModelResponse(None, e) for _ in prompts]
+
     def call_model(self,
             prompt_sys: str = None,
             prompt_usr: str = None,
+            progress_cb: callable = None,
         ) -> PromptModelResponse:
         try:
 
@@ -271,6 +797,20 @@ class LocalModelObj(ModelObj, LocalModelCache):
                 usr_prompt=prompt_usr,
             )
 
+            if progress_cb is not None:
+                chunks = []
+                for output in self.llm(
+                    prompt=wrapped_prompt,
+                    stream=True,
+                    **self.gen_params,
+                ):
+                    s_chunk = self._get_completion(output)
+                    if s_chunk:
+                        chunks.append(s_chunk)
+                        if progress_cb(s_chunk):
+                            break
+                return PromptModelResponse(''.join(chunks), None)
+
             output = self.llm(
                 prompt=wrapped_prompt, 
                 **self.gen_params,
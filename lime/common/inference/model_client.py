@@ -0,0 +1,173 @@
+import threading
+from multiprocessing.connection import (
+    Client,
+    Connection,
+)
+from typing import (
+    Any,
+    Dict,
+    List,
+    Union,
+)
+from .base import (
+    PromptModelResponse,
+    ModelObj,
+)
+from .tokens import (
+    NTokensCache,
+)
+from .model_server import (
+    read_server_info,
+)
+from .local_llama_cpp import (
+    wrap_prompt,
+)
+
+
+class ServedModelObj(ModelObj):
+    '''
+        A local model prompted through its resident ModelServer (see
+        `lime serve-model`), so the weights aren't loaded by each eval.
+        Mirrors LocalModelObj: the sheet prompt set by eval_prompt is
+        evaluated (and cached) on the server.
+    '''
+    def __init__(
+            self,
+            model_name: str,
+            server_info: Dict[str, Any] = None,
+            **kwargs
+        ) -> None:
+        super().__init__(model_name, **kwargs)
+        self.server_info = server_info or read_server_info(model_name)
+        if self.server_info is None:
+            msg = f'no model server running for {model_name}; '
+            msg += f'start one with `lime serve-model {model_name}`'
+            raise ValueError(msg)
+        self.prompt_model_params : List[str] = [
+            'temperature',
+            'max_tokens',
+            'seed',
+        ]
+        # one connection, one request at a time, as with LocalModelObj
+        self.thread_safe : bool = False
+        self.conn : Union[Connection, None] = None
+        self.conn_lock = threading.Lock()
+        self.info : Union[Dict[str, Any], None] = None
+        self.sys_prompt : Union[str, None] = None
+        self.ntokens_cache = NTokensCache()
+
+    def get_conn(self) -> Connection:
+        if self.conn is None:
+            self.conn = Client(
+                self.server_info['address'],
+                family=self.server_info['family'],
+                authkey=self.server_info['authkey'],
+            )
+        return self.conn
+
+    def request(
+            self,
+            method: str,
+            progress_cb: callable = None,
+            **kwargs
+        ) -> Any:
+        with self.conn_lock:
+            conn = self.get_conn()
+            try:
+                conn.send((method, kwargs))
+                stopped = False
+                while True:
+                    status, value = conn.recv()
+                    if status == 'progress':
+                        if (progress_cb is not None) and progress_cb(value):
+                            if not(stopped):
+                                conn.send('stop')
+                                stopped = True
+                        continue
+                    if status == 'error':
+                        raise value
+                    return value
+            except (EOFError, OSError):
+                # server went away; reconnect on the next request
+                self.conn = None
+                raise
+
+    def get_info(self) -> Dict[str, Any]:
+        if self.info is None:
+            self.info = self.request('info')
+        return self.info
+
+    def check_valid(self, **kwargs) -> bool:
+        try:
+            self.get_info()
+        except Exception as e:
+            raise ValueError(f'model server of {self.model_name} not available: {e}')
+        return True
+
+    def init_llm(self, **kwargs) -> None:
+        '''the model is loaded (once) by the server'''
+        self.get_info()
+
+    def eval_prompt(self, prompt: str, prompt_type: str = 'prompt') -> None:
+        if prompt_type == 'sys_prompt':
+            self.sys_prompt = prompt
+
+    def save_state(self) -> None:
+        pass
+
+    def cache_key_data(self,
+                       prompt_sys: str = None,
+                       prompt_usr: str = None,
+                       gen_params: Dict[str, Any] = {},
+                       ) -> Dict[str, Any]:
+        '''same as LocalModelObj, so cached completions are shared'''
+        info = self.get_info()
+        return {
+            **super().cache_key_data(prompt_sys, prompt_usr, gen_params),
+            'prompt':       wrap_prompt(sys_prompt=prompt_sys, usr_prompt=prompt_usr),
+            'model_fn':     info.get('model_fn'),
+            'init_params':  info.get('init_params'),
+        }
+
+    def count_tokens(self, text: str) -> int:
+        ntokens = self.ntokens_cache.get(text)
+        if ntokens is not None:
+            return ntokens
+        try:
+            ntokens = self.request('count_tokens', text=text)
+        except:
+            return -1
+        self.ntokens_cache.set(text, ntokens)
+        return ntokens
+
+    def prompt_model(self,
+            prompt_sys: str = None,
+            prompt_usr: str = None,
+            progress_cb: callable = None,
+            **kwargs
+        ) -> PromptModelResponse:
+        try:
+
+            gen_params = {
+                **self.gen_params,
+                **{k: v for k, v in kwargs.items()
+                   if k in self.prompt_model_params},
+            }
+
+            if self.use_prompt_cache and (self.sys_prompt is not None):
+                prompt_sys = self.sys_prompt
+
+            completion, error = self.request(
+                'prompt_model',
+                progress_cb=progress_cb,
+                prompt_sys=prompt_sys,
+                prompt_usr=prompt_usr,
+                use_prompt_cache=self.use_prompt_cache,
+                stream=progress_cb is not None,
+                gen_params=gen_params,
+            )
+
+            return PromptModelResponse(completion, error)
+
+        except Exception as e:
+            return PromptModelResponse(None, e)
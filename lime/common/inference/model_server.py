@@ -0,0 +1,221 @@
+import os
+import json
+import socket
+import threading
+from multiprocessing.connection import (
+    Listener,
+    Connection,
+    AuthenticationError,
+)
+from typing import (
+    Any,
+    Dict,
+    Tuple,
+    Union,
+)
+from ..models.state import (
+    ConfigLoader,
+)
+from ..models.utils import (
+    CONFIG_DIR,
+)
+
+class ModelServerParams(ConfigLoader):
+    '''
+        Resident local model servers, started with `lime serve-model`.
+        When use_server is set, a local model with a running server is
+        prompted through it instead of being loaded by each eval.
+    '''
+    use_server = True
+    # where servers write their address file; None for ~/.lime/servers
+    server_dir = None
+ModelServerParams._initialize()
+
+
+def get_server_dir(server_dir: str = None) -> str:
+    return (
+        server_dir or
+        ModelServerParams.server_dir or
+        os.path.join(os.path.expanduser('~'), CONFIG_DIR, 'servers')
+    )
+
+
+def get_server_fn(model_name: str, server_dir: str = None) -> str:
+    safe_name = ''.join(
+        c if (c.isalnum() or c in '-_.') else '_'
+        for c in model_name
+    )
+    return os.path.join(get_server_dir(server_dir), f'{safe_name}.json')
+
+
+def read_server_info(
+        model_name: str,
+        server_dir: str = None,
+    ) -> Union[Dict[str, Any], None]:
+    '''
+        Address info of the running server of model_name, or None if
+        there is no server (or its process is gone).
+    '''
+    server_fn = get_server_fn(model_name, server_dir)
+    try:
+        with open(server_fn, 'r') as f:
+            server_info = json.load(f)
+        os.kill(server_info['pid'], 0)
+    except (OSError, ValueError, KeyError):
+        return None
+    if isinstance(server_info.get('address'), list):
+        server_info['address'] = tuple(server_info['address'])
+    server_info['authkey'] = bytes.fromhex(server_info['authkey'])
+    return server_info
+
+
+class ModelServer:
+    '''
+        Keeps a LocalModelObj (and its loaded Llama, prefix cache, ...)
+        resident and serves it over a local socket. Requests are
+        (method, kwargs) tuples, answered with ('ok', result) or
+        ('error', exception); prompt_model is answered with a 
+        (completion, error) tuple, and can stream
+        ('progress', text) messages first; the client sends 'stop' to
+        end the generation early. Each client connection gets a thread,
+        and requests to the model are run one at a time.
+    '''
+    def __init__(
+            self,
+            model_name: str,
+            infer_obj: Any = None,
+            server_dir: str = None,
+        ) -> None:
+        if infer_obj is None:
+            from .local_llama_cpp import LocalModelObj
+            infer_obj = LocalModelObj(model_name, use_prompt_cache=True)
+        self.model_name : str = model_name
+        self.infer_obj : Any = infer_obj
+        self.server_fn : str = get_server_fn(model_name, server_dir)
+        self.lock = threading.Lock()
+        self.sys_prompt : Union[str, None] = None
+        self.listener : Union[Listener, None] = None
+
+    def start(self) -> None:
+        '''load the model, then listen and write the address file'''
+        self.infer_obj.check_valid()
+
+        server_dir = os.path.dirname(self.server_fn)
+        os.makedirs(server_dir, exist_ok=True)
+
+        authkey = os.urandom(32)
+        if hasattr(socket, 'AF_UNIX'):
+            family = 'AF_UNIX'
+            address = self.server_fn[:-len('.json')] + '.sock'
+            if os.path.exists(address):
+                os.remove(address)
+        else:
+            family, address = 'AF_INET', ('127.0.0.1', 0)
+        self.listener = Listener(address, family=family, authkey=authkey)
+
+        server_info = {
+            'model_name':   self.model_name,
+            'pid':          os.getpid(),
+            'family':       family,
+            'address':      self.listener.address,
+            'authkey':      authkey.hex(),
+        }
+        # only readable by the user, it holds the authkey
+        fd = os.open(self.server_fn, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(server_info, f)
+
+    def serve_forever(self) -> None:
+        while True:
+            try:
+                conn = self.listener.accept()
+            except AuthenticationError:
+                continue
+            except OSError:
+                return      # listener closed
+            threading.Thread(
+                target=self.handle,
+                args=(conn,),
+                daemon=True,
+            ).start()
+
+    def close(self) -> None:
+        if self.listener is not None:
+            self.listener.close()
+        for fn in (self.server_fn, self.server_fn[:-len('.json')] + '.sock'):
+            if os.path.exists(fn):
+                os.remove(fn)
+
+    def handle(self, conn: Connection) -> None:
+        with conn:
+            while True:
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if not isinstance(msg, tuple):
+                    continue    # a 'stop' which came after the completion
+                method, kwargs = msg
+                try:
+                    result = getattr(self, f'do_{method}')(conn, **kwargs)
+                    conn.send(('ok', result))
+                except Exception as e:
+                    try:
+                        conn.send(('error', e))
+                    except Exception:
+                        conn.send(('error', ValueError(str(e))))
+
+    def do_info(self, conn: Connection) -> Dict[str, Any]:
+        return {
+            'model_name':   self.model_name,
+            'model_fn':     getattr(self.infer_obj, 'model_fn', None),
+            'init_params':  getattr(self.infer_obj, 'init_params', {}),
+        }
+
+    def do_count_tokens(self, conn: Connection, text: str) -> int:
+        with self.lock:
+            return self.infer_obj.count_tokens(text)
+
+    def do_prompt_model(
+            self,
+            conn: Connection,
+            prompt_sys: str = None,
+            prompt_usr: str = None,
+            use_prompt_cache: bool = False,
+            stream: bool = False,
+            gen_params: Dict[str, Any] = {},
+        ) -> Tuple[Union[str, None], Union[Exception, None]]:
+        '''
+            With use_prompt_cache, prompt_sys is the sheet prompt: it's
+            only evaluated when it differs from the last one served.
+        '''
+        def progress_cb(s: str) -> bool:
+            conn.send(('progress', s))
+            return conn.poll() and (conn.recv() == 'stop')
+        if not(stream):
+            progress_cb = None
+        with self.lock:
+            self.infer_obj.use_prompt_cache = use_prompt_cache
+            if not(use_prompt_cache):
+                return tuple(self.infer_obj.prompt_model(
+                    prompt_sys=prompt_sys,
+                    prompt_usr=prompt_usr,
+                    progress_cb=progress_cb,
+                    **gen_params,
+                ))
+            if prompt_sys != self.sys_prompt:
+                if prompt_sys is not None:
+                    self.infer_obj.eval_prompt(
+                        prompt=prompt_sys,
+                        prompt_type='sys_prompt',
+                    )
+                    self.infer_obj.save_state()
+                else:
+                    self.infer_obj.sys_tokens = []
+                self.sys_prompt = prompt_sys
+            return tuple(self.infer_obj.prompt_model(
+                prompt_sys=None,
+                prompt_usr=prompt_usr,
+                progress_cb=progress_cb,
+                **gen_params,
+            ))
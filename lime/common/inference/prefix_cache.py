@@ -0,0 +1,99 @@
+from collections import OrderedDict
+from typing import (
+    Any,
+    Dict,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+
+def common_prefix_len(a: Sequence[int], b: Sequence[int]) -> int:
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+class PrefixNode:
+    __slots__ = ('parent', 'token', 'children', 'state', 'nbytes')
+    def __init__(self, parent: 'PrefixNode' = None, token: int = None) -> None:
+        self.parent : Union[PrefixNode, None] = parent
+        self.token : Union[int, None] = token
+        self.children : Dict[int, PrefixNode] = {}
+        self.state : Any = None
+        self.nbytes : int = 0
+
+
+class PrefixCache:
+    '''
+        Token-level prefix tree of saved model states (e.g. llama.cpp's
+        LlamaState), so a prompt can start from the state of its longest
+        cached prefix. States are evicted least-recently-used first once
+        their total size is past max_bytes.
+    '''
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes : int = max_bytes
+        self.root = PrefixNode()
+        self.entries : OrderedDict = OrderedDict()   # id(node) -> node
+        self.nbytes : int = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def match(self, tokens: Sequence[int]) -> Tuple[int, Any]:
+        '''
+            Longest cached prefix of tokens: (its length, its state),
+            or (0, None) if there is none.
+        '''
+        node, best = self.root, None
+        for i, token in enumerate(tokens):
+            node = node.children.get(token)
+            if node is None:
+                break
+            if node.state is not None:
+                best = (i + 1, node)
+        if best is None:
+            return 0, None
+        n_tokens, node = best
+        self.entries.move_to_end(id(node))
+        return n_tokens, node.state
+
+    def insert(self, tokens: Sequence[int], state: Any, nbytes: int) -> None:
+        if (len(tokens) == 0) or (nbytes > self.max_bytes):
+            return
+        node = self.root
+        for token in tokens:
+            child = node.children.get(token)
+            if child is None:
+                child = PrefixNode(node, token)
+                node.children[token] = child
+            node = child
+        if node.state is not None:
+            self.nbytes -= node.nbytes
+        node.state, node.nbytes = state, nbytes
+        self.nbytes += nbytes
+        self.entries[id(node)] = node
+        self.entries.move_to_end(id(node))
+        self._evict()
+
+    def _evict(self) -> None:
+        while self.nbytes > self.max_bytes and self.entries:
+            _, node = self.entries.popitem(last=False)
+            self.nbytes -= node.nbytes
+            node.state, node.nbytes = None, 0
+            self._prune(node)
+
+    def _prune(self, node: PrefixNode) -> None:
+        '''remove the branch up to the nearest node still in use'''
+        while (node.parent is not None and
+               not(node.children) and
+               node.state is None):
+            del node.parent.children[node.token]
+            node = node.parent
+
+    def clear(self) -> None:
+        self.root = PrefixNode()
+        self.entries.clear()
+        self.nbytes = 0
@@ -0,0 +1,236 @@
+import time
+import random
+import asyncio
+import threading
+import email.utils
+from typing import (
+    Any,
+    Dict,
+    Tuple,
+    Union,
+    Callable,
+    Awaitable,
+)
+import httpx
+import requests
+import openai
+from ..models.state import (
+    ConfigLoader,
+)
+
+class RateLimitParams(ConfigLoader):
+    '''
+        Client-side rate limits, set per model in its `profile`.
+        rpm / tpm of None means that bucket is not limited.
+    '''
+    rpm = None
+    tpm = None
+    max_retries = 4
+    # seconds; the retry delay is jittered in [0, backoff_base * 2**attempt]
+    backoff_base = 1.0
+    backoff_max = 60.0
+RateLimitParams._initialize()
+
+RETRY_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504, 529)
+
+RETRY_EXCEPTIONS = (
+    openai.APIConnectionError,
+    httpx.TransportError,
+    requests.ConnectionError,
+    requests.Timeout,
+)
+
+
+class TokenBucket:
+    '''
+        Refills `capacity` units per minute. Callers reserve units and
+        are told how long to wait; the level can go negative so waiting
+        callers queue up in order without holding the lock.
+    '''
+    def __init__(self, capacity: float) -> None:
+        self.capacity : float = float(capacity)
+        self.rate : float = self.capacity / 60.0
+        self.level : float = self.capacity
+        self.updated : float = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, n: float = 1) -> float:
+        '''take n units, return seconds to wait before using them'''
+        n = min(float(n), self.capacity)
+        with self.lock:
+            now = time.monotonic()
+            self.level = min(
+                self.capacity,
+                self.level + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.level -= n
+            if self.level >= 0:
+                return 0.0
+            return -self.level / self.rate
+
+    def pause(self, seconds: float) -> None:
+        '''empty the bucket for `seconds`, e.g. when told to Retry-After'''
+        with self.lock:
+            self.level = min(self.level, -seconds * self.rate)
+
+
+def get_status_code(error: Exception) -> Union[int, None]:
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        response = getattr(error, 'response', None)
+        status_code = getattr(response, 'status_code', None)
+    return status_code
+
+
+def get_retry_after(error: Exception) -> Union[float, None]:
+    '''seconds from a Retry-After(-ms) header of the error's response'''
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms') is not None:
+            return float(headers.get('retry-after-ms')) / 1000.0
+        retry_after = headers.get('retry-after')
+        if retry_after is None:
+            return None
+        try:
+            return float(retry_after)
+        except ValueError:
+            retry_date = email.utils.parsedate_to_datetime(retry_after)
+            return max(0.0, retry_date.timestamp() - time.time())
+    except Exception:
+        return None
+
+
+class RateLimiter:
+    '''
+        Requests-per-minute and tokens-per-minute buckets in front of
+        a model's prompt function, with retries of rate-limited and
+        transient errors. Limiters are shared by every ModelObj of the
+        same model (see get_rate_limiter), but not across processes.
+    '''
+    def __init__(
+            self,
+            rpm: Union[int, None] = None,
+            tpm: Union[int, None] = None,
+            max_retries: int = 4,
+            backoff_base: float = 1.0,
+            backoff_max: float = 60.0,
+        ) -> None:
+        self.rpm_bucket = TokenBucket(rpm) if rpm else None
+        self.tpm_bucket = TokenBucket(tpm) if tpm else None
+        self.max_retries : int = max_retries or 0
+        self.backoff_base : float = backoff_base
+        self.backoff_max : float = backoff_max
+
+    def reserve(self, ntokens: int = 0) -> float:
+        delay = 0.0
+        if self.rpm_bucket is not None:
+            delay = max(delay, self.rpm_bucket.reserve(1))
+        if (self.tpm_bucket is not None) and (ntokens > 0):
+            delay = max(delay, self.tpm_bucket.reserve(ntokens))
+        return delay
+
+    def retry_delay(
+            self,
+            error: Exception,
+            attempt: int,
+        ) -> Union[float, None]:
+        '''
+            Seconds to wait before retrying, or None if the error
+            shouldn't be retried (or retries are exhausted).
+        '''
+        if attempt >= self.max_retries:
+            return None
+        status_code = get_status_code(error)
+        if status_code is not None:
+            if status_code not in RETRY_STATUS_CODES:
+                return None
+        elif not(isinstance(error, RETRY_EXCEPTIONS)):
+            return None
+        backoff = random.uniform(
+            0,
+            min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        )
+        retry_after = get_retry_after(error)
+        if retry_after is None:
+            return backoff
+        # all requests to this model are held until the server's Retry-After
+        for bucket in (self.rpm_bucket, self.tpm_bucket):
+            if bucket is not None:
+                bucket.pause(retry_after)
+        return retry_after + random.uniform(0, self.backoff_base)
+
+    def call(
+            self,
+            prompt_fn: Callable[[], Any],
+            ntokens: int = 0,
+            on_retry: Union[Callable[[], None], None] = None,
+        ) -> Any:
+        '''
+            prompt_fn returns a PromptModelResponse, it's retried 
+            while its error is retryable. on_retry is called before
+            each retry, e.g. to reset the prompt's progress_cb.
+        '''
+        attempt = 0
+        while True:
+            delay = self.reserve(ntokens)
+            if delay > 0:
+                time.sleep(delay)
+            response = prompt_fn()
+            if response.error is None:
+                return response
+            delay = self.retry_delay(response.error, attempt)
+            if delay is None:
+                return response
+            time.sleep(delay)
+            attempt += 1
+            if on_retry is not None:
+                on_retry()
+
+    async def acall(
+            self,
+            aprompt_fn: Callable[[], Awaitable[Any]],
+            ntokens: int = 0,
+            on_retry: Union[Callable[[], None], None] = None,
+        ) -> Any:
+        attempt = 0
+        while True:
+            delay = self.reserve(ntokens)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            response = await aprompt_fn()
+            if response.error is None:
+                return response
+            delay = self.retry_delay(response.error, attempt)
+            if delay is None:
+                return response
+            await asyncio.sleep(delay)
+            attempt += 1
+            if on_retry is not None:
+                on_retry()
+
+
+_rate_limiters : Dict[Tuple, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(
+        model_name: str,
+        profile_params: Dict[str, Any] = {},
+        **kwargs,
+    ) -> RateLimiter:
+    '''
+        The RateLimiter for a model: settings are config < model's
+        profile < kwargs, and one limiter is kept per model and settings.
+    '''
+    params = {
+        k: kwargs.get(k, profile_params.get(k, v))
+        for k, v in RateLimitParams._to_dict().items()
+    }
+    key = (model_name, *sorted(params.items()))
+    with _rate_limiters_lock:
+        if key not in _rate_limiters:
+            _rate_limiters[key] = RateLimiter(**params)
+        return _rate_limiters[key]
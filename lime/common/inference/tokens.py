@@ -0,0 +1,61 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import (
+    Any,
+    Union,
+)
+import tiktoken
+
+
+class NTokensCache:
+    '''
+        LRU bounded memo of token counts, keyed on a hash of the text
+        so long prompts aren't held in memory as keys.
+    '''
+    def __init__(self, maxsize: int = 4096) -> None:
+        self.maxsize : int = maxsize
+        self.data : OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(
+            text.encode('utf-8', errors='replace'),
+            digest_size=16,
+        ).digest()
+
+    def get(self, text: Union[str, None]) -> Union[int, None]:
+        if text is None: return None
+        key = self._key(text)
+        with self.lock:
+            ntokens = self.data.get(key)
+            if ntokens is not None:
+                self.data.move_to_end(key)
+            return ntokens
+
+    def set(self, text: Union[str, None], ntokens: int) -> None:
+        if text is None: return
+        key = self._key(text)
+        with self.lock:
+            self.data[key] = ntokens
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+
+_tiktoken_encoders = {}
+
+def get_tiktoken_encoder(model_name: str) -> Union[Any, None]:
+    '''
+        Resolve (and keep) the tiktoken encoding for a model name.
+        Returns None if tiktoken doesn't know the model name; other 
+        errors (e.g. failing to download the bpe file) are raised.
+    '''
+    if model_name not in _tiktoken_encoders:
+        try: 
+            encoder = tiktoken.encoding_for_model(model_name)
+        except KeyError: 
+            encoder = None
+        _tiktoken_encoders[model_name] = encoder
+    return _tiktoken_encoders[model_name]
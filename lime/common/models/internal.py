@@ -8,6 +8,7 @@ from typing import (
     List,
     Dict,
     Any,
+    Tuple,
 )
 from datetime import datetime
 
@@ -67,11 +68,39 @@ class QuestionOutput(BaseModel):
     eval_time:      float
     grading:        Optional[GradingOutput] = None
     ntokens:        Optional[NTokens] = None
+    cache_hit:      Optional[bool] = None
+    ttft:           Optional[float] = None  # secs to first streamed token
+    tps:            Optional[float] = None  # completion tokens / sec
 
 class SheetOutputSchema(BaseModel):
     header:         HeaderOutput
     questions:      List[QuestionOutput]
 
+class QuestionNames:
+    '''
+        Index of the question names of a sheet. A name already taken
+        gets the first free `_n` suffix (`Q`, `Q_1`, `Q_2`, ...), which
+        can't collide with any name given before it either.
+    '''
+    def __init__(self) -> None:
+        self.taken : set = set()
+        # next suffix to try for each duplicated name
+        self.next_n : Dict[str, int] = {}
+
+    def add(self, name: str) -> Tuple[str, bool]:
+        '''the unique name to use, and whether name was a duplicate'''
+        if name not in self.taken:
+            self.taken.add(name)
+            return name, False
+        n = self.next_n.get(name, 1)
+        while f'{name}_{n}' in self.taken:
+            n += 1
+        self.next_n[name] = n + 1
+        unique_name = f'{name}_{n}'
+        self.taken.add(unique_name)
+        return unique_name, True
+
+
 class SheetSchema(BaseModel):
     name:           str
     meta:           Dict[str, str]
@@ -88,42 +117,46 @@ class SheetSchema(BaseModel):
         sheet_text = None
         sheet_name = None
         if sheet_header is not None:
-            _name = sheet_header.name
-            _meta = [e for e in sheet_header.sub_sections if e['type'] == 'meta']
-            _meta = _meta[0]['data'] if len(_meta) > 0 else {}
-            _text = [e for e in sheet_header.sub_sections if e['type'] == 'question']
-            _text = _text[0]['clean'] if len(_text) > 0 else None
-            sheet_meta = _meta
+            sheet_name = sheet_header.name
+            _meta, _text = None, None
+            for e in sheet_header.sub_sections:
+                if e['type'] == 'meta' and _meta is None:
+                    _meta = e['data']
+                elif e['type'] == 'question' and _text is None:
+                    _text = e['clean']
+            sheet_meta = _meta if _meta is not None else {}
             sheet_text = _text
-            sheet_name = _name
 
         questions = doc.questions
 
+        question_names = QuestionNames()
         question_schemas = []
         for question in questions:
-            question_name = question.name
-            question_meta = [e for e in question.sub_sections if e['type'] == 'meta']
-            question_meta = question_meta[0]['data'] if len(question_meta) > 0 else {}
-            question_text_usr = [e for e in question.sub_sections if e['type'] == 'question']
-            question_text_usr = question_text_usr[0]['text_usr'] if len(question_text_usr) > 0 else None
-            question_test_sys = sheet_text
-            question_answer = [e for e in question.sub_sections if e['type'] == 'answer']
-            question_answer = question_answer[0]['answer_clean'] if len(question_answer) > 0 else None
+            question_meta = None
+            question_text_usr = None
+            question_answer = None
+            for e in question.sub_sections:
+                if e['type'] == 'meta' and question_meta is None:
+                    question_meta = e['data']
+                elif e['type'] == 'question' and question_text_usr is None:
+                    question_text_usr = e['text_usr']
+                elif e['type'] == 'answer' and question_answer is None:
+                    question_answer = e['answer_clean']
             parse_warns = []
             if question_text_usr is None:
                 question_text_usr = ''
                 parse_warns.append('text_usr is None')
-            if question_name in [q.name for q in question_schemas]:
-                parse_warns.append(f'question name `{question_name}` is not unique')
-                question_name = f"{question_name}_1"
+            question_name, is_dup = question_names.add(question.name)
+            if is_dup:
+                parse_warns.append(f'question name `{question.name}` is not unique')
             question_schemas.append(
                 QuestionSchema(
                     name=question_name,
-                    meta=question_meta,
+                    meta=question_meta or {},
                     text_usr=question_text_usr,
-                    text_sys=question_test_sys,
+                    text_sys=sheet_text,
                     answer=question_answer,
-                    parse_warns=parse_warns.copy()
+                    parse_warns=parse_warns,
                 )
             )
 
@@ -36,3 +36,27 @@ key_names = [
 for k in key_names:
     if os.environ.get(k) is not None:
         Secrets[k] = os.environ.get(k)
+
+# Priority (highest to lowest):
+#  1. command line args  (not implemented yet)
+#  2. workspace config
+#  3. user config
+#  4. defaults defined in class's source attributes
+
+default_config_obj = {
+    'LocalModels': {
+        'llama_5t': {
+            'fn': '/mnt/llamas/mega.gguf',
+        },
+    },
+    'LocalParams': {
+        'temperature': 0.0,
+        'max_tokens': 20,
+        'seed': None,
+        'api_key': Secrets.get('ANTHROPIC_API_KEY'),
+    },
+    'DefaultSettings': {
+        'input_sheet_prefix': 'input',
+        'output_sheet_prefix': 'output',
+    },
+}
@@ -27,14 +27,33 @@ def get_workspace_config_dir():
     '''
     try:
         cwd = os.getcwd()
-        while cwd != os.path.expanduser('~'):
+        home = os.path.expanduser('~')
+        while cwd != home:
             if os.path.exists(os.path.join(cwd, CONFIG_DIR_NAME)):
                 return os.path.join(cwd, CONFIG_DIR_NAME)
-            cwd = os.path.dirname(cwd)
+            parent = os.path.dirname(cwd)
+            if parent == cwd:
+                break   # reached the root without passing through home
+            cwd = parent
     except Exception as e:
         return None
     return None
 
+def get_cache_dir(sub_dir: str = None) -> str:
+    '''
+        cache lives in the workspace's .lime dir if there is one,
+        otherwise in a .lime dir in the cwd
+    '''
+    workspace_config_fn = get_workspace_config_dir()
+    if workspace_config_fn is not None:
+        lime_dir = os.path.dirname(workspace_config_fn)
+    else:
+        lime_dir = os.path.join(os.getcwd(), CONFIG_DIR)
+    cache_dir = os.path.join(lime_dir, 'cache')
+    if sub_dir is not None:
+        cache_dir = os.path.join(cache_dir, sub_dir)
+    return cache_dir
+
 def get_lime_version():
     try:
         return pkg_resources.get_distribution('lime').version
@@ -1,5 +1,5 @@
 import sys, json
-from typing import Any, List, Union
+from typing import Any, Dict, List, Union
 from lime.common.models.internal import (
     QuestionSchema,
     SheetSchema,
@@ -29,6 +29,7 @@ class SheetProgressMsg:
         ):
         self.verbose = verbose_level
         self.n_chars = 13
+        self.streamed = False
 
     @staticmethod
     def _grid_fmt_gen(
@@ -79,6 +80,14 @@ class SheetProgressMsg:
             s += fmt(question_obj.text_usr)
             s += sep
         print(s, end='', flush=True)
+        self.streamed = False
+
+    def stream(self, text: str) -> None:
+        '''completion text as it's streamed, at full verbosity'''
+        if self.verbose < 2:
+            return
+        print(text.replace('\n', ' '), end='', flush=True)
+        self.streamed = True
 
     def post_prompt(
             self, 
@@ -112,7 +121,8 @@ class SheetProgressMsg:
         
         n_chars = self.n_chars if self.verbose == 1 else None
             
-        s = ''
+        s = sep if self.streamed else ''
+        self.streamed = False
         s += fmt(f'grade: {grade_symbol}')
         s += sep
         s += fmt(f'{q_out.eval_time:.2f} secs')
@@ -120,9 +130,11 @@ class SheetProgressMsg:
         if q_out.error is not None:
             s += fmt(f'err: {q_out.error}')
             s += sep
-        if False:
-            tps = ( (q_out.ntokens.cmp or 0) / q_out.eval_time)
-            tps = f'{tps:.1f}' if tps > 0 else 'n/a'
+        if self.verbose > 1:
+            ttft = f'{q_out.ttft:.2f}' if q_out.ttft is not None else 'n/a'
+            s += fmt(f'ttft: {ttft}')
+            s += sep
+            tps = f'{q_out.tps:.1f}' if q_out.tps is not None else 'n/a'
             s += fmt(f'tps: {tps}')
             s += sep
 
@@ -150,6 +162,10 @@ class MainProgressMsg:
             # TODO - get extra info here
             pass
 
+    def jobs_init(self, jobs: int) -> None:
+        if self.verbose > 0:
+            print(f'Running sheets across {jobs} processes')
+
     def pre_loop(
             self,
             sheet_fns: List[str],
@@ -167,20 +183,79 @@ class MainProgressMsg:
         if self.verbose > 0:
             print(f'run_id: {output.header.run_id}')
 
-    def pre_sheet(
+    def parse_summary(
             self,
-            sheet_obj: SheetSchema,
+            sheet_fns: List[str],
+            sheet_objs: List[Union[SheetSchema, None]],
+            parse_errs: Dict[str, str],
         ) -> None:
-        if self.verbose > 0:
-            print(f"Processing: {sheet_obj.name} ... ", end='', flush=True)
-            parse_warns = {
+        '''parse warnings of all sheets, reported before evaluating any'''
+        parse_warns = {}
+        for sheet_fn, sheet_obj in zip(sheet_fns, sheet_objs):
+            if sheet_obj is None: continue
+            sheet_warns = {
                 e.name: e.parse_warns
                 for e in sheet_obj.questions
                 if len(e.parse_warns) > 0
             }
-            if len(parse_warns) > 0:
-                print(f" | {len(parse_warns)} parse warnings")
+            if len(sheet_warns) > 0:
+                parse_warns[sheet_fn] = sheet_warns
+        if self.verbose > 0:
+            n_questions = sum(len(e.questions) for e in sheet_objs if e is not None)
+            n_warns = sum(len(e) for e in parse_warns.values())
+            s =  f'Parsed {len(sheet_objs) - len(parse_errs)} sheets, '
+            s += f'{n_questions} questions'
+            if n_warns > 0:
+                s += f' | {n_warns} parse warnings in {len(parse_warns)} sheets'
+            if len(parse_errs) > 0:
+                s += f' | {len(parse_errs)} sheets failed'
+            print(s)
         if self.verbose > 1:
             if len(parse_warns) > 0:
                 print(json.dumps(parse_warns, indent=2))
+
+    def pre_sheet(
+            self,
+            sheet_obj: SheetSchema,
+        ) -> None:
+        if self.verbose > 0:
+            print(f"Processing: {sheet_obj.name} ... ", end='', flush=True)
+
+    def post_sheet(
+            self,
+            sheet_fn: str,
+            output_obj: Union[SheetOutputSchema, None],
+        ) -> None:
+        '''summary of a sheet processed by a worker (with --jobs)'''
+        if self.verbose == 0:
+            return
+        if output_obj is None:
+            print(f'Interrupted: {sheet_fn}')
+            return
+        total_questions = len(output_obj.questions)
+        num_errors = len([
+            e for e in output_obj.questions 
+            if e.error is not None
+        ])
+        num_correct = len([
+            e for e in output_obj.questions 
+            if (e.grading is not None) and e.grading.grade_bool
+        ])
+        s =  f'Completed: {output_obj.header.sheet_name} | '
+        s += f'{total_questions} questions | '
+        s += f'{num_errors} errors | '
+        s += f'{num_correct} correct'
+        print(s)
+
+    def resume_sheet(
+            self,
+            sheet_obj: SheetSchema,
+            prior_outputs: Dict[str, QuestionOutput],
+        ) -> None:
+        if self.verbose > 0:
+            n_prior = len([
+                e for e in sheet_obj.questions 
+                if e.name in prior_outputs
+            ])
+            print(f"Resuming: {n_prior} of {len(sheet_obj.questions)} questions completed")
     
\ No newline at end of file
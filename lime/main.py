@@ -23,6 +23,10 @@ from lime.commands.render  import (
     setup_parser as render_setup_parser,
     main as render_main,
 )
+from lime.commands.serve  import (
+    setup_parser as serve_setup_parser,
+    main as serve_main,
+)
 
 def main():
     '''
@@ -62,6 +66,11 @@ def main():
     render_setup_parser(render_parser)
     render_parser.set_defaults(func=render_main)
 
+    # Subcommand: serve-model
+    serve_parser = subparsers.add_parser('serve-model')
+    serve_setup_parser(serve_parser)
+    serve_parser.set_defaults(func=serve_main)
+
     # Invoke subcommand
     args = parser.parse_args()
     if hasattr(args, 'func'):
@@ -27,6 +27,7 @@ setup(
         'tiktoken',
         'flask',
         'requests',
+        'httpx',
         'anthropic',
     ],
     extras_require={
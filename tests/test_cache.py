@@ -0,0 +1,227 @@
+import os, sys, json
+from types import SimpleNamespace
+from unittest.mock import patch
+import numpy as np
+sys.path.append('.')
+from lime.commands.eval import eval_sheet
+from lime.common.controllers.parse import (
+    parse_to_obj,
+    get_md_schema,
+    MdSchema,
+)
+from lime.common.inference.base import PromptModelResponse
+from lime.common.inference.api_openai import OpenAIModelObj
+from lime.common.cache.completion import CompletionCache
+from lime.common.cache.llama_state import (
+    LlamaStateStore,
+    get_file_hash,
+)
+from lime.common.cache.parsed_sheet import ParseCache
+from lime.common.models.utils import get_cache_dir
+
+'''
+    Test the on-disk caches in lime.common.cache, each test uses
+    a tmp_path as the cache dir.
+'''
+
+p_prompt = 'lime.common.inference.api_openai.OpenAIModelObj.prompt_model'
+
+def test_completion_cache_eval(tmp_path):
+    '''second run of an unchanged sheet is served from the cache'''
+
+    sheet_obj = parse_to_obj(
+        './tests/data/input-three.md',
+        './lime/data/md-schema.yaml',
+    )
+    infer_obj = OpenAIModelObj('gpt-3.5-turbo')
+    completion_cache = CompletionCache(cache_dir=str(tmp_path))
+
+    with patch(p_prompt, return_value=PromptModelResponse('C', None)) as mock_prompt:
+
+        output_1 = eval_sheet(
+            sheet_obj, infer_obj, run_id='aaff',
+            completion_cache=completion_cache
+        )
+        assert mock_prompt.call_count == 2
+
+        output_2 = eval_sheet(
+            sheet_obj, infer_obj, run_id='bbff',
+            completion_cache=completion_cache
+        )
+        assert mock_prompt.call_count == 2
+
+    assert [q.cache_hit for q in output_1.questions] == [False, False]
+    assert [q.cache_hit for q in output_2.questions] == [True, True]
+    assert [q.completion for q in output_2.questions] == ['C', 'C']
+
+    # without a cache, cache_hit is not set
+    with patch(p_prompt, return_value=PromptModelResponse('C', None)):
+        output_3 = eval_sheet(sheet_obj, infer_obj, run_id='ccff')
+    assert output_3.questions[0].cache_hit is None
+
+
+def test_completion_cache_not_cacheable(tmp_path):
+    '''errors and temperature > 0 completions are not cached'''
+
+    sheet_obj = parse_to_obj(
+        './tests/data/input-three.md',
+        './lime/data/md-schema.yaml',
+    )
+    infer_obj = OpenAIModelObj('gpt-3.5-turbo')
+    completion_cache = CompletionCache(cache_dir=str(tmp_path))
+
+    with patch(p_prompt, return_value=PromptModelResponse(None, ValueError('x'))):
+        eval_sheet(
+            sheet_obj, infer_obj, run_id='aaff',
+            completion_cache=completion_cache
+        )
+    assert completion_cache.size() == 0
+
+    infer_obj.update_gen_params({'temperature': 0.7})
+    with patch(p_prompt, return_value=PromptModelResponse('C', None)):
+        output = eval_sheet(
+            sheet_obj, infer_obj, run_id='aaff',
+            completion_cache=completion_cache
+        )
+    assert completion_cache.size() == 0
+    assert output.questions[0].cache_hit is None
+
+
+def test_completion_cache_eviction(tmp_path):
+    '''least recently used entries are evicted past max_bytes'''
+
+    completion_cache = CompletionCache(cache_dir=str(tmp_path), max_bytes=300)
+
+    keys = [completion_cache.make_key({'prompt': str(i)}) for i in range(3)]
+
+    completion_cache.put(keys[0], 'a' * 50)
+    completion_cache.put(keys[1], 'b' * 50)
+    assert completion_cache.get(keys[0]) == 'a' * 50   # now most recent
+    completion_cache.put(keys[2], 'c' * 50)
+
+    assert completion_cache.size() <= 300
+    assert completion_cache.get(keys[1]) is None
+    assert completion_cache.get(keys[0]) == 'a' * 50
+    assert completion_cache.get(keys[2]) == 'c' * 50
+
+    # entries persist across instances
+    completion_cache.close()
+    completion_cache = CompletionCache(cache_dir=str(tmp_path), max_bytes=300)
+    assert completion_cache.get(keys[2]) == 'c' * 50
+
+
+def test_llama_state_store(tmp_path):
+    '''states round trip through (memory-mapped) files, keyed on content'''
+
+    store = LlamaStateStore(cache_dir=str(tmp_path))
+    n_ctx, n_vocab, n_tokens = 16, 8, 5
+    input_ids = np.zeros(n_ctx, dtype=np.intc)
+    input_ids[:n_tokens] = [1, 10, 20, 30, 40]
+    scores = np.zeros((n_ctx, n_vocab), dtype=np.single)
+    scores[:n_tokens] = np.arange(n_tokens * n_vocab).reshape(n_tokens, n_vocab)
+    state = SimpleNamespace(
+        input_ids=input_ids,
+        scores=scores,
+        n_tokens=n_tokens,
+        llama_state=b'kv' * 50,
+        llama_state_size=100,
+    )
+    
+    key = store.make_key({'model_hash': 'abc', 'prompt': 'sheet prompt'})
+    assert key != store.make_key({'model_hash': 'abd', 'prompt': 'sheet prompt'})
+    
+    with patch('lime.common.cache.llama_state.LlamaState', SimpleNamespace):
+        assert store.load(key) is None
+        store.save(key, state)
+        loaded = store.load(key)
+
+    assert loaded.n_tokens == n_tokens
+    assert np.array_equal(loaded.input_ids, input_ids)
+    assert np.array_equal(loaded.scores, scores)
+    assert bytes(loaded.llama_state) == b'kv' * 50
+    assert loaded.llama_state_size == 100
+    # trailing unused scores rows aren't written
+    assert store.size() < scores.nbytes
+
+    # least recently used files are evicted past max_bytes
+    store.max_bytes = store.size() + 10
+    store.save(store.make_key({'prompt': 'other'}), state)
+    assert len(os.listdir(store.cache_dir)) == 1
+
+
+def test_file_hash(tmp_path):
+    '''file hashes are kept in an index until the file changes'''
+    fn = str(tmp_path / 'weights.gguf')
+    with open(fn, 'wb') as f:
+        f.write(b'weights' * 1000)
+    
+    h = get_file_hash(fn, cache_dir=str(tmp_path))
+    assert os.path.exists(tmp_path / 'file_hashes.json')
+    with patch('hashlib.sha256') as mock_sha:
+        assert get_file_hash(fn, cache_dir=str(tmp_path)) == h
+        assert mock_sha.call_count == 0
+    
+    with open(fn, 'ab') as f:
+        f.write(b'more')
+    assert get_file_hash(fn, cache_dir=str(tmp_path)) != h
+
+
+p_parse = 'lime.common.controllers.parse.SheetParser.parse'
+
+def test_parse_cache(tmp_path):
+    '''unchanged sheets are served from the cache, by file or content'''
+    sheet_fn = str(tmp_path / 'input-three.md')
+    with open('./tests/data/input-three.md', 'r') as f:
+        text = f.read()
+    with open(sheet_fn, 'w') as f:
+        f.write(text)
+    
+    parse_cache = ParseCache(cache_dir=str(tmp_path))
+    sheet_obj = parse_to_obj(sheet_fn, parse_cache=parse_cache)
+    assert sheet_obj == parse_to_obj(sheet_fn)
+    
+    # fast path: neither read nor parsed
+    with patch('builtins.open') as mock_open, patch(p_parse) as mock_parse:
+        sheet_obj_2 = parse_to_obj(sheet_fn, parse_cache=parse_cache)
+        assert mock_open.call_count == 0
+        assert mock_parse.call_count == 0
+    assert sheet_obj_2 == sheet_obj
+
+    # touched but same content: read, but not parsed
+    stat = os.stat(sheet_fn)
+    os.utime(sheet_fn, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    with patch(p_parse) as mock_parse:
+        assert parse_to_obj(sheet_fn, parse_cache=parse_cache) == sheet_obj
+        assert mock_parse.call_count == 0
+
+    # changed content is parsed again
+    with open(sheet_fn, 'w') as f:
+        f.write(text.replace('Sheet-Three', 'Sheet-Four'))
+    sheet_obj_3 = parse_to_obj(sheet_fn, parse_cache=parse_cache)
+    assert sheet_obj_3 != sheet_obj
+    assert sheet_obj_3 == parse_to_obj(sheet_fn)
+
+
+def test_parse_cache_schema_version(tmp_path):
+    '''a different md-schema doesn't use sheets parsed with another'''
+    md_schema = get_md_schema()
+    schema_2 = json.loads(json.dumps(md_schema.schema))
+    schema_2['extra'] = {'md_header': 9, 'children': {'md_header': 10, 'options': []}}
+    assert MdSchema(schema_2).version != md_schema.version
+    assert MdSchema(md_schema.schema).version == md_schema.version
+
+    sheet_fn = './tests/data/input-three.md'
+    parse_cache = ParseCache(cache_dir=str(tmp_path))
+    parse_to_obj(sheet_fn, parse_cache=parse_cache)
+    file_id = parse_cache.file_id(sheet_fn)
+    assert parse_cache.get_by_file(file_id, md_schema.version) is not None
+    assert parse_cache.get_by_file(file_id, MdSchema(schema_2).version) is None
+
+
+def test_cache_dir_outside_home(tmp_path, monkeypatch):
+    '''the workspace lookup stops at the root when cwd isn't under ~'''
+    monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+    work_dir = tmp_path / 'work'
+    work_dir.mkdir()
+    monkeypatch.chdir(work_dir)
+    assert get_cache_dir() == str(work_dir / '.lime' / 'cache')
@@ -0,0 +1,106 @@
+import os, sys, json, gzip
+from unittest.mock import patch, MagicMock
+from requests.structures import CaseInsensitiveDict
+sys.path.append('.')
+from lime.common.inference.cpl_client import (
+    CPLModelObj,
+)
+from lime.common.inference.cpl_server import (
+    CPLBaseServer,
+)
+
+'''
+    Test the CPL client <-> server protocol without a live server:
+    - client side: stub the session's post and inspect the request
+    - server side: use flask's test_client
+'''
+
+class EchoServer(CPLBaseServer):
+    def generate_answer(self, question: str, **kwargs) -> str:
+        return question.upper()
+
+
+def mock_response(answer: str) -> MagicMock:
+    response = MagicMock()
+    response.status_code = 200
+    response.json.return_value = {'answer': answer}
+    return response
+
+
+def test_cpl_session_reuse():
+    '''one pooled session is used for all requests, with a timeout'''
+
+    infer_obj = CPLModelObj('cpl_test')
+
+    with patch('requests.Session.post', return_value=mock_response('ok')) as mock_post:
+
+        for _ in range(3):
+            completion, error = infer_obj.prompt_model(prompt_usr='hello')
+            assert completion == 'ok'
+            assert error is None
+
+        assert mock_post.call_count == 3
+        kwargs = mock_post.call_args.kwargs
+        assert kwargs['json'] == {'question': 'hello', **infer_obj.profile_params}
+        assert kwargs['timeout'] == infer_obj.get_timeout()
+        assert kwargs['timeout'][1] is not None
+
+    assert infer_obj.get_session() is infer_obj.get_session()
+
+
+def test_cpl_gzip_payload():
+    '''gzip'd payloads are encoded by the client and decoded by the server'''
+
+    infer_obj = CPLModelObj('cpl_test', gzip_payload=True)
+
+    with patch('requests.Session.post', return_value=mock_response('ok')) as mock_post:
+        infer_obj.prompt_model(prompt_usr='hello')
+        kwargs = mock_post.call_args.kwargs
+
+    assert 'json' not in kwargs
+    assert kwargs['headers'] == {'Content-Encoding': 'gzip'}
+    assert json.loads(gzip.decompress(kwargs['data']))['question'] == 'hello'
+
+    server = EchoServer()
+    client = server.app.test_client()
+
+    response = client.post(
+        '/infer',
+        data=kwargs['data'],
+        headers={'Content-Type': 'application/json', **kwargs['headers']},
+    )
+    assert response.status_code == 200
+    assert response.get_json() == {'answer': 'HELLO'}
+
+    # non-gzip'd requests still work
+    response = client.post('/infer', json={'question': 'hi'})
+    assert response.get_json() == {'answer': 'HI'}
+
+
+def test_cpl_stream_json_fallback():
+    '''a streamed prompt reads text chunks, or a json answer if not streamed'''
+
+    infer_obj = CPLModelObj('cpl_test')
+
+    response = mock_response('not streamed')
+    response.headers = CaseInsensitiveDict({'Content-Type': 'application/json'})
+    response.__enter__.return_value = response
+    chunks = []
+    with patch('requests.Session.post', return_value=response):
+        completion, error = infer_obj.prompt_model(
+            prompt_usr='hello', progress_cb=chunks.append,
+        )
+    assert (completion, error) == ('not streamed', None)
+    assert chunks == ['not streamed']
+
+    response = mock_response(None)
+    response.headers = CaseInsensitiveDict({'Content-Type': 'text/plain; charset=utf-8'})
+    response.iter_content.return_value = iter(['stre', 'amed'])
+    response.__enter__.return_value = response
+    chunks = []
+    with patch('requests.Session.post', return_value=response):
+        completion, error = infer_obj.prompt_model(
+            prompt_usr='hello', progress_cb=chunks.append,
+        )
+    assert (completion, error) == ('streamed', None)
+    assert chunks == ['stre', 'amed']
@@ -1,15 +1,31 @@
-import os, sys, json
+import os, sys, json, time
+import pytest
+import asyncio
 from unittest.mock import patch
 from contextlib import contextmanager
-from openai.types.chat import ChatCompletion
+from openai import OpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
 from lime.commands.eval import (
     eval_sheet, 
+    aeval_sheet,
     batch_eval,
+    eval_question,
     get_sheet_fns,
+    run_sheet,
+    make_journal_fp,
+)
+from lime.common.views.msg.eval import (
+    MainProgressMsg,
+)
+from lime.common.models.errs import (
+    BaseQuietError,
 )
 from lime.common.controllers.parse import (
     parse_to_obj,
 )
+from lime.common.controllers.journal import (
+    read_journal,
+)
 from lime.common.inference.base import (
     PromptModelResponse,
 )
@@ -29,6 +45,21 @@ def load_chat_completion(fn: str) -> ChatCompletion:
         except Exception as e:
             print(e)
     
+def stream_chat_completion(chat_completion: ChatCompletion) -> list:
+    '''the chunks returned for chat_completion with stream=True'''
+    content = chat_completion.choices[0].message.content
+    pieces = [content[i:i+8] for i in range(0, len(content), 8)]
+    return [
+        ChatCompletionChunk(
+            id=chat_completion.id,
+            choices=[{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}],
+            created=chat_completion.created,
+            model=chat_completion.model,
+            object='chat.completion.chunk',
+        )
+        for piece in pieces
+    ]
+
 RESPONSE_STUB_FN = './tests/data/stubs/completion.json'
 MODEL_RESPONSE_STUB = load_chat_completion(RESPONSE_STUB_FN)
 
@@ -257,34 +288,481 @@ def test_get_sheet_fns_2():
         assert fn in sheet_fns
 
 def test_eval_anthropic():
-    '''Test Anthropic model inference with a mocked API response'''
+    '''
+        AnthropicModelObj sends the sheet prompt as a cached system prompt
+        through its pooled client, plain and streamed, sync and async
+    '''
+    import httpx
+    
+    requests_sent = []
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        requests_sent.append((request, body))
+        if not body.get('stream'):
+            return httpx.Response(200, json={
+                'content': [{'type': 'text', 'text': 'Test completion'}],
+                'usage': {'input_tokens': 12, 'output_tokens': 2},
+            })
+        events = [
+            {'type': 'message_start', 'message': {}},
+            {'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': 'Test '}},
+            {'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': 'completion'}},
+            {'type': 'message_delta', 'usage': {'output_tokens': 2}},
+            {'type': 'message_stop'},
+        ]
+        sse = ''.join(
+            f"event: {e['type']}\ndata: {json.dumps(e)}\n\n" for e in events
+        )
+        return httpx.Response(200, text=sse)
+
+    model = AnthropicModelObj('claude-3-5-sonnet', api_key='test_key')
+    assert model.api_model_name == 'claude-3-5-sonnet-20240620'
+    transport = httpx.MockTransport(handler)
+    model.client = httpx.Client(transport=transport, **model._http_client_kwargs())
+
+    completion, error = model.prompt_model(
+        prompt_sys='Sheet prompt. ', prompt_usr='Test prompt', max_tokens=20,
+    )
+    assert (completion, error) == ('Test completion', None)
+    assert model.count_tokens('Test completion') == 2
+
+    request, body = requests_sent[-1]
+    assert str(request.url) == 'https://api.anthropic.com/v1/messages'
+    assert request.headers['x-api-key'] == 'test_key'
+    assert request.headers['anthropic-version'] == '2023-06-01'
+    assert body['model'] == 'claude-3-5-sonnet-20240620'
+    assert body['messages'] == [{'role': 'user', 'content': 'Test prompt'}]
+    assert body['system'] == [{
+        'type': 'text',
+        'text': 'Sheet prompt. ',
+        'cache_control': {'type': 'ephemeral'},
+    }]
+    assert body['max_tokens'] == 20
+    assert 'seed' not in body
+
+    streamed = []
+    completion, error = model.prompt_model(
+        prompt_sys=None, prompt_usr='Test prompt', progress_cb=streamed.append,
+    )
+    assert (completion, error) == ('Test completion', None)
+    assert streamed == ['Test ', 'completion']
+    assert 'system' not in requests_sent[-1][1]
+
+    async def aprompt():
+        model.aclient = httpx.AsyncClient(transport=transport, **model._http_client_kwargs())
+        model.aclient_loop = asyncio.get_running_loop()
+        return await model.aprompt_model(prompt_sys='Sheet prompt. ', prompt_usr='Test prompt')
+    assert asyncio.run(aprompt()) == ('Test completion', None)
+    assert len(requests_sent) == 3
+
+    # other texts are counted locally, not by a request
+    assert model.count_tokens('Twenty-seven chars of text.') == 8
+    assert len(requests_sent) == 3
+
+    # the system and user prompts are keyed apart
+    assert (
+        model.cache_key_data('Sheet prompt. ', 'Test prompt') !=
+        model.cache_key_data('Sheet prompt. Test ', 'prompt')
+    )
+
+def test_eval_concurrency_1():
+    '''
+        with concurrency > 1, questions are prompted through a thread pool
+        but output questions are returned in sheet order
+    '''
+    input_md = './tests/data/input-three.md'
+    input_schema = './lime/data/md-schema.yaml'
 
-    with patch('lime.common.models.state.Secrets.get', return_value='test_key'):
-        model = AnthropicModelObj('claude-3-5-sonnet')
-        
-        with patch('lime.common.inference.api_anthropic.requests.post') as mock_post:
-            mock_post.return_value.json.return_value = {'content': [{'text': 'Test completion'}]}
-            mock_post.return_value.raise_for_status = lambda: None
+    sheet_obj = parse_to_obj(input_md, input_schema)
+    infer_obj = OpenAIModelObj('gpt-3.5-turbo')
+
+    # make the first question finish last
+    def mock_prompt_model(prompt_sys, prompt_usr, **kwargs):
+        if 'early bird' in prompt_usr:
+            time.sleep(0.2)
+        return PromptModelResponse(prompt_usr[:10], None)
 
-            completion = model.prompt_model('Test prompt')
+    with patch('lime.common.inference.api_openai.OpenAIModelObj.prompt_model') as mock_submit_prompt:
+            
+        mock_submit_prompt.side_effect = mock_prompt_model
             
-            assert completion == 'Test completion'
-
-            mock_post.assert_called_once_with(
-                'https://api.anthropic.com/v1/messages',
-                headers={
-                    'x-api-key': 'test_key',
-                    'anthropic-version': '2023-06-01',
-                    'Content-Type': 'application/json',
-                },
-                json={
-                    'model': 'claude-3-5-sonnet-20240620',
-                    'messages': [{'role': 'user', 'content': 'Test prompt'}],
-                    'temperature': 0.0,
-                    'max_tokens': 20,
-                    'seed': None,
-                }
-            )
+        output = eval_sheet(
+            sheet_obj,
+            infer_obj,
+            run_id='aaff',
+            concurrency=4,
+        )
+
+        assert mock_submit_prompt.call_count == 2
+    
+    assert [q.name for q in output.questions] == ['Q-1', 'Q-2']
+    assert output.questions[0].completion == 'Q: What di'
+    assert output.questions[1].completion == 'Q: Who cut'
+    assert output.questions[0].eval_time >= 0.2
+    assert output.questions[1].eval_time < 0.2
+
+def test_eval_async_1():
+    '''
+        aeval_sheet drives the native async client of OpenAIModelObj
+        with several prompts in flight, outputs remain in sheet order
+    '''
+    input_md = './tests/data/input-three.md'
+    input_schema = './lime/data/md-schema.yaml'
+
+    sheet_obj = parse_to_obj(input_md, input_schema)
+    infer_obj = OpenAIModelObj('gpt-3.5-turbo')
+
+    in_flight, max_in_flight = [0], [0]
+    async def mock_create(*args, **kwargs):
+        in_flight[0] += 1
+        max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+        await asyncio.sleep(0.05)
+        in_flight[0] -= 1
+        assert not kwargs.get('stream')
+        return MODEL_RESPONSE_STUB
+
+    p_method = 'openai.resources.chat.completions.AsyncCompletions.create'
+    with patch(p_method) as mock_completions_create:
+        
+        mock_completions_create.side_effect = mock_create
+
+        output = asyncio.run(aeval_sheet(
+            sheet_obj,
+            infer_obj,
+            run_id='aaff',
+            concurrency=2,
+        ))
+
+        assert mock_completions_create.call_count == 2
+
+    assert max_in_flight[0] == 2
+    assert [q.name for q in output.questions] == ['Q-1', 'Q-2']
+    STUB_COMPLETION = '"Grazie per i muffin alla griglia."'
+    assert output.questions[0].completion == STUB_COMPLETION
+    assert output.questions[0].error is None
+
+def test_eval_client_reuse_1():
+    '''
+        the OpenAI client (and its connection pool) is built once 
+        per model object and reused for every question
+    '''
+    input_md = './tests/data/input-three.md'
+    input_schema = './lime/data/md-schema.yaml'
+
+    sheet_obj = parse_to_obj(input_md, input_schema)
+    infer_obj = OpenAIModelObj('gpt-3.5-turbo')
+
+    p_client = 'lime.common.inference.api_openai.OpenAI'
+    p_method = 'openai.resources.chat.completions.Completions.create'
+    with (
+        patch(p_client, wraps=OpenAI) as mock_client,
+        patch(p_method, return_value=MODEL_RESPONSE_STUB) as mock_create,
+    ):
+        
+        eval_sheet(sheet_obj, infer_obj, run_id='aaff')
+        eval_sheet(sheet_obj, infer_obj, run_id='aaff')
+
+        assert mock_create.call_count == 4
+        assert mock_client.call_count == 1
+
+def test_eval_count_tokens_memo_1():
+    '''
+        the encoder is resolved once per model object and identical 
+        texts (e.g. the sheet prompt, same completions) are not re-encoded
+    '''
+    input_md = './tests/data/input-three.md'
+    input_schema = './lime/data/md-schema.yaml'
+
+    sheet_obj = parse_to_obj(input_md, input_schema)
+    infer_obj = OpenAIModelObj('gpt-3.5-turbo')
+
+    encoded = []
+    class MockEncoder:
+        def encode(self, text):
+            encoded.append(text)
+            return text.split()
+
+    completion = infer_obj._get_completion(MODEL_RESPONSE_STUB)
+    p_encoder = 'lime.common.inference.api_openai.get_tiktoken_encoder'
+    p_prompt = 'lime.common.inference.api_openai.OpenAIModelObj.prompt_model'
+    with (
+        patch(p_encoder, return_value=MockEncoder()) as mock_get_encoder,
+        patch(p_prompt, return_value=PromptModelResponse(completion, None)),
+    ):
+        output_1 = eval_sheet(sheet_obj, infer_obj, run_id='aaff')
+        output_2 = eval_sheet(sheet_obj, infer_obj, run_id='aaff')
+
+        assert mock_get_encoder.call_count == 1
+    
+    # sheet prompt + two questions + one (identical) completion
+    assert len(encoded) == 4
+    assert output_1.questions[0].ntokens == output_2.questions[0].ntokens
+    assert output_1.questions[0].ntokens.sys == len(sheet_obj.text.split())
+
+def test_eval_stream_1():
+    '''
+        the completion is streamed to stream_cb, and the output records
+        time-to-first-token and tokens/sec of the streamed chunks
+    '''
+    input_md = './tests/data/input-three.md'
+    input_schema = './lime/data/md-schema.yaml'
+
+    sheet_obj = parse_to_obj(input_md, input_schema)
+    infer_obj = OpenAIModelObj('gpt-3.5-turbo')
+
+    def mock_create(*args, **kwargs):
+        assert kwargs.get('stream')
+        for chunk in stream_chat_completion(MODEL_RESPONSE_STUB):
+            time.sleep(0.02)
+            yield chunk
+
+    streamed = []
+    p_method = 'openai.resources.chat.completions.Completions.create'
+    p_count = 'lime.common.inference.api_openai.OpenAIModelObj.count_tokens'
+    with (
+        patch(p_method, side_effect=mock_create),
+        patch(p_count, return_value=10),
+    ):
+        q_out = eval_question(
+            sheet_obj.questions[0], infer_obj, ntokens_sys=0,
+            stream_cb=streamed.append,
+        )
+
+    STUB_COMPLETION = '"Grazie per i muffin alla griglia."'
+    assert q_out.completion == STUB_COMPLETION
+    assert ''.join(streamed) == STUB_COMPLETION
+    assert len(streamed) > 1
+    assert q_out.ttft >= 0.02
+    assert q_out.ttft < q_out.eval_time
+    # 10 tokens over the chunks after the first
+    gen_time = 0.02 * (len(streamed) - 1)
+    assert 0 < q_out.tps <= 10 / gen_time
+
+    # no stream timing for dry runs
+    q_out = eval_question(
+        sheet_obj.questions[0], infer_obj, ntokens_sys=0, dry_run=True,
+    )
+    assert q_out.ttft is None
+    assert q_out.tps is None
+
+def test_eval_early_stop_1():
+    '''
+        with a stop predicate in the question's meta, the stream is 
+        stopped once it's satisfied and the completion truncated
+    '''
+    input_md = './tests/data/input-three.md'
+    input_schema = './lime/data/md-schema.yaml'
+
+    sheet_obj = parse_to_obj(input_md, input_schema)
+    question = sheet_obj.questions[0].model_copy(
+        update={'meta': {'stop_sequences': 'muffin'}}
+    )
+    infer_obj = OpenAIModelObj('gpt-3.5-turbo')
+
+    n_sent = [0]
+    def mock_create(*args, **kwargs):
+        for chunk in stream_chat_completion(MODEL_RESPONSE_STUB):
+            n_sent[0] += 1
+            yield chunk
+
+    p_method = 'openai.resources.chat.completions.Completions.create'
+    with patch(p_method, side_effect=mock_create):
+        q_out = eval_question(question, infer_obj, ntokens_sys=0)
+
+    assert q_out.completion == '"Grazie per i '
+    n_chunks = len(stream_chat_completion(MODEL_RESPONSE_STUB))
+    assert n_sent[0] < n_chunks
+
+def test_eval_journal_1(tmp_path):
+    '''
+        with a tmp_output_fn, each question is appended to a jsonl 
+        journal which compacts back to the same output
+    '''
+    input_md = './tests/data/input-three.md'
+    input_schema = './lime/data/md-schema.yaml'
+
+    sheet_obj = parse_to_obj(input_md, input_schema)
+    infer_obj = OpenAIModelObj('gpt-3.5-turbo')
+    
+    journal_fn = str(tmp_path / 'tmp-output-three.jsonl')
+
+    completion = infer_obj._get_completion(MODEL_RESPONSE_STUB)
+    p_prompt = 'lime.common.inference.api_openai.OpenAIModelObj.prompt_model'
+    with patch(p_prompt, return_value=PromptModelResponse(completion, None)):
+        output = eval_sheet(
+            sheet_obj, 
+            infer_obj, 
+            run_id='aaff', 
+            tmp_output_fn=journal_fn,
+        )
+
+    with open(journal_fn, 'r') as f:
+        lines = f.readlines()
+    
+    # one header record + one record per question
+    assert len(lines) == 3
+    assert 'header' in json.loads(lines[0])
+    assert json.loads(lines[1])['question']['name'] == 'Q-1'
+
+    assert read_journal(journal_fn) == output
+
+    # a truncated last record (e.g. crash mid-write) is skipped
+    with open(journal_fn, 'w') as f:
+        f.writelines(lines[:2] + [lines[2][:20]])
+    
+    partial = read_journal(journal_fn)
+    assert [q.name for q in partial.questions] == ['Q-1']
+
+def test_eval_resume_1(tmp_path):
+    '''
+        resuming a run re-uses the run_id / output path and only
+        prompts the questions which weren't completed without error
+    '''
+    input_md = str(tmp_path / 'input-three.md')
+    with open('./tests/data/input-three.md', 'r') as f_in:
+        with open(input_md, 'w') as f_out:
+            f_out.write(f_in.read())
+
+    prompted = []
+    def mock_prompt_model(prompt_sys, prompt_usr, **kwargs):
+        prompted.append(prompt_usr)
+        if len(prompted) == 2:
+            return PromptModelResponse(None, ValueError('rate limited'))
+        return PromptModelResponse('ok', None)
+
+    p_prompt = 'lime.common.inference.api_openai.OpenAIModelObj.prompt_model'
+    p_valid = 'lime.common.inference.api_openai.OpenAIModelObj.check_valid'
+    with (
+        patch(p_prompt, side_effect=mock_prompt_model),
+        patch(p_valid, return_value=True),
+    ):
+        batch_eval([input_md], 'gpt-3.5-turbo', 'aaff', use_prompt_cache=False)
+        assert len(prompted) == 2
+
+        batch_eval([input_md], 'gpt-3.5-turbo', 'aaff', use_prompt_cache=False, resume=True)
+        assert len(prompted) == 3
+        assert 'blind mice' in prompted[2]
+
+    output_fp = str(tmp_path / 'output-three-gpt-3.5-turbo-aaff.json')
+    with open(output_fp, 'r') as f:
+        output = json.load(f)
+    assert [q['name'] for q in output['questions']] == ['Q-1', 'Q-2']
+    assert [q['error'] for q in output['questions']] == [None, None]
+    assert output['header']['run_id'] == 'aaff'
+
+def test_eval_batch_1():
+    '''
+        models with prompt_model_batch (local models) get `concurrency` 
+        questions per call, outputs stay in sheet order
+    '''
+    sheet_obj = parse_to_obj(
+        './tests/data/input-three.md',
+        './lime/data/md-schema.yaml',
+    )
+    infer_obj = OpenAIModelObj('gpt-3.5-turbo')
+    
+    def mock_prompt_model_batch(prompts, stop_fns=None):
+        return [
+            PromptModelResponse(prompt_usr[-8:], None)
+            for _, prompt_usr, _ in prompts
+        ]
+    
+    with patch.object(
+        OpenAIModelObj, 'prompt_model_batch', create=True,
+        side_effect=mock_prompt_model_batch,
+    ) as mock_batch:
+        output = eval_sheet(sheet_obj, infer_obj, run_id='aaff', concurrency=2)
+    
+    assert mock_batch.call_count == 1
+    assert len(mock_batch.call_args.args[0]) == 2
+    assert [q.completion for q in output.questions] == [
+        q.text_usr[-8:] for q in sheet_obj.questions
+    ]
+
+
+def test_eval_jobs_1(tmp_path):
+    '''
+        sheets sharded across a process pool each get their own output,
+        the same as when run sequentially (dry_run so workers don't call
+        the api; patches don't cross the process boundary)
+    '''
+    input_mds = []
+    for name in ['input-one.md', 'input-three.md']:
+        input_md = str(tmp_path / name)
+        with open(f'./tests/data/{name}', 'r') as f_in:
+            with open(input_md, 'w') as f_out:
+                f_out.write(f_in.read())
+        input_mds.append(input_md)
+
+    batch_eval(input_mds, 'gpt-3.5-turbo', 'aaff', dry_run=True, jobs=2)
+    
+    for name, n_questions in [('one', 2), ('three', 2)]:
+        output_fp = str(tmp_path / f'output-{name}-gpt-3.5-turbo-aaff.json')
+        with open(output_fp, 'r') as f:
+            output = json.load(f)
+        assert output['header']['run_id'] == 'aaff'
+        assert len(output['questions']) == n_questions
+        assert all(q['completion'] is None for q in output['questions'])
+
+
+def test_eval_parse_fail_fast_1(tmp_path):
+    '''
+        every sheet is parsed before any is evaluated: a sheet which
+        fails to parse stops the run before the model is even created
+    '''
+    input_mds = ['./tests/data/input-one.md', str(tmp_path / 'input-missing.md')]
+    p_make = 'lime.commands.eval.make_infer_obj'
+    with patch(p_make) as mock_make:
+        with pytest.raises(BaseQuietError) as exc_info:
+            batch_eval(input_mds, 'gpt-3.5-turbo', 'aaff', dry_run=True)
+        assert mock_make.call_count == 0
+    assert 'input-missing.md' in str(exc_info.value)
+    assert not os.path.exists('./tests/data/output-one-gpt-3.5-turbo-aaff.json')
+
+
+def test_eval_interrupt_1(tmp_path):
+    '''
+        on an interrupt, the journal of the questions completed so far
+        is compacted into the output file and then removed
+    '''
+    input_md = str(tmp_path / 'input-three.md')
+    with open('./tests/data/input-three.md', 'r') as f_in:
+        with open(input_md, 'w') as f_out:
+            f_out.write(f_in.read())
+    output_fp = str(tmp_path / 'output-three-gpt-3.5-turbo-aaff.json')
+    journal_fp = make_journal_fp(output_fp)
+    assert journal_fp == str(tmp_path / 'tmp-output-three-gpt-3.5-turbo-aaff.jsonl')
+    assert make_journal_fp('out/results').endswith('tmp-results.jsonl')
+
+    infer_obj = OpenAIModelObj('gpt-3.5-turbo')
+    sheet_obj = parse_to_obj(input_md)
+
+    def interrupted_eval_sheet(**kwargs):
+        # one question completes, then Ctrl+C
+        calls = []
+        def mock_prompt_model(*args, **kw):
+            calls.append(1)
+            if len(calls) > 1:
+                raise KeyboardInterrupt
+            return PromptModelResponse('ok', None)
+        with patch.object(infer_obj, 'prompt_model', side_effect=mock_prompt_model):
+            return eval_sheet(**kwargs)
+    
+    with (
+        patch('lime.commands.eval.ExecSettings.save_tmp_file', True),
+        patch('lime.commands.eval.eval_sheet', side_effect=interrupted_eval_sheet),
+        patch('lime.commands.eval.continue_or_exit'),
+    ):
+        output = run_sheet(
+            input_md, 'gpt-3.5-turbo', MainProgressMsg(),
+            sheet_obj=sheet_obj, run_id='aaff', infer_obj=infer_obj,
+        )
+    
+    assert [q.completion for q in output.questions] == ['ok']
+    assert not os.path.exists(journal_fp)
+    with open(output_fp, 'r') as f:
+        assert len(json.load(f)['questions']) == 1
+
 
 if __name__ == '__main__':
     test_get_sheet_fns_1()
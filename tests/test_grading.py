@@ -2,6 +2,7 @@ import os, sys, json, time
 from unittest import mock
 
 from lime.common.grading.fuzzy import fuzzier_match
+from lime.common.grading.early_stop import get_stop_predicate
 
 def test_fuzzier_match_1():
     '''
@@ -142,5 +143,49 @@ def test_fuzzier_match_partial_2():
     assert fuzzier_match(ground_truth, completion, allow_just_letter=True) == False
 
 
+def test_stop_predicate_1():
+    '''
+        stop predicates from (sheet) meta: off unless one is set,
+        and stopping never changes the fuzzy grade
+    '''
+    assert get_stop_predicate({}, 'B) 6') is None
+    assert get_stop_predicate({'stop_regex': 'None'}, 'B) 6') is None
+    assert get_stop_predicate({'stop_answer_len': 'true'}, None) is None
+
+    # regex: keep through the match
+    stop_fn = get_stop_predicate({'stop_regex': r'[A-D]\)'})
+    assert not stop_fn('The answer')
+    assert stop_fn('The answer is B)')
+    assert stop_fn.truncate('B) 6, because...') == 'B)'
+
+    # stop sequences: cut before the sequence
+    stop_fn = get_stop_predicate({'stop_sequences': '["\\n", "Q:"]'})
+    assert stop_fn.sequences == ['\n', 'Q:']
+    assert stop_fn.truncate('B) 6 Q: next') == 'B) 6 '
+    assert stop_fn.truncate('B) 6\nQ: next') == 'B) 6'
+    stop_fn = get_stop_predicate({'stop_sequences': '.'})
+    assert stop_fn.truncate('B) 6. Because') == 'B) 6'
+
+    # answer: stop once the completion contains it, as a whole word
+    stop_fn = get_stop_predicate({'stop_answer_len': 'true'}, 'B) 6\n')
+    assert not stop_fn(' B)')
+    assert not stop_fn(' B) 6')
+    assert stop_fn(' B) 6 ')
+    assert not stop_fn(' A) 5 ')
+    assert stop_fn.truncate(' B) 6 since') == ' B) 6 since'
+    assert fuzzier_match('B) 6\n', ' B) 6 ') == True
+
+    # a one-letter answer after a preamble: not stopped by its length, 
+    # nor by words starting with the letter
+    stop_fn = get_stop_predicate({'stop_answer_len': 'true'}, 'B')
+    completion = ''
+    for chunk in ['Based', ' on the', ' passage,', ' the answer is', ' B', '.']:
+        assert not stop_fn(completion)
+        completion += chunk
+    assert stop_fn(completion)
+    assert completion == 'Based on the passage, the answer is B.'
+    assert fuzzier_match('B', completion) == True
+
+
 if __name__ == '__main__':
-    pass
\ No newline at end of file
+    pass
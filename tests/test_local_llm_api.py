@@ -1,9 +1,18 @@
 import os, sys, json, time
+from types import SimpleNamespace
+import numpy as np
 from unittest import mock
 
 from lime.common.inference.local_llama_cpp import (
     LocalModelObj,
+    LocalModelCache,
     wrap_prompt,
+    get_init_params,
+    get_cpu_count,
+    sample_logits,
+)
+from lime.common.inference.prefix_cache import (
+    PrefixCache,
 )
 
 def test_wrap_prompt():
@@ -13,3 +22,344 @@ def test_wrap_prompt():
     WRAPPED_PROMPT = f'''<s>[INST]{preamble} {prompt} [/INST]'''        
 
     assert wrap_prompt(sys_prompt=preamble, usr_prompt=prompt) == WRAPPED_PROMPT
+
+
+class FakeLlama:
+    '''
+        Stands in for llama_cpp.Llama: "samples" the bytes of a fixed 
+        completion, one token per byte, then eos (an id > 256 so an
+        identity check against it would fail).
+    '''
+    eos = 1000
+    def __init__(self, completion: str, n_ctx: int = 512) -> None:
+        self.out_ids = list(completion.encode('utf-8'))
+        self._n_ctx = n_ctx
+        self.n_tokens = 0
+        self.input_ids = []
+        self.n_evaluated = 0
+    def n_ctx(self) -> int:
+        return self._n_ctx
+    def tokenize(self, text: bytes) -> list:
+        return list(text)
+    def detokenize(self, tokens: list) -> bytes:
+        return bytes(tokens)
+    def token_eos(self) -> int:
+        return int(str(self.eos))   # a new int object each call
+    def eval(self, tokens: list) -> None:
+        self.input_ids[self.n_tokens:] = tokens
+        self.n_tokens += len(tokens)
+        self.n_evaluated += len(tokens)
+    def save_state(self) -> SimpleNamespace:
+        return SimpleNamespace(
+            input_ids=list(self.input_ids[:self.n_tokens]),
+            llama_state_size=10 * self.n_tokens,
+        )
+    def load_state(self, state: SimpleNamespace) -> None:
+        self.input_ids = list(state.input_ids)
+        self.n_tokens = len(state.input_ids)
+    def sample(self, **kwargs) -> int:
+        return self.out_ids.pop(0) if self.out_ids else int(str(self.eos))
+
+
+def test_eval_sample_piecewise():
+    '''multi-byte chars split across tokens are streamed and returned whole'''
+
+    completion = 'Paris, Île-de-France ✓'
+
+    model = LocalModelCache()
+    model.gen_params = {'max_tokens': 100, 'temperature': 0.0, 'seed': None}
+    model.llm = FakeLlama(completion)
+
+    pieces = []
+    output = model.eval_sample_piecewise('Q: capital? A:', progress_cb=pieces.append)
+
+    assert output.error is None
+    assert output.completion == completion
+    assert ''.join(pieces) == completion
+    assert '�' not in ''.join(pieces)
+
+    # max_tokens
+    model.gen_params['max_tokens'] = 5
+    model.llm = FakeLlama(completion)
+    output = model.eval_sample_piecewise('Q: capital? A:')
+    assert output.completion == 'Paris'
+
+    # bounded by the context left
+    model.gen_params['max_tokens'] = 100
+    model.llm = FakeLlama(completion, n_ctx=len('Q: capital? A: [/INST]') + 3)
+    output = model.eval_sample_piecewise('Q: capital? A:')
+    assert output.completion == 'Par'
+
+
+def test_prefix_cache():
+    '''longest cached prefix is matched, lru states evicted past max_bytes'''
+    prefix_cache = PrefixCache(max_bytes=100)
+    prefix_cache.insert([1, 2, 3], 'abc', 40)
+    prefix_cache.insert([1, 2, 3, 4, 5], 'abcde', 40)
+
+    assert prefix_cache.match([1, 2, 3, 4, 5, 6]) == (5, 'abcde')
+    assert prefix_cache.match([1, 2, 3, 9]) == (3, 'abc')
+    assert prefix_cache.match([1, 2]) == (0, None)
+
+    # [1, 2, 3] was used last, so [1, 2, 3, 4, 5] is evicted
+    prefix_cache.insert([7, 8], 'gh', 40)
+    assert len(prefix_cache) == 2
+    assert prefix_cache.match([1, 2, 3, 4, 5]) == (3, 'abc')
+    assert 4 not in prefix_cache.root.children[1].children[2].children[3].children
+
+
+def test_eval_tokens_reuse():
+    '''questions only evaluate what follows their longest cached prefix'''
+    model = LocalModelCache()
+    model.gen_params = {'max_tokens': 3, 'temperature': 0.0, 'seed': None}
+    model.llm = FakeLlama('abc' * 10)
+
+    sys_prompt = 'In the following, answer the multiple choice question. ' * 2
+    model.eval_prompt(sys_prompt, prompt_type='sys_prompt')
+    model.save_state()
+    n_sys = len(model.sys_tokens)
+    assert model.llm.n_evaluated == n_sys
+
+    stem = 'Which of these is the largest of the planets in the solar system?'
+    questions = [f'Q: {stem} {c} A:' for c in ['Jupiter', 'Mars', 'Venus']]
+    n_evaluated = []
+    for question in questions:
+        n0 = model.llm.n_evaluated
+        output = model.eval_sample_piecewise(question)
+        assert output.error is None
+        n_evaluated.append(model.llm.n_evaluated - n0)
+    
+    # 1st: the whole question (+ generated), after that the shared stem is cached
+    assert n_evaluated[0] >= len(questions[0])
+    # (the rest of the question, then generated tokens but the last)
+    assert n_evaluated[2] == len('Venus A: [/INST]') + 2
+    assert len(model.prefix_cache) >= 2
+
+    # after another prompt replaces the context, the sheet prompt is reloaded
+    model.eval_prompt('something else entirely', prompt_type='prompt')
+    n0 = model.llm.n_evaluated
+    model.eval_sample_piecewise(questions[0])
+    assert model.llm.input_ids[:n_sys] == model.sys_tokens
+    assert model.llm.n_evaluated - n0 < len(questions[0])
+
+
+def test_init_params():
+    '''init params: config defaults < profile < kwargs, threads from cpus'''
+    init_params = get_init_params()
+    assert init_params['n_ctx'] == 512
+    assert init_params['use_mmap'] is True
+    assert init_params['n_threads'] == max(1, get_cpu_count() // 2)
+    assert init_params['n_threads_batch'] == get_cpu_count()
+
+    init_params = get_init_params(
+        {'n_ctx': 4096, 'n_threads': 16, 'rag_style': 'basic'}, 
+        n_threads=8,
+    )
+    assert init_params['n_ctx'] == 4096
+    assert init_params['n_threads'] == 8
+    assert 'rag_style' not in init_params
+
+    # --jobs workers divide the cpus between them
+    with mock.patch('lime.common.inference.local_llama_cpp._n_procs', 4):
+        init_params = get_init_params()
+    assert init_params['n_threads_batch'] == max(1, get_cpu_count() // 4)
+    assert init_params['n_threads'] == max(1, get_cpu_count() // 4 // 2)
+
+
+def test_count_tokens_vocab_only():
+    '''counting tokens loads a vocab-only Llama (once), not the weights'''
+    loaded = []
+    class VocabLlama(FakeLlama):
+        def __init__(self, model_path: str, vocab_only: bool = False, **kwargs):
+            loaded.append((model_path, vocab_only))
+            super().__init__('')
+
+    with (
+        mock.patch('lime.common.inference.local_llama_cpp.Llama', VocabLlama, create=True),
+        mock.patch('lime.common.inference.local_llama_cpp.llama_log_set', create=True),
+        mock.patch('lime.common.inference.local_llama_cpp.get_model_fn', return_value='w.gguf'),
+    ):
+        model = LocalModelObj('my_llama')
+        assert model.count_tokens('four') == 4
+        assert model.count_tokens('four') == 4
+        assert model.count_tokens('fives') == 5
+        assert model.llm is None
+        
+        model_2 = LocalModelObj('my_llama')
+        assert model_2.count_tokens('six') == 3
+
+    assert loaded == [('w.gguf', True)]
+
+
+def test_check_valid_dry_run():
+    '''a dry run checks the model with its vocab, without the weights'''
+    loaded = []
+    class VocabLlama(FakeLlama):
+        def __init__(self, model_path: str, vocab_only: bool = False, **kwargs):
+            loaded.append((model_path, vocab_only))
+            super().__init__('')
+
+    with (
+        mock.patch('lime.common.inference.local_llama_cpp.Llama', VocabLlama, create=True),
+        mock.patch('lime.common.inference.local_llama_cpp.llama_log_set', create=True),
+        mock.patch('lime.common.inference.local_llama_cpp.get_model_fn', return_value='v.gguf'),
+    ):
+        model = LocalModelObj('my_llama')
+        assert model.check_valid(dry_run=True)
+        assert model.llm is None
+        assert loaded == [('v.gguf', True)]
+
+        assert model.check_valid()
+        assert model.llm is not None
+        assert loaded == [('v.gguf', True), ('v.gguf', False)]
+
+
+class FakeLlamaLib:
+    '''
+        Stands in for the low-level llama_cpp api over a FakeLlama ctx:
+        keeps each sequence's tokens, and a sequence's "logits" pick the
+        next char of its usr prompt, for up to 3 chars, then eos.
+    '''
+    def __init__(self, llm: FakeLlama, n_vocab: int = 1001) -> None:
+        self.llm = llm
+        self.n_vocab = n_vocab
+        self.kv = {}
+        self.logits = {}
+        self.n_decode = 0
+    def llama_kv_cache_seq_rm(self, ctx, seq_id, p0, p1):
+        for s in ([seq_id] if seq_id >= 0 else list(self.kv)):
+            if s in self.kv:
+                self.kv[s] = self.kv[s][:p0] if p0 > 0 else []
+    def llama_kv_cache_seq_cp(self, ctx, src, dst, p0, p1):
+        assert src == 0
+        self.kv[dst] = list(ctx.input_ids[p0:p1])
+    def llama_batch_init(self, n_tokens, embd, n_seq_max):
+        return SimpleNamespace(
+            n_tokens=0, token=[0] * n_tokens, pos=[0] * n_tokens,
+            n_seq_id=[0] * n_tokens, seq_id=[[0] for _ in range(n_tokens)],
+            logits=[False] * n_tokens,
+        )
+    def llama_batch_free(self, batch):
+        pass
+    def llama_decode(self, ctx, batch):
+        self.n_decode += 1
+        marker = list(b' [/INST]')
+        for k in range(batch.n_tokens):
+            seq_id = batch.seq_id[k][0]
+            assert batch.pos[k] == len(self.kv[seq_id])
+            self.kv[seq_id].append(batch.token[k])
+            if not batch.logits[k]:
+                continue
+            hist = self.kv[seq_id][len(self.llm.input_ids[:self.llm.n_tokens]):]
+            i_marker = [
+                i for i in range(len(hist)) if hist[i:i + len(marker)] == marker
+            ][0]
+            usr, gen = hist[:i_marker], hist[i_marker + len(marker):]
+            logits = np.zeros(self.n_vocab, dtype=np.float32)
+            logits[usr[len(gen)] if len(gen) < 3 else FakeLlama.eos] = 1.0
+            self.logits[k] = logits
+        return 0
+    def llama_get_logits_ith(self, ctx, i):
+        return np.ctypeslib.as_ctypes(self.logits[i])
+
+
+def test_eval_sample_batch():
+    '''questions decoded as parallel sequences after the sheet prompt'''
+    model = LocalModelCache()
+    model.llm = FakeLlama('', n_ctx=512)
+    model.llm.ctx = model.llm
+    model.llm.n_batch = 16
+    model.llm.n_vocab = lambda: 1001
+    
+    model.eval_prompt('Answer in 3 letters.', prompt_type='sys_prompt')
+    model.save_state()
+    
+    fake_lib = FakeLlamaLib(model.llm)
+    prompts = ['Jupiter', 'Mars', 'Venus', 'Io']
+    with mock.patch('lime.common.inference.local_llama_cpp.llama_cpp', fake_lib, create=True):
+        responses = model.eval_sample_batch(
+            [model.llm.tokenize(wrap_prompt(usr_prompt=p).encode()) for p in prompts],
+            [{'max_tokens': 10}] * 3 + [{'max_tokens': 2}],
+        )
+    
+    assert [r.completion for r in responses] == ['Jup', 'Mar', 'Ven', 'Io']
+    assert all(r.error is None for r in responses)
+    # prompts + generated tokens of all sequences share decode calls
+    n_tokens = sum(len(f'{p} [/INST]') for p in prompts) + 3 * 3 + 1
+    assert fake_lib.n_decode <= (n_tokens // 16) + 4
+    # sequences are removed from the kv cache, sheet prompt kept
+    assert all(len(fake_lib.kv[s]) == 0 for s in range(1, 5))
+    assert model.llm.n_tokens == len(model.sys_tokens)
+
+    # a sequence stops once its stop_fn is true of its text
+    with mock.patch('lime.common.inference.local_llama_cpp.llama_cpp', fake_lib, create=True):
+        responses = model.eval_sample_batch(
+            [model.llm.tokenize(wrap_prompt(usr_prompt=p).encode()) for p in prompts],
+            [{'max_tokens': 10}] * 4,
+            [None, lambda s: s.endswith('a'), None, lambda s: True],
+        )
+    assert [r.completion for r in responses] == ['Jup', 'Ma', 'Ven', 'I']
+
+
+def test_sample_logits():
+    '''llama's sampler chain: repeat penalty, then greedy or filtered'''
+    logits = np.array([2.0, 2.1, 0.5, -1.0, -3.0])
+    assert sample_logits(logits) == 1
+    # the last tokens are penalized: positive logits divided, negative ones
+    # multiplied, so they don't become likelier
+    assert sample_logits(logits, last_tokens=[1]) == 0
+    assert sample_logits(logits, last_tokens=[1], repeat_penalty=1.0) == 1
+    assert sample_logits(np.array([-1.0, -1.05]), last_tokens=[1]) == 0
+    assert sample_logits(np.array([-1.0, -1.05]), last_tokens=[0]) == 1
+
+    # top_k / min_p leave only the likeliest tokens to sample from
+    rng = np.random.default_rng(0)
+    draws = {
+        sample_logits(logits, temperature=1.0, top_k=2, rng=rng) 
+        for _ in range(50)
+    }
+    assert draws == {0, 1}
+    draws = {
+        sample_logits(logits, temperature=1.0, top_k=0, top_p=1.0, 
+                      min_p=0.2, rng=rng) 
+        for _ in range(50)
+    }
+    assert draws == {0, 1, 2}
+
+
+def test_n_seq_max():
+    '''n_seq_max is given to Llama if it takes it, and bounds a batch'''
+    kwargs_seen = []
+    class SeqLlama(FakeLlama):
+        def __init__(self, model_path: str, vocab_only: bool = False, 
+                     n_seq_max: int = 1, **kwargs):
+            kwargs_seen.append(n_seq_max)
+            super().__init__('')
+    class OldLlama(FakeLlama):
+        def __init__(self, model_path: str, vocab_only: bool = False, **kwargs):
+            kwargs_seen.append(kwargs)
+            super().__init__('')
+
+    with (
+        mock.patch('lime.common.inference.local_llama_cpp.llama_log_set', create=True),
+        mock.patch('lime.common.inference.local_llama_cpp.get_model_fn', return_value='s.gguf'),
+    ):
+        model = LocalModelObj('my_llama', n_seq_max=5)
+        assert model.init_params['n_seq_max'] == 5
+        with mock.patch('lime.common.inference.local_llama_cpp.Llama', SeqLlama, create=True):
+            model.init_llm()
+        with mock.patch('lime.common.inference.local_llama_cpp.Llama', OldLlama, create=True):
+            model.init_llm()
+        assert kwargs_seen[0] == 5
+        assert 'n_seq_max' not in kwargs_seen[1]
+    
+    # older llama.cpp doesn't bound sequence ids
+    with mock.patch('lime.common.inference.local_llama_cpp.llama_cpp', 
+                    SimpleNamespace(), create=True):
+        assert model.max_batch_seqs() is None
+    model.llm.ctx = model.llm
+    # the sheet prompt takes one of the context's sequences
+    fake_lib = SimpleNamespace(llama_n_seq_max=lambda ctx: 5)
+    with mock.patch('lime.common.inference.local_llama_cpp.llama_cpp', 
+                    fake_lib, create=True):
+        assert model.max_batch_seqs() == 4
@@ -0,0 +1,106 @@
+import os, sys
+import threading
+from unittest.mock import patch
+sys.path.append('.')
+from lime.common.inference.base import (
+    PromptModelResponse,
+)
+from lime.common.inference.model_server import (
+    ModelServer,
+    read_server_info,
+)
+from lime.common.inference.model_client import (
+    ServedModelObj,
+)
+from lime.common.inference.interface import (
+    get_infer_obj,
+)
+
+'''
+    Test the resident model server and its client, with the server
+    running in a thread and a stand-in for the LocalModelObj.
+'''
+
+class EchoModel:
+    '''records what the server asks of the model'''
+    def __init__(self) -> None:
+        self.model_fn = 'path/to/weights.gguf'
+        self.init_params = {'n_ctx': 512}
+        self.use_prompt_cache = False
+        self.sys_prompts = []
+    def check_valid(self) -> bool:
+        return True
+    def count_tokens(self, text: str) -> int:
+        return len(text.split())
+    def eval_prompt(self, prompt: str, prompt_type: str = 'prompt') -> None:
+        self.sys_prompts.append(prompt)
+    def save_state(self) -> None:
+        pass
+    def prompt_model(self, prompt_sys, prompt_usr, progress_cb=None, **kwargs):
+        for word in prompt_usr.split():
+            if progress_cb is not None:
+                progress_cb(word)
+        return PromptModelResponse(
+            f'{prompt_sys}|{prompt_usr}|{kwargs.get("max_tokens")}', None
+        )
+
+
+def start_server(model_name: str, server_dir: str) -> ModelServer:
+    server = ModelServer(model_name, infer_obj=EchoModel(), server_dir=server_dir)
+    server.start()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_model_server(tmp_path):
+    '''requests, streaming, and the sheet prompt is evaluated once'''
+    server = start_server('my_llama', str(tmp_path))
+    try:
+        server_info = read_server_info('my_llama', str(tmp_path))
+        assert server_info['pid'] == os.getpid()
+        assert read_server_info('other_llama', str(tmp_path)) is None
+
+        infer_obj = ServedModelObj('my_llama', server_info=server_info)
+        assert infer_obj.check_valid()
+        assert infer_obj.count_tokens('one two three') == 3
+        assert infer_obj.cache_key_data('a', 'b')['model_fn'] == 'path/to/weights.gguf'
+
+        pieces = []
+        completion, error = infer_obj.prompt_model(
+            'sys', 'hello there', progress_cb=pieces.append, max_tokens=7
+        )
+        assert error is None
+        assert completion == 'sys|hello there|7'
+        assert pieces == ['hello', 'there']
+
+        # with the prompt cache, the server evaluates each sheet prompt once
+        infer_obj.use_prompt_cache = True
+        infer_obj.init_llm()
+        infer_obj.eval_prompt('sheet prompt', prompt_type='sys_prompt')
+        infer_obj.save_state()
+        for _ in range(3):
+            completion, error = infer_obj.prompt_model('sheet prompt', 'q', max_tokens=5)
+            assert completion == 'None|q|5'
+        assert server.infer_obj.sys_prompts == ['sheet prompt']
+
+        # a second client shares the resident model
+        infer_obj_2 = ServedModelObj('my_llama', server_info=server_info)
+        assert infer_obj_2.count_tokens('a b') == 2
+    finally:
+        server.close()
+    assert read_server_info('my_llama', str(tmp_path)) is None
+
+
+def test_get_infer_obj_served(tmp_path):
+    '''a local model with a running server is prompted through it'''
+    server = start_server('my_llama', str(tmp_path))
+    try:
+        with patch(
+            'lime.common.inference.model_server.ModelServerParams.server_dir',
+            str(tmp_path),
+        ):
+            infer_obj = get_infer_obj('my_llama')
+            assert isinstance(infer_obj, ServedModelObj)
+            assert not(isinstance(get_infer_obj('gpt-3.5-turbo'), ServedModelObj))
+    finally:
+        server.close()
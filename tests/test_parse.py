@@ -1,11 +1,16 @@
 import os, sys
 import pytest
+from unittest.mock import patch
 from lime.common.models.internal import (
     SheetSchema,
     QuestionSchema,
 )
 from lime.common.controllers.parse import (
     parse_to_obj,
+    parse_wrapper,
+    iter_sheet_questions,
+    get_md_schema,
+    parse_sheets,
 )
 
 def test_parse_to_obj_1():
@@ -105,3 +110,87 @@ def test_meta_cascade_1():
 
     obj.questions[1].meta.get('answer_suggested_length') == '10'  # should be set from sheet-level meta
     obj.questions[0].meta.get('answer_suggested_length') == '15'  # should be overridden by question-level meta
+
+def test_parse_stream_1():
+    '''
+        the single pass parser gives the same sheet as the (deprecated)
+        parse_markdown -> from_mddoc path, and streams its questions
+    '''
+    input_schema = './lime/data/md-schema.yaml'
+    for input_md in [
+        './tests/data/input-one.md',
+        './tests/data/input-two.md',
+        './tests/data/input-four.md',
+        './tests/data/input-five.md',
+        './tests/data/model_cfg/input-mix-params.md',
+    ]:
+        obj = parse_to_obj(input_md, input_schema)
+        md_doc = parse_wrapper(input_md, input_schema)
+        obj_mddoc = SheetSchema.from_mddoc(md_doc)
+        obj_mddoc.sheet_fn = obj.sheet_fn
+        assert obj == obj_mddoc
+
+        questions = iter_sheet_questions(input_md, input_schema)
+        assert next(questions) == obj.questions[0]
+        assert list(questions) == obj.questions[1:]
+
+def test_parse_dup_names_1(tmp_path):
+    '''
+        duplicate names get suffixes which don't collide with each other
+        or with names in the sheet, from both parsers
+    '''
+    input_md = str(tmp_path / 'input-dups.md')
+    names = ['Q', 'Q', 'Q_1', 'Q', 'R', 'Q_1']
+    with open(input_md, 'w') as f:
+        f.write('# Sheet-Dups\n')
+        for name in names:
+            f.write(f'## {name}\n#### question\nwhat?\n')
+    input_schema = './lime/data/md-schema.yaml'
+
+    obj = parse_to_obj(input_md, input_schema)
+    obj_mddoc = SheetSchema.from_mddoc(parse_wrapper(input_md, input_schema))
+    
+    for sheet in (obj, obj_mddoc):
+        q_names = [q.name for q in sheet.questions]
+        assert q_names == ['Q', 'Q_1', 'Q_1_1', 'Q_2', 'R', 'Q_1_2']
+        assert len(set(q_names)) == len(names)
+        assert sheet.questions[0].parse_warns == []
+        assert sheet.questions[3].parse_warns == ['question name `Q` is not unique']
+
+
+def test_parse_sheets_1(tmp_path):
+    '''
+        sheets parsed up front in a process pool come back in order,
+        with the errors of sheets which failed instead of raising
+    '''
+    input_mds = [
+        './tests/data/input-one.md',
+        './tests/data/input-four.md',
+        str(tmp_path / 'input-missing.md'),
+        './tests/data/input-five.md',
+    ]
+    expected = [
+        parse_to_obj(fn) if os.path.exists(fn) else None
+        for fn in input_mds
+    ]
+    for jobs in [1, 2]:
+        with patch('lime.common.controllers.parse.MIN_SHEETS_PER_PARSE_JOB', 1):
+            sheet_objs, errors = parse_sheets(input_mds, jobs=jobs)
+        assert sheet_objs == expected
+        assert list(errors.keys()) == [input_mds[2]]
+        assert errors[input_mds[2]].startswith('FileNotFoundError')
+
+def test_md_schema_cached_1():
+    '''the md-schema is loaded and compiled once, not per sheet'''
+    input_schema = './lime/data/md-schema.yaml'
+    md_schema = get_md_schema(input_schema)
+    assert md_schema is get_md_schema()
+    assert md_schema.major == {1: 'sheet', 2: 'question'}
+    assert md_schema.minor['question'][0] == 4
+    assert 'answer' in md_schema.minor['question'][1]
+    assert 'answer' not in md_schema.minor['sheet'][1]
+
+    with patch('lime.common.controllers.parse.yaml.safe_load') as mock_load:
+        parse_to_obj('./tests/data/input-one.md', input_schema)
+        parse_to_obj('./tests/data/input-two.md')
+        assert mock_load.call_count == 0
@@ -0,0 +1,147 @@
+import os, sys
+import asyncio
+from unittest.mock import patch
+import httpx
+import openai
+sys.path.append('.')
+from lime.common.inference.base import (
+    PromptModelResponse,
+)
+from lime.common.inference.api_openai import (
+    OpenAIModelObj,
+)
+from lime.common.inference.ratelimit import (
+    TokenBucket,
+    RateLimiter,
+    get_rate_limiter,
+)
+
+'''
+    Test the client-side rate limiter; time.sleep / asyncio.sleep are
+    patched so the delays are recorded instead of waited.
+'''
+
+p_sleep = 'lime.common.inference.ratelimit.time.sleep'
+
+def rate_limit_error(headers: dict = {}) -> openai.RateLimitError:
+    request = httpx.Request('POST', 'https://api.openai.com/v1/chat/completions')
+    response = httpx.Response(429, headers=headers, request=request)
+    return openai.RateLimitError('rate limited', response=response, body=None)
+
+
+def test_token_bucket():
+    '''capacity is available at once, past that callers wait for the refill'''
+    bucket = TokenBucket(60)    # 1 per second
+    delays = [bucket.reserve(1) for _ in range(62)]
+    assert delays[:60] == [0.0] * 60
+    assert 0.9 < delays[60] <= 1.0
+    assert 1.9 < delays[61] <= 2.0
+
+    # tokens-per-minute: a big reservation waits on the refill
+    bucket = TokenBucket(1000)
+    assert bucket.reserve(800) == 0.0
+    assert 35 < bucket.reserve(800) <= 36
+
+
+def test_retry_after():
+    '''429s are retried after the Retry-After, other errors are returned'''
+    rate_limiter = RateLimiter(max_retries=3)
+    responses = [
+        PromptModelResponse(None, rate_limit_error({'retry-after': '7'})),
+        PromptModelResponse(None, rate_limit_error()),
+        PromptModelResponse('ok', None),
+    ]
+    with patch(p_sleep) as mock_sleep:
+        response = rate_limiter.call(lambda: responses.pop(0))
+    assert response.completion == 'ok'
+    delays = [c.args[0] for c in mock_sleep.call_args_list]
+    assert len(delays) == 2
+    assert 7 <= delays[0] <= 8
+    assert 0 <= delays[1] <= 2      # jittered backoff of attempt 1
+
+    # not retryable
+    calls = []
+    def prompt_fn():
+        calls.append(1)
+        return PromptModelResponse(None, ValueError('bad request'))
+    with patch(p_sleep) as mock_sleep:
+        response = rate_limiter.call(prompt_fn)
+    assert isinstance(response.error, ValueError)
+    assert len(calls) == 1
+
+    # retries exhausted
+    calls = []
+    def prompt_fn():
+        calls.append(1)
+        return PromptModelResponse(None, rate_limit_error())
+    with patch(p_sleep):
+        response = rate_limiter.call(prompt_fn)
+    assert isinstance(response.error, openai.RateLimitError)
+    assert len(calls) == 4
+
+
+def test_openai_rate_limited():
+    '''OpenAIModelObj retries a 429 in both prompt_model and aprompt_model'''
+    infer_obj = OpenAIModelObj('gpt-3.5-turbo', rpm=120, tpm=10000)
+    assert infer_obj.rate_limiter.rpm_bucket.capacity == 120
+    assert infer_obj.rate_limiter is get_rate_limiter(
+        'gpt-3.5-turbo', rpm=120, tpm=10000
+    )
+    assert infer_obj.limit_ntokens('abc', max_tokens=10) >= 10
+
+    p_create = 'lime.common.inference.api_openai.OpenAIModelObj._create_completion'
+    with (
+        patch(p_create, side_effect=[
+            PromptModelResponse(None, rate_limit_error({'retry-after-ms': '50'})),
+            PromptModelResponse('C', None),
+        ]) as mock_create,
+        patch(p_sleep),
+    ):
+        completion, error = infer_obj.prompt_model('', 'hello')
+    assert (completion, error) == ('C', None)
+    assert mock_create.call_count == 2
+
+    # without rpm / tpm buckets, only the retry backs off
+    infer_obj = OpenAIModelObj('gpt-3.5-turbo')
+    assert infer_obj.rate_limiter.rpm_bucket is None
+    responses = [
+        PromptModelResponse(None, rate_limit_error()),
+        PromptModelResponse('C', None),
+    ]
+    async def mock_acreate(request, progress_cb=None):
+        return responses.pop(0)
+    p_acreate = 'lime.common.inference.api_openai.OpenAIModelObj._acreate_completion'
+    with (
+        patch(p_acreate, side_effect=mock_acreate),
+        patch('lime.common.inference.ratelimit.asyncio.sleep') as mock_asleep,
+    ):
+        completion, error = asyncio.run(infer_obj.aprompt_model('', 'hello'))
+    assert (completion, error) == ('C', None)
+    assert mock_asleep.call_count == 1
+
+
+def test_retry_resets_timer():
+    '''a retried prompt's progress_cb starts over: no text or chunks kept'''
+    from lime.commands.eval import PromptTimer
+    infer_obj = OpenAIModelObj('gpt-3.5-turbo')
+    streamed = [
+        (['par', 'tial'], PromptModelResponse(None, rate_limit_error())),
+        (['B'], PromptModelResponse('B', None)),
+    ]
+    def mock_create(request, progress_cb=None):
+        chunks, response = streamed.pop(0)
+        for chunk in chunks:
+            progress_cb(chunk)
+        return response
+    p_create = 'lime.common.inference.api_openai.OpenAIModelObj._create_completion'
+    with (
+        patch(p_create, side_effect=mock_create),
+        patch(p_sleep),
+        patch('lime.commands.eval.time.time', side_effect=[0.0, 1.0, 10.0, 10.5]),
+    ):
+        timer = PromptTimer(stop_fn=lambda text: False)
+        completion, error = infer_obj.prompt_model('', 'hello', progress_cb=timer)
+    assert (completion, error) == ('B', None)
+    assert timer.text == 'B'
+    assert timer.n_chunks == 1
+    assert timer.ttft() == 0.5